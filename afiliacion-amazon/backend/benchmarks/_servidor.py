@@ -0,0 +1,46 @@
+"""Utilidades comunes de los benchmarks: cargar servicios y levantar stubs HTTP."""
+import importlib.util
+import os
+import socket
+import threading
+import time
+
+import uvicorn
+
+MICROSERVICIOS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'microservicios'))
+
+
+def cargar_servicio(nombre: str, modulo: str):
+    """Importa microservicios/<nombre>/main.py como módulo independiente."""
+    path = os.path.join(MICROSERVICIOS, nombre, 'main.py')
+    spec = importlib.util.spec_from_file_location(modulo, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)  # type: ignore
+    return mod
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ServidorEnHilo:
+    """Sirve una app ASGI con uvicorn en un hilo aparte (conexiones TCP reales)."""
+
+    def __init__(self, app, port: int = 0):
+        self.port = port or _puerto_libre()
+        self.url = f"http://127.0.0.1:{self.port}"
+        config = uvicorn.Config(app, host='127.0.0.1', port=self.port, log_level='warning', access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
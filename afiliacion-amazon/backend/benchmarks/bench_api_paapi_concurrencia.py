@@ -0,0 +1,80 @@
+"""Benchmark: solapamiento de peticiones /buscar concurrentes en api-paapi.
+
+Usa un AmazonApi de pega cuyo search_items duerme PAAPI_DELAY segundos (como un
+round-trip real a Amazon) y lanza N peticiones /buscar a la vez. Con el tope de
+concurrencia a 1 las llamadas se serializan; con el tope a N deben solaparse y
+el tiempo total acercarse al de una sola llamada. También mide la latencia de
+/health mientras hay llamadas a PAAPI en curso.
+
+Uso:
+    python benchmarks/bench_api_paapi_concurrencia.py [N] [PAAPI_DELAY]
+"""
+import asyncio
+import sys
+import time
+import types
+
+import httpx
+
+from _servidor import cargar_servicio
+
+api_module = cargar_servicio('api-paapi', 'api_paapi_main')
+
+
+def _stub_amazon_api(delay: float):
+    def search_items(**kwargs):
+        time.sleep(delay)
+        page = kwargs.get("item_page", 1)
+        items = [
+            types.SimpleNamespace(
+                asin=f"P{page}I{i}",
+                detail_page_url=f"https://www.amazon.es/dp/P{page}I{i}",
+                title=f"Producto {page}-{i}",
+            )
+            for i in range(kwargs.get("item_count", 10))
+        ]
+        return types.SimpleNamespace(items=items)
+    return types.SimpleNamespace(search_items=search_items)
+
+
+async def _run(n: int, delay: float, max_concurrency: int):
+    api_module.paapi_executor = api_module.PaapiExecutor(max_concurrency)
+    # Aislar el pool de hilos: sin límite de cuota ni caché de resultados
+    api_module.paapi_scheduler = api_module.TokenBucketScheduler(tps=1000, burst=n)
+    api_module.search_cache.clear()
+    api_module.amazon_api = _stub_amazon_api(delay)
+    transport = httpx.ASGITransport(app=api_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def buscar(i):
+            r = await client.get("/buscar", params={"busqueda": f"kw{i}", "pagina": 1 + i % 10})
+            assert r.status_code == 200, r.text
+            return r
+
+        async def health_latency():
+            await asyncio.sleep(delay / 4)
+            t = time.perf_counter()
+            r = await client.get("/health")
+            assert r.status_code == 200
+            return time.perf_counter() - t
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(health_latency(), *(buscar(i) for i in range(n)))
+        elapsed = time.perf_counter() - t0
+    api_module.paapi_executor.shutdown()
+    return elapsed, results[0]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.25
+    print(f"N={n} peticiones /buscar concurrentes, PAAPI simulado={delay * 1000:.0f} ms")
+    for cap in (1, n):
+        elapsed, health = asyncio.run(_run(n, delay, cap))
+        print(
+            f"  max_concurrency={cap:>3}: total={elapsed * 1000:8.1f} ms "
+            f"(serie teórica {n * delay * 1000:.0f} ms) | /health en vuelo={health * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Microbenchmark: coste por item de la extracción de campos de PAAPI.
+
+Construye SearchResult sintéticos de 10 y 50 items con la estructura completa
+de ofertas (listing con precio y ahorro, summaries, imágenes, título) y mide el
+tiempo medio de _extraer_producto por item, además de la búsqueda completa
+(_to_list + extracción) por respuesta.
+
+Uso:
+    python benchmarks/bench_api_paapi_extraccion.py [repeticiones]
+"""
+import sys
+import time
+from types import SimpleNamespace as NS
+
+from _servidor import cargar_servicio
+
+api_module = cargar_servicio('api-paapi', 'api_paapi_main')
+
+
+def _item(i: int):
+    amount = 20.0 + i
+    con_ahorro = i % 2 == 0
+    savings = NS(amount=5.0, percentage=20, display_amount="5,00 €") if con_ahorro else None
+    price = NS(amount=amount, currency="EUR", display_amount=None if i % 3 else f"{amount:.2f} €", savings=savings)
+    return NS(
+        asin=f"B0{i:08d}",
+        detail_page_url=f"https://www.amazon.es/dp/B0{i:08d}",
+        offers=NS(
+            listings=[NS(price=price)],
+            summaries=[NS(lowest_price=NS(amount=amount, currency="EUR", display_amount=None, savings=savings))],
+        ),
+        list_price=NS(amount=amount + 5, currency="EUR") if con_ahorro else None,
+        item_info=NS(title=NS(display_value=f"  Aspiradora sin cable modelo {i}  "), product_title=None),
+        images=NS(primary=NS(large=None, medium=NS(url=f"https://m.media-amazon.com/{i}.jpg"), small=None)),
+        brand="Marca" if i % 4 else None,
+        manufacturer="Fabricante",
+    )
+
+
+def _bench(n_items: int, reps: int):
+    result = NS(items=[_item(i) for i in range(n_items)])
+    extraer = api_module._extraer_producto
+    to_list = api_module._to_list
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        [extraer(it) for it in to_list(result)]
+    total = time.perf_counter() - t0
+    return total / (reps * n_items), total / reps
+
+
+def main():
+    reps = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for n in (10, 50):
+        por_item, por_respuesta = _bench(n, max(1, reps * 10 // n))
+        print(f"SearchResult de {n:>2} items: {por_item * 1e6:7.2f} µs/item | {por_respuesta * 1e3:7.3f} ms/respuesta")
+
+
+if __name__ == "__main__":
+    main()
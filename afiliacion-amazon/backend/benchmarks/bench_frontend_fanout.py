@@ -0,0 +1,52 @@
+"""Benchmark: latencia de buscar_productos de frontend-api en serie vs en paralelo.
+
+Levanta un api-paapi de pega que tarda DELAY segundos por página y mide cuánto
+tarda buscar_productos en reunir TOTAL productos con FRONTEND_PAAPI_FANOUT=1
+(equivalente al recorrido en serie) y con varias páginas en paralelo.
+
+Uso:
+    python benchmarks/bench_frontend_fanout.py [TOTAL] [DELAY]
+"""
+import asyncio
+import sys
+import time
+
+from fastapi import FastAPI
+
+from _servidor import ServidorEnHilo, cargar_servicio
+
+fe_module = cargar_servicio('frontend-api', 'frontend_api_main')
+
+
+def _stub_paapi(delay: float) -> FastAPI:
+    stub = FastAPI()
+
+    @stub.get("/buscar")
+    async def buscar(busqueda: str, num_resultados: int = 10, pagina: int = 1):
+        await asyncio.sleep(delay)
+        base = (pagina - 1) * num_resultados
+        return [
+            {"asin": f"B{base + i:09d}", "titulo": f"{busqueda} {base + i}", "url_producto": "https://www.amazon.es/dp/x",
+             "url_afiliado": "https://www.amazon.es/dp/x?tag=t", "precio": "10,00 €", "precio_amount": 10.0}
+            for i in range(num_resultados)
+        ]
+
+    return stub
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    with ServidorEnHilo(_stub_paapi(delay)) as srv:
+        fe_module.API_PAAPI_URL = srv.url
+        print(f"buscar_productos(total={total}) con api-paapi simulado a {delay * 1000:.0f} ms/página")
+        for fanout in (1, 2, 5):
+            fe_module.PAAPI_FANOUT = fanout
+            t0 = time.perf_counter()
+            productos = asyncio.run(fe_module.buscar_productos("auriculares", "All", total))
+            dt = time.perf_counter() - t0
+            print(f"  fanout={fanout}: {dt * 1000:8.1f} ms ({len(productos)} productos)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Microbenchmark: filtro de títulos por palabra clave principal en frontend-api.
+
+Compara el filtro anterior (re.split + _stem_es de la clave y del título en
+cada producto) con KeywordMatcher sobre N títulos sintéticos (10k por defecto):
+una pasada en frío, con títulos nunca vistos, y otra en caliente, con los
+mismos títulos otra vez (productos que reaparecen entre búsquedas).
+
+Uso:
+    python benchmarks/bench_frontend_match.py [N]
+"""
+import random
+import re
+import sys
+import time
+
+from _servidor import cargar_servicio
+
+fe_module = cargar_servicio('frontend-api', 'frontend_api_main')
+
+PALABRAS = [
+    "Aspiradora", "aspiradoras", "sin", "cable", "Robot", "aspirador", "con", "mopa", "Auriculares",
+    "inalámbricos", "Bluetooth", "5.3", "cancelación", "ruido", "Jabón", "orgánico", "natural", "pack",
+    "de", "3", "unidades", "Cafetera", "espresso", "automática", "Teléfono", "móvil", "128GB", "negro",
+    "Zapatillas", "running", "hombre", "mujer", "Freidora", "aire", "5,5L", "digital", "XXL",
+]
+
+
+def _titulos(n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choice(PALABRAS) for _ in range(rnd.randint(8, 18))) + f" modelo {i}" for i in range(n)]
+
+
+def _match_anterior(main_kw: str, titulo: str) -> bool:
+    main_kw = main_kw.strip().lower()
+    t = (titulo or '').lower()
+    kw_tokens = [tok for tok in re.split(r"\W+", main_kw) if tok]
+    title_tokens = [tok for tok in re.split(r"\W+", t) if tok]
+    stem_kw = {fe_module._stem_es(tok) for tok in kw_tokens}
+    stem_title = {fe_module._stem_es(tok) for tok in title_tokens}
+    return bool(stem_kw & stem_title)
+
+
+def _medir(fn, titulos):
+    t0 = time.perf_counter()
+    coincidencias = sum(1 for t in titulos if fn(t))
+    return time.perf_counter() - t0, coincidencias
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    titulos = _titulos(n)
+    keyword = "auriculares inalambricos"
+    print(f"{n} títulos, palabra clave {keyword!r}")
+
+    t, c = _medir(lambda titulo: _match_anterior(keyword, titulo), titulos)
+    print(f"  anterior          : {n / t:12,.0f} títulos/s ({c} coinciden)")
+
+    fe_module._stems_titulo.cache_clear()
+    fe_module._raiz.cache_clear()
+    for pasada in ("frío", "caliente"):
+        matcher = fe_module.KeywordMatcher(keyword)
+        t, c = _medir(matcher.match, titulos)
+        print(f"  KeywordMatcher {pasada:<8}: {n / t:12,.0f} títulos/s ({c} coinciden)")
+
+
+if __name__ == "__main__":
+    main()
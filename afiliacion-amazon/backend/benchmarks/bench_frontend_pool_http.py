@@ -0,0 +1,77 @@
+"""Benchmark: cliente HTTP por llamada vs cliente compartido con keep-alive.
+
+Simula las llamadas upstream de un lote de frontend-api (5 páginas de
+api-paapi y 10 artículos del generador) contra stubs locales sin latencia
+propia, de modo que lo medido es el coste de crear cliente, conexión TCP y
+cierre en cada llamada. Con TLS real (Railway) la diferencia es mayor.
+
+Uso:
+    python benchmarks/bench_frontend_pool_http.py [LOTES]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from _servidor import ServidorEnHilo, cargar_servicio
+
+fe_module = cargar_servicio('frontend-api', 'frontend_api_main')
+
+
+def _stub() -> FastAPI:
+    stub = FastAPI()
+
+    @stub.get("/buscar")
+    async def buscar(pagina: int = 1, num_resultados: int = 10):
+        return [{"asin": f"{pagina}-{i}", "titulo": "t", "url_producto": "u", "url_afiliado": "u"}
+                for i in range(num_resultados)]
+
+    @stub.post("/generar-articulo")
+    async def generar():
+        return {"titulo": "t", "subtitulo": "s", "articulo": "<p>x</p>"}
+
+    return stub
+
+
+async def _lote_cliente_por_llamada(url: str):
+    # Patrón anterior: un httpx.AsyncClient nuevo en cada llamada
+    for pagina in range(1, 6):
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            await client.get(f"{url}/buscar", params={"busqueda": "x", "pagina": pagina})
+    for _ in range(10):
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            await client.post(f"{url}/generar-articulo", json={})
+
+
+async def _lote_cliente_compartido(url: str):
+    for pagina in range(1, 6):
+        await fe_module.get_http_client("paapi").get(f"{url}/buscar", params={"busqueda": "x", "pagina": pagina})
+    for _ in range(10):
+        await fe_module.get_http_client("generador").post(f"{url}/generar-articulo", json={})
+
+
+async def _medir(fn, url: str, lotes: int):
+    tiempos = []
+    for _ in range(lotes):
+        t0 = time.perf_counter()
+        await fn(url)
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos)
+
+
+async def _main(lotes: int):
+    with ServidorEnHilo(_stub()) as srv:
+        await _medir(_lote_cliente_compartido, srv.url, 1)  # calentar conexiones
+        antes = await _medir(_lote_cliente_por_llamada, srv.url, lotes)
+        despues = await _medir(_lote_cliente_compartido, srv.url, lotes)
+        await fe_module._cerrar_clientes_http()
+    print(f"Lote de 15 llamadas upstream (mediana de {lotes} lotes)")
+    print(f"  cliente por llamada: {antes * 1000:7.1f} ms/lote")
+    print(f"  cliente compartido : {despues * 1000:7.1f} ms/lote  (ahorro {(antes - despues) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
@@ -0,0 +1,81 @@
+"""Microbenchmark: selección de productos de un lote en frontend-api.
+
+Compara la cadena anterior (ordenar por precio, filtrar descuentos, fallback
+de Black Friday, filtrar por palabra clave, recortar) con rankear_productos
+(una pasada con puntuación; ordenación directa si entran todos, como en
+seleccionar_grupos, o selección top-k en heap), para listas de 50 productos
+(lo que pide un lote a api-paapi) y de 10k. Cada medida es el mínimo de
+varias rondas, para quitar ruido.
+
+rankear_productos hace más trabajo que la cadena (puntuación y variedad de
+marcas), así que es algo más lento: en 50 productos la diferencia es de
+centésimas de milisegundo. Este benchmark mide ese coste; no es una mejora de
+rendimiento sino de calidad del ranking.
+
+Uso:
+    python benchmarks/bench_frontend_ranking.py [repeticiones]
+"""
+import random
+import sys
+import time
+
+from _servidor import cargar_servicio
+
+fe_module = cargar_servicio('frontend-api', 'frontend_api_main')
+
+MARCAS = ["Sony", "JBL", "Xiaomi", "Bose", "Anker", None]
+
+
+def _productos(n: int, seed: int = 3):
+    rnd = random.Random(seed)
+    productos = []
+    for i in range(n):
+        pct = rnd.choice([None, None, 5.0, 15.0, 30.0, 55.0])
+        productos.append(fe_module.Producto(
+            titulo=f"Auriculares {'inalámbricos' if i % 3 else 'con cable'} modelo {i}",
+            url_producto="u", url_afiliado="u", asin=f"B{i:09d}", marca=rnd.choice(MARCAS),
+            precio_amount=None if i % 7 == 0 else 20.0 + i % 40, ahorro_pct=pct, tiene_descuento=bool(pct),
+        ))
+    return productos
+
+
+def _cadena_anterior(productos, main_kw, max_total, black_friday):
+    productos = sorted(productos, key=lambda p: (not fe_module._has_precio(p)))
+    con_desc = [p for p in productos if fe_module._descuento(p) is not None]
+    if con_desc:
+        productos = con_desc
+    elif black_friday:
+        productos = [p for p in productos if fe_module._has_precio(p)]
+    else:
+        productos = []
+    matcher = fe_module.KeywordMatcher(main_kw)
+    if matcher:
+        productos = [p for p in productos if matcher.match(p.titulo)]
+    return productos[:max_total]
+
+
+def _medir(fn, reps, rondas=5):
+    mejor = float("inf")
+    for _ in range(rondas):
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor / reps
+
+
+def main():
+    reps = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    keyword = "auriculares inalambricos"
+    for n, max_total in ((50, 50), (50, 25), (10_000, 10_000), (10_000, 50)):
+        productos = _productos(n)
+        r = max(1, reps * 50 // n)
+        antes = _medir(lambda: _cadena_anterior(productos, keyword, max_total, False), r)
+        matcher = fe_module.KeywordMatcher(keyword)
+        ahora = _medir(lambda: fe_module.rankear_productos(productos, matcher, max_total, False), r)
+        print(f"{n:>6} productos, top {max_total:>6}: cadena anterior {antes * 1e3:8.3f} ms | "
+              f"rankear_productos {ahora * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark: completions simultáneas en un único worker de generador-contenido.
+
+Levanta un servidor compatible con la API de OpenAI que tarda DELAY segundos
+por completion y sirve generador-contenido con uvicorn (un solo proceso).
+Lanza N peticiones /generar-articulo a la vez con OPENAI_MAX_CONCURRENCY=1
+(equivalente al cliente bloqueante anterior: una completion por worker) y con
+el tope a N, y mide el tiempo total y la latencia de /health mientras tanto.
+
+Uso:
+    python benchmarks/bench_generador_concurrencia.py [N] [DELAY]
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from _servidor import ServidorEnHilo, cargar_servicio
+
+XML = (
+    "<articulo><titular>Titular</titular><subtitulo>Sub</subtitulo><intro><p>Intro</p></intro>"
+    "<items><item id=\"1\"><nombre>Producto</nombre><texto><p>Texto</p></texto></item></items>"
+    "<cierre><p>Cierre</p></cierre></articulo>"
+)
+
+
+def _stub_openai(delay: float) -> FastAPI:
+    stub = FastAPI()
+
+    @stub.post("/v1/chat/completions")
+    async def completions():
+        await asyncio.sleep(delay)
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": XML}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    return stub
+
+
+async def _lote(url: str, n: int, delay: float):
+    payload = {"tema": "Auriculares", "productos": [
+        {"titulo": "Producto", "url_producto": "https://www.amazon.es/dp/B000000001"}]}
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        async def generar():
+            r = await client.post("/generar-articulo", json=payload)
+            assert r.status_code == 200, r.text
+
+        async def health():
+            await asyncio.sleep(delay / 4)
+            t = time.perf_counter()
+            assert (await client.get("/health")).status_code == 200
+            return time.perf_counter() - t
+
+        t0 = time.perf_counter()
+        resultados = await asyncio.gather(health(), *(generar() for _ in range(n)))
+        return time.perf_counter() - t0, resultados[0]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    with ServidorEnHilo(_stub_openai(delay)) as openai_srv:
+        os.environ["OPENAI_BASE_URL"] = f"{openai_srv.url}/v1"
+        os.environ["OPENAI_API_KEY"] = "sk-bench"
+        gen_module = cargar_servicio('generador-contenido', 'generador_contenido_main')
+        print(f"N={n} /generar-articulo simultáneos, OpenAI simulado={delay * 1000:.0f} ms")
+        for tope in (1, n):
+            gen_module.OPENAI_MAX_CONCURRENCY = tope
+            gen_module._openai = None
+            with ServidorEnHilo(gen_module.app) as gen_srv:
+                total, health = asyncio.run(_lote(gen_srv.url, n, delay))
+            print(f"  OPENAI_MAX_CONCURRENCY={tope:>3}: total={total * 1000:8.1f} ms "
+                  f"(serie teórica {n * delay * 1000:.0f} ms) | /health={health * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
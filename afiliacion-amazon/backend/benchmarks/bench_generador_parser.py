@@ -0,0 +1,117 @@
+"""Microbenchmark: parseo de la salida del modelo en generador-contenido.
+
+Compara la cadena anterior de /generar-articulo (normalize_model_html, un
+re.search por etiqueta, búsqueda de <items> y finditer de items, dos
+extract_tag y el re.sub del botón por item y el re.sub de enlaces sobre todo
+el HTML) con parsear_salida + MontajeArticulo (una pasada), sobre salidas
+sintéticas con la forma de las completions reales de 3, 10 y 50 productos y
+sobre salidas patológicas: items sin </item>, <intro> sin cerrar y salida
+cortada. También mide el parser alimentado a deltas de 16 caracteres, como
+en /generar-articulo/stream.
+
+Uso:
+    python benchmarks/bench_generador_parser.py [repeticiones]
+"""
+import re
+import sys
+import time
+
+from _servidor import cargar_servicio
+
+gen_module = cargar_servicio('generador-contenido', 'generador_contenido_main')
+
+PARRAFO = ("<p>Un modelo <b>equilibrado</b> para el día a día, con buena autonomía y un sonido "
+           "cuidado; <a href=\"https://www.amazon.es/dp/B0\">ver ficha</a> antes de decidir.</p>")
+
+
+def _salida(n: int, cerrar_items: bool = True, cerrar_intro: bool = True, cortar: bool = False) -> str:
+    partes = ["<articulo><titular>Los mejores productos</titular><subtitulo>Guía</subtitulo>",
+              "<intro>" + PARRAFO * 2 + ("</intro>" if cerrar_intro else ""), "<items>"]
+    for i in range(1, n + 1):
+        partes.append(f'<item id="{i}"><nombre>Producto {i}</nombre><texto>{PARRAFO * 3}</texto>'
+                      + ("</item>" if cerrar_items else ""))
+    partes.append("</items><cierre>" + PARRAFO + "</cierre></articulo>")
+    salida = "".join(partes)
+    return salida[: len(salida) * 2 // 3] if cortar else salida
+
+
+def _productos(n: int):
+    return {str(i): gen_module.Producto(titulo=f"Producto {i}", url_producto=f"https://www.amazon.es/dp/B{i:09d}",
+                                        url_imagen="https://m.media-amazon.com/i.jpg", precio="49,99 €")
+            for i in range(1, n + 1)}
+
+
+def _cadena_anterior(raw_output, productos_map):
+    raw_clean = gen_module.normalize_model_html(raw_output)
+
+    def extract_tag(tag, text, flags=re.IGNORECASE | re.DOTALL):
+        m = re.search(f"<{tag}>(.*?)</{tag}>", text, flags)
+        return m.group(1).strip() if m else None
+
+    titulo = extract_tag("titular", raw_clean)
+    subtitulo = extract_tag("subtitulo", raw_clean)
+    intro_html = extract_tag("intro", raw_clean) or ""
+    cierre_html = extract_tag("cierre", raw_clean) or ""
+    m = re.search(r"<items>(.*?)</items>", raw_clean, re.IGNORECASE | re.DOTALL)
+    items_block = m.group(1) if m else raw_clean
+    partes = [intro_html] if intro_html else []
+    for m in re.finditer(r'<item\s+id=["\']?(\d+)["\']?\s*>(.*?)</item>', items_block, re.IGNORECASE | re.DOTALL):
+        product_obj = productos_map.get(m.group(1))
+        if not product_obj:
+            continue
+        texto = extract_tag("texto", m.group(2)) or ""
+        texto = re.sub(r'<div[^>]*class="btn-buy-amz[^>]*>.*?</div>', '', texto, flags=re.DOTALL)
+        partes.append(gen_module._render_item_block(product_obj, extract_tag("nombre", m.group(2)), texto))
+    if cierre_html:
+        partes.append(cierre_html)
+    return titulo, subtitulo, re.sub(r"<a([^>]*)>", gen_module._normalize_anchor, "\n".join(partes), flags=re.IGNORECASE)
+
+
+def _una_pasada(raw_output, productos_map, delta=None):
+    req = gen_module.GenerarArticuloRequest(tema="Tema", productos=[])
+    montaje = gen_module.MontajeArticulo(req, productos_map)
+    if delta is None:
+        secciones = gen_module.parsear_salida(raw_output)
+    else:
+        parser = gen_module.ParserArticulo()
+        secciones = []
+        for i in range(0, len(raw_output), delta):
+            secciones += parser.feed(raw_output[i:i + delta])
+        secciones += parser.close()
+    for seccion in secciones:
+        montaje.añadir(seccion)
+    return montaje.titulo, montaje.subtitulo_ia, len(montaje.items)
+
+
+def _medir(fn, reps):
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        resultado = fn()
+    return (time.perf_counter() - t0) / reps, resultado
+
+
+def main():
+    reps = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    casos = [
+        ("3 productos", 3, {}),
+        ("10 productos", 10, {}),
+        ("50 productos", 50, {}),
+        ("200 items sin </item>", 200, {"cerrar_items": False}),
+        ("50, <intro> sin cerrar", 50, {"cerrar_intro": False}),
+        ("50, salida cortada", 50, {"cortar": True}),
+    ]
+    print(f"{'salida':<24} {'KB':>6} {'anterior':>11} {'una pasada':>11} {'deltas 16c':>11}  items ant/nuevo")
+    for nombre, n, opciones in casos:
+        raw = _salida(n, **opciones)
+        productos_map = _productos(n)
+        r = max(1, reps * 10 // n)
+        antes, res_antes = _medir(lambda: _cadena_anterior(raw, productos_map), r)
+        ahora, res_ahora = _medir(lambda: _una_pasada(raw, productos_map), r)
+        stream, _ = _medir(lambda: _una_pasada(raw, productos_map, delta=16), max(1, r // 4))
+        items_antes = res_antes[2].count("<h2>")
+        print(f"{nombre:<24} {len(raw) / 1024:6.1f} {antes * 1e3:8.3f} ms {ahora * 1e3:8.3f} ms "
+              f"{stream * 1e3:8.3f} ms  {items_antes}/{res_ahora[2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark: tiempo hasta el primer contenido en generador-contenido.
+
+Levanta un servidor compatible con la API de OpenAI que genera un artículo de
+N productos a razón de un delta cada DELAY segundos (stream SSE, o la
+respuesta entera al final si no se pide stream) y mide, contra
+generador-contenido servido con uvicorn, el tiempo de /generar-articulo y el
+del primer bloque de producto y el evento fin de /generar-articulo/stream.
+
+Uso:
+    python benchmarks/bench_generador_stream.py [N] [DELAY]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from _servidor import ServidorEnHilo, cargar_servicio
+
+
+def _salida(n: int):
+    """Deltas de la salida del modelo, de unos pocos caracteres como los reales."""
+    xml = "<articulo><titular>Titular</titular><subtitulo>Sub</subtitulo><intro><p>" + "Intro. " * 40 + "</p></intro><items>"
+    for i in range(1, n + 1):
+        xml += f'<item id="{i}"><nombre>Producto {i}</nombre><texto><p>' + "Texto del producto. " * 25 + "</p></texto></item>"
+    xml += "</items><cierre><p>" + "Cierre. " * 30 + "</p></cierre></articulo>"
+    return [xml[i:i + 16] for i in range(0, len(xml), 16)]
+
+
+def _stub_openai(deltas, delay: float) -> FastAPI:
+    stub = FastAPI()
+    base = {"id": "chatcmpl-bench", "created": 0, "model": "gpt-4o-mini"}
+
+    @stub.post("/v1/chat/completions")
+    async def completions(request: Request):
+        cuerpo = await request.json()
+        if not cuerpo.get("stream"):
+            await asyncio.sleep(delay * len(deltas))
+            return {**base, "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(deltas)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+
+        async def sse():
+            for d in deltas:
+                await asyncio.sleep(delay)
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": d}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    return stub
+
+
+async def _medir(url: str, n: int):
+    payload = {"tema": "Auriculares", "productos": [
+        {"titulo": f"Producto {i}", "url_producto": f"https://www.amazon.es/dp/B00000000{i}"} for i in range(1, n + 1)]}
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        t0 = time.perf_counter()
+        r = await client.post("/generar-articulo", json=payload)
+        assert r.status_code == 200, r.text
+        completo = time.perf_counter() - t0
+
+        primero = fin = None
+        t0 = time.perf_counter()
+        async with client.stream("POST", "/generar-articulo/stream", json=payload) as r:
+            async for linea in r.aiter_lines():
+                tipo = json.loads(linea)["tipo"] if linea else None
+                if tipo == "item" and primero is None:
+                    primero = time.perf_counter() - t0
+                elif tipo == "fin":
+                    fin = time.perf_counter() - t0
+        return completo, primero, fin
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    deltas = _salida(n)
+    with ServidorEnHilo(_stub_openai(deltas, delay)) as openai_srv:
+        os.environ["OPENAI_BASE_URL"] = f"{openai_srv.url}/v1"
+        os.environ["OPENAI_API_KEY"] = "sk-bench"
+        gen_module = cargar_servicio('generador-contenido', 'generador_contenido_main')
+        gen_module.completion_cache = None
+        with ServidorEnHilo(gen_module.app) as gen_srv:
+            completo, primero, fin = asyncio.run(_medir(gen_srv.url, n))
+    print(f"{n} productos, {len(deltas)} deltas de {delay * 1000:.0f} ms")
+    print(f"  /generar-articulo        : {completo * 1000:8.1f} ms hasta la respuesta")
+    print(f"  /generar-articulo/stream : {primero * 1000:8.1f} ms hasta el primer producto, "
+          f"{fin * 1000:8.1f} ms hasta fin")
+
+
+if __name__ == "__main__":
+    main()
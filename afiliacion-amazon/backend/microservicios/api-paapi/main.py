@@ -1,10 +1,24 @@
 from fastapi import FastAPI, HTTPException, Query
 from amazon_paapi import AmazonApi
+from amazon_paapi.errors import ItemsNotFound, TooManyRequests
 import os
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import json
+import sqlite3
+import sys
+import threading
+import time
 
 # Cargar variables de entorno
 load_dotenv()
@@ -40,10 +54,256 @@ PARTNER_TAG = os.getenv('PAAPI_ASSOCIATE_TAG') or os.getenv('AMAZON_ASSOCIATE_TA
 # País para AmazonApi ("ES" para España)
 COUNTRY = os.getenv('PAAPI_COUNTRY', 'ES')
 
+# Tope de llamadas simultáneas a PAAPI (tamaño del pool de hilos dedicado)
+PAAPI_MAX_CONCURRENCY = max(1, int(os.getenv('PAAPI_MAX_CONCURRENCY', 4)))
+
+
+class PaapiExecutor:
+    """Ejecuta las llamadas síncronas del SDK de PAAPI fuera del event loop.
+
+    python-amazon-paapi es bloqueante: llamado directamente desde un endpoint
+    async congela el worker de uvicorn (incluido /health) durante todo el
+    round-trip a Amazon. Las llamadas se delegan a un pool de hilos propio cuyo
+    tamaño es, a la vez, el tope de concurrencia hacia Amazon.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max(1, int(max_workers))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="paapi")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_calls = 0
+        self.total_errors = 0
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self.pending -= 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.total_errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.total_calls += 1
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.pending += 1
+        return await loop.run_in_executor(self._pool, functools.partial(self._call, fn, args, kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_workers,
+                "pending": self.pending,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "total_calls": self.total_calls,
+                "total_errors": self.total_errors,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+paapi_executor = PaapiExecutor(PAAPI_MAX_CONCURRENCY)
+
+
+@app.on_event("shutdown")
+async def _on_shutdown():
+    paapi_executor.shutdown()
+    if product_store is not None:
+        product_store.close()
+
+
+# Cuota PAAPI: ~1 petición/segundo por associate tag y un máximo diario que
+# crece con las ventas. PAAPI_TPD=0 desactiva el límite diario.
+PAAPI_TPS = float(os.getenv('PAAPI_TPS', 1))
+PAAPI_BURST = float(os.getenv('PAAPI_BURST', 1))
+PAAPI_TPD = int(os.getenv('PAAPI_TPD', 8640))
+PAAPI_QUEUE_MAX = int(os.getenv('PAAPI_QUEUE_MAX', 100))
+PAAPI_QUEUE_TIMEOUT = float(os.getenv('PAAPI_QUEUE_TIMEOUT', 20))
+
+# Menor valor = más prioridad. /buscar interactivo adelanta al tráfico de fondo.
+PRIORIDADES = {"interactiva": 0, "lote": 5, "background": 10}
+
+
+class RateLimitError(Exception):
+    """No hay cuota PAAPI disponible (cola llena, espera agotada o tope diario)."""
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucketScheduler:
+    """Token bucket global con cola de espera por prioridades delante de AmazonApi.
+
+    Cada llamada a PAAPI consume un token. Los tokens se reponen a ``tps`` por
+    segundo hasta ``burst``; ``tpd`` limita el total diario (UTC). Si no hay
+    token, la llamada espera en una cola acotada (``max_queue``) como mucho
+    ``timeout`` segundos; dentro de la cola se atiende antes la prioridad más baja
+    y, a igual prioridad, por orden de llegada.
+    """
+
+    def __init__(self, tps: float, burst: float = 1, tpd: int = 0, max_queue: int = 100,
+                 timeout: float = 20, clock=time.monotonic):
+        self.tps = max(0.001, float(tps))
+        self.burst = max(1.0, float(burst))
+        self.tpd = max(0, int(tpd))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = float(timeout)
+        self._clock = clock
+        self._tokens = self.burst
+        self._last = clock()
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._day = datetime.now(timezone.utc).date()
+        self._day_count = 0
+        self._waits: deque = deque(maxlen=1000)
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.tps)
+        self._last = now
+
+    def _check_daily(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self._day_count = 0
+        if self.tpd and self._day_count >= self.tpd:
+            self.rejected += 1
+            now = datetime.now(timezone.utc)
+            manana = datetime.combine(today + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+            raise RateLimitError("PAAPI daily quota exhausted", retry_after=(manana - now).total_seconds())
+
+    def _take(self, waited: float):
+        self._tokens -= 1
+        self._day_count += 1
+        self.acquired += 1
+        self._waits.append(waited)
+
+    def _wake_head(self):
+        if self._heap:
+            self._heap[0][2].set()
+
+    def _remove(self, entry):
+        try:
+            self._heap.remove(entry)
+        except ValueError:
+            return
+        heapq.heapify(self._heap)
+        self._wake_head()
+
+    def hay_margen(self, reserve: float = 0, max_fraccion_diaria: float = 1.0) -> bool:
+        """True si ahora sobra cuota: cola vacía, más de ``reserve`` tokens y
+        consumo diario por debajo de ``max_fraccion_diaria`` del tope."""
+        self._refill()
+        if self._heap or self._tokens < 1 + reserve:
+            return False
+        return not (self.tpd and self._day_count >= self.tpd * max_fraccion_diaria)
+
+    async def acquire(self, priority: int = PRIORIDADES["interactiva"]) -> float:
+        """Espera un token respetando prioridad. Devuelve los segundos esperados."""
+        self._check_daily()
+        self._refill()
+        if not self._heap and self._tokens >= 1:
+            self._take(0.0)
+            return 0.0
+        if len(self._heap) >= self.max_queue:
+            self.rejected += 1
+            raise RateLimitError("PAAPI queue full", retry_after=len(self._heap) / self.tps)
+
+        start = self._clock()
+        entry = (int(priority), next(self._seq), asyncio.Event())
+        heapq.heappush(self._heap, entry)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._heap))
+        try:
+            while True:
+                self._refill()
+                waited = self._clock() - start
+                if self._heap[0] is entry and self._tokens >= 1:
+                    self._check_daily()
+                    heapq.heappop(self._heap)
+                    self._take(waited)
+                    self._wake_head()
+                    return waited
+                remaining = self.timeout - waited
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise RateLimitError("PAAPI queue timeout", retry_after=len(self._heap) / self.tps)
+                delay = remaining
+                if self._heap[0] is entry:
+                    delay = min(remaining, (1 - self._tokens) / self.tps)
+                entry[2].clear()
+                try:
+                    await asyncio.wait_for(entry[2].wait(), timeout=max(delay, 0.001))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._remove(entry)
+
+    def stats(self) -> dict:
+        self._refill()
+        waits = sorted(self._waits)
+
+        def _pct(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4)
+
+        por_prioridad = {}
+        for prio, _, _ in self._heap:
+            por_prioridad[prio] = por_prioridad.get(prio, 0) + 1
+        return {
+            "tps": self.tps,
+            "burst": self.burst,
+            "tpd": self.tpd,
+            "tokens": round(self._tokens, 3),
+            "used_today": self._day_count,
+            "queue_depth": len(self._heap),
+            "queue_depth_by_priority": por_prioridad,
+            "max_queue_depth": self.max_queue_depth,
+            "max_queue": self.max_queue,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "wait_avg_s": round(sum(waits) / len(waits), 4) if waits else 0.0,
+            "wait_p50_s": _pct(0.50),
+            "wait_p95_s": _pct(0.95),
+            "wait_max_s": round(waits[-1], 4) if waits else 0.0,
+        }
+
+
+paapi_scheduler = TokenBucketScheduler(PAAPI_TPS, PAAPI_BURST, PAAPI_TPD, PAAPI_QUEUE_MAX, PAAPI_QUEUE_TIMEOUT)
+
+
+async def llamar_paapi(metodo: str, prioridad: int = PRIORIDADES["interactiva"], **kwargs):
+    """Punto único de salida hacia PAAPI: cuota (token bucket) y después pool de hilos."""
+    await paapi_scheduler.acquire(prioridad)
+    return await paapi_executor.run(getattr(amazon_api, metodo), **kwargs)
+
+
 amazon_api = None
 if ACCESS_KEY and SECRET_KEY:
     try:
-        amazon_api = AmazonApi(ACCESS_KEY, SECRET_KEY, PARTNER_TAG, COUNTRY)
+        # El throttling propio del SDK (sleep de 1 s por hilo) lo sustituye paapi_scheduler
+        amazon_api = AmazonApi(ACCESS_KEY, SECRET_KEY, PARTNER_TAG, COUNTRY,
+                               throttling=float(os.getenv('PAAPI_SDK_THROTTLING', 0)))
     except Exception:
         amazon_api = None
 
@@ -61,6 +321,12 @@ async def health():
             "has_secret_key": bool(SECRET_KEY),
             "partner_tag": _mask(PARTNER_TAG),
             "country": COUNTRY,
+            "executor": paapi_executor.stats(),
+            "rate_limiter": paapi_scheduler.stats(),
+            "cache": search_cache.stats(),
+            "single_flight": search_flight.stats(),
+            "item_cache": item_cache.stats(),
+            "store": product_store.stats() if product_store is not None else None,
         }
     except Exception as e:
         # Siempre devolver JSON para facilitar diagnóstico
@@ -77,6 +343,721 @@ class ProductoRespuesta(BaseModel):
     calificacion: Optional[float] = None
     total_valoraciones: Optional[int] = None
     tiene_descuento: Optional[bool] = None
+    # Campos numéricos para ranking/filtrado sin re-parsear el texto de `precio`
+    precio_amount: Optional[float] = None
+    precio_currency: Optional[str] = None
+    precio_lista_amount: Optional[float] = None
+    ahorro_pct: Optional[float] = None
+    ahorro_amount: Optional[float] = None
+
+
+# Normalizar categoría: mapear nombres comunes en español a índices válidos de PAAPI
+CATEGORY_MAP = {
+    "tecnologia": "Electronics",
+    "tecnología": "Electronics",
+    "electronica": "Electronics",
+    "electrónica": "Electronics",
+    "informatica": "Computers",
+    "informática": "Computers",
+    "videojuegos": "VideoGames",
+    "hogar": "HomeAndKitchen",
+    "cocina": "Kitchen",
+    "moda": "Fashion",
+    "deportes": "SportsAndOutdoors",
+    "libros": "Books",
+    "cine": "MoviesAndTV",
+    "peliculas": "MoviesAndTV",
+    "películas": "MoviesAndTV",
+    "series": "TV",
+    "juguetes": "ToysAndGames",
+}
+# Si el usuario ya pasó un índice válido (en inglés), permitirlo directamente
+VALID_LIKE = frozenset(CATEGORY_MAP.values())
+
+
+def _mapear_categoria(categoria: Optional[str]) -> Optional[str]:
+    cat_in = (categoria or "").strip()
+    cat_l = cat_in.lower()
+    if not cat_l or cat_l == "all":
+        return None
+    mapped = CATEGORY_MAP.get(cat_l)
+    if not mapped and cat_in in VALID_LIKE:
+        mapped = cat_in
+    return mapped
+
+
+# Caché de resultados de /buscar (TTL + LRU + stale-while-revalidate)
+PAAPI_CACHE_TTL = float(os.getenv('PAAPI_CACHE_TTL', 900))
+PAAPI_CACHE_STALE_TTL = float(os.getenv('PAAPI_CACHE_STALE_TTL', 3600))
+PAAPI_CACHE_MAX_ENTRIES = int(os.getenv('PAAPI_CACHE_MAX_ENTRIES', 2000))
+PAAPI_CACHE_MAX_BYTES = int(os.getenv('PAAPI_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+class ResultCache:
+    """Caché en memoria acotada por número de entradas y bytes aproximados.
+
+    Cada entrada es fresca durante ``ttl`` segundos y, después, "stale" durante
+    ``stale_ttl`` segundos más: se sirve al instante pero el llamante debe
+    refrescarla en segundo plano (stale-while-revalidate). Pasado ese margen la
+    entrada caduca. Al superar los límites se expulsa la menos usada (LRU).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, stale_ttl: float = 0,
+                 clock=time.monotonic):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl = float(ttl)
+        self.stale_ttl = max(0.0, float(stale_ttl))
+        self._clock = clock
+        self._data: "OrderedDict" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Devuelve ``(valor, estado)`` con estado "fresh", "stale" o None (fallo)."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, None
+        value, size, fresh_until, stale_until = entry
+        now = self._clock()
+        if now >= stale_until:
+            self._pop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None, None
+        self._data.move_to_end(key)
+        if now < fresh_until:
+            self.hits += 1
+            return value, "fresh"
+        self.stale_hits += 1
+        return value, "stale"
+
+    def peek(self, key):
+        """``(estado, segundos_frescos_restantes)`` sin tocar contadores ni orden LRU."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None, 0.0
+        now = self._clock()
+        if now >= entry[3]:
+            return None, 0.0
+        if now < entry[2]:
+            return "fresh", entry[2] - now
+        return "stale", 0.0
+
+    def set(self, key, value, size: int, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else float(ttl)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._data:
+            self._pop(key)
+        now = self._clock()
+        self._data[key] = (value, size, now + ttl, now + ttl + self.stale_ttl)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._pop(oldest)
+            self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+            "stale_ttl_s": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+search_cache = ResultCache(PAAPI_CACHE_MAX_ENTRIES, PAAPI_CACHE_MAX_BYTES,
+                           PAAPI_CACHE_TTL, PAAPI_CACHE_STALE_TTL)
+
+# Caché por ASIN para /items (y alimentada también por /buscar)
+PAAPI_ITEM_CACHE_TTL = float(os.getenv('PAAPI_ITEM_CACHE_TTL', 3600))
+PAAPI_ITEM_CACHE_MAX_ENTRIES = int(os.getenv('PAAPI_ITEM_CACHE_MAX_ENTRIES', 20000))
+PAAPI_ITEM_CACHE_MAX_BYTES = int(os.getenv('PAAPI_ITEM_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PAAPI_ITEMS_MAX = int(os.getenv('PAAPI_ITEMS_MAX', 500))
+# PAAPI GetItems admite como máximo 10 ASIN por petición
+GETITEMS_LOTE = 10
+
+item_cache = ResultCache(PAAPI_ITEM_CACHE_MAX_ENTRIES, PAAPI_ITEM_CACHE_MAX_BYTES, PAAPI_ITEM_CACHE_TTL)
+
+# Filas compactas: tuplas con los valores de ProductoRespuesta en orden de campos
+_CAMPOS_PRODUCTO = tuple(ProductoRespuesta.model_fields)
+
+
+def _a_filas(productos: List[ProductoRespuesta]):
+    filas = tuple(tuple(getattr(p, c) for c in _CAMPOS_PRODUCTO) for p in productos)
+    size = sys.getsizeof(filas)
+    for fila in filas:
+        size += sys.getsizeof(fila) + sum(sys.getsizeof(v) for v in fila if v is not None)
+    return filas, size
+
+
+def _desde_filas(filas) -> List[ProductoRespuesta]:
+    return [ProductoRespuesta.model_construct(**dict(zip(_CAMPOS_PRODUCTO, fila))) for fila in filas]
+
+
+def _cachear_items(productos: List[ProductoRespuesta]):
+    for p in productos:
+        if p.asin:
+            filas, size = _a_filas([p])
+            item_cache.set((COUNTRY, p.asin), filas, size)
+
+
+def _clave_busqueda(busqueda: str, search_index: Optional[str], item_count: int, pagina: int) -> tuple:
+    keywords = " ".join((busqueda or "").lower().split())
+    return (keywords, search_index or "All", int(pagina), int(item_count), COUNTRY)
+
+
+class SingleFlight:
+    """Coalescencia de llamadas idénticas concurrentes.
+
+    La primera llamada con una clave lanza ``fn()`` como tarea independiente; las
+    que llegan con la misma clave mientras sigue en vuelo esperan esa misma tarea
+    y reciben su resultado o su excepción. La tarea no se cancela si el cliente
+    que la originó se desconecta, para no dejar sin respuesta a los demás.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self._calls
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # marcar como recuperada aunque nadie espere ya
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+# Una sola llamada upstream por búsqueda normalizada (misma clave que la caché)
+search_flight = SingleFlight()
+
+
+# Almacén persistente de productos. Vacío = desactivado (p.ej. en tests).
+PAAPI_STORE_PATH = os.getenv('PAAPI_STORE_PATH', '')
+# Antigüedad máxima (s) para responder desde el almacén en modo local
+PAAPI_STORE_MAX_AGE = float(os.getenv('PAAPI_STORE_MAX_AGE', 6 * 3600))
+
+
+class ProductStore:
+    """Almacén local de todo lo que PAAPI nos ha devuelto (SQLite en modo WAL).
+
+    ``productos`` guarda una fila por (país, ASIN) con los campos de
+    ProductoRespuesta, el search_index en que apareció y ``updated_at``;
+    ``busquedas`` guarda qué ASIN devolvió cada búsqueda normalizada, para poder
+    reconstruir una página de /buscar sin llamar a Amazon. Las operaciones son
+    síncronas y cortas; los endpoints las ejecutan con asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columnas = ", ".join(c for c in _CAMPOS_PRODUCTO if c != "asin")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS productos (country TEXT NOT NULL, asin TEXT NOT NULL, {columnas}, "
+            f"search_index TEXT, updated_at REAL NOT NULL, PRIMARY KEY (country, asin))"
+        )
+        # Columnas nuevas de ProductoRespuesta en bases creadas por versiones anteriores
+        existentes = {row[1] for row in self._conn.execute("PRAGMA table_info(productos)")}
+        for c in _CAMPOS_PRODUCTO:
+            if c not in existentes:
+                self._conn.execute(f"ALTER TABLE productos ADD COLUMN {c}")
+        for nombre, cols in (("asin", "asin"), ("marca", "marca"), ("search_index", "search_index"),
+                             ("ahorro_pct", "ahorro_pct"), ("updated_at", "updated_at")):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_productos_{nombre} ON productos ({cols})")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS busquedas (clave TEXT PRIMARY KEY, asins TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._upsert_sql = (
+            f"INSERT INTO productos (country, {', '.join(_CAMPOS_PRODUCTO)}, search_index, updated_at) "
+            f"VALUES ({', '.join('?' * (len(_CAMPOS_PRODUCTO) + 3))}) "
+            f"ON CONFLICT (country, asin) DO UPDATE SET "
+            + ", ".join(f"{c}=excluded.{c}" for c in _CAMPOS_PRODUCTO if c != "asin")
+            + ", search_index=COALESCE(excluded.search_index, productos.search_index), updated_at=excluded.updated_at"
+        )
+        self.upserts = 0
+        self.local_hits = 0
+
+    @staticmethod
+    def _clave_sql(clave: tuple) -> str:
+        return json.dumps(clave, ensure_ascii=False)
+
+    def upsert(self, productos: List["ProductoRespuesta"], search_index: Optional[str] = None,
+               clave: Optional[tuple] = None):
+        now = self._clock()
+        filas = [
+            (COUNTRY, *(getattr(p, c) for c in _CAMPOS_PRODUCTO), search_index, now)
+            for p in productos if p.asin
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(self._upsert_sql, filas)
+                if clave is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO busquedas (clave, asins, updated_at) VALUES (?, ?, ?)",
+                        (self._clave_sql(clave), json.dumps([p.asin for p in productos if p.asin]), now),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.upserts += len(filas)
+
+    def obtener(self, asins: List[str], max_age: float) -> dict:
+        """ASIN -> ProductoRespuesta de los que están en el almacén y son frescos."""
+        if not asins:
+            return {}
+        limite = self._clock() - max_age
+        marcas = ", ".join("?" * len(asins))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_CAMPOS_PRODUCTO)} FROM productos "
+                f"WHERE country = ? AND asin IN ({marcas}) AND updated_at >= ?",
+                (COUNTRY, *asins, limite),
+            ).fetchall()
+        encontrados = {}
+        for row in rows:
+            # Validación completa: SQLite devuelve los bool como enteros
+            p = ProductoRespuesta(**dict(zip(_CAMPOS_PRODUCTO, row)))
+            encontrados[p.asin] = p
+        self.local_hits += len(encontrados)
+        return encontrados
+
+    def buscar(self, clave: tuple, max_age: float) -> Optional[List["ProductoRespuesta"]]:
+        """Página de /buscar reconstruida desde el almacén, o None si falta algo o no es fresca."""
+        limite = self._clock() - max_age
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT asins FROM busquedas WHERE clave = ? AND updated_at >= ?",
+                (self._clave_sql(clave), limite),
+            ).fetchone()
+        if row is None:
+            return None
+        asins = json.loads(row[0])
+        productos = self.obtener(asins, max_age)
+        if len(productos) < len(asins):
+            return None
+        return [productos[a] for a in asins]
+
+    def stats(self) -> dict:
+        with self._lock:
+            n_productos = self._conn.execute("SELECT COUNT(*) FROM productos").fetchone()[0]
+            n_busquedas = self._conn.execute("SELECT COUNT(*) FROM busquedas").fetchone()[0]
+        return {
+            "path": self.path,
+            "productos": n_productos,
+            "busquedas": n_busquedas,
+            "max_age_s": PAAPI_STORE_MAX_AGE,
+            "upserts": self.upserts,
+            "local_hits": self.local_hits,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+product_store: Optional[ProductStore] = None
+if PAAPI_STORE_PATH:
+    try:
+        product_store = ProductStore(PAAPI_STORE_PATH)
+    except Exception as e:
+        logging.getLogger("uvicorn").warning(f"api-paapi: almacén local desactivado ({PAAPI_STORE_PATH}): {e}")
+        product_store = None
+
+
+async def _persistir(productos: List["ProductoRespuesta"], search_index: Optional[str] = None,
+                     clave: Optional[tuple] = None):
+    if product_store is None or not productos:
+        return
+    try:
+        await asyncio.to_thread(product_store.upsert, productos, search_index, clave)
+    except Exception as e:
+        logging.getLogger("uvicorn").warning(f"api-paapi: no se pudo guardar en el almacén local: {e}")
+
+
+# Normalizar posibles envoltorios (p.ej., SearchResult) a lista de items
+def _to_list(x):
+    if x is None:
+        return []
+    if isinstance(x, list):
+        return x
+    for attr in ("items", "search_result", "searchResult", "results", "Results"):
+        v = getattr(x, attr, None)
+        if v is not None:
+            if isinstance(v, list):
+                return v
+            try:
+                return list(v)
+            except Exception:
+                # Envoltorio anidado (p.ej. response.search_result.items)
+                nested = _to_list(v)
+                if nested:
+                    return nested
+    try:
+        return list(x)
+    except Exception:
+        return []
+
+
+# Motor de extracción: las rutas de acceso a los objetos del SDK se compilan una
+# sola vez al importar el módulo, y ofertas/precio/ahorro se resuelven en una
+# única pasada por item en lugar de recorrer la misma cadena en cada candidato.
+_SIN_PRECIO = "Precio no disponible"
+_EUR = ("EUR", "EURO", "€")
+
+
+def _idx(seq, i):
+    if isinstance(seq, (list, tuple)) and len(seq) > i:
+        return seq[i]
+    return None
+
+
+def _compilar_ruta(path):
+    """Convierte ('a', 'b', 0, 'c') en una función ``o -> o.a.b[0].c``.
+
+    Los pasos (atributo o índice) se resuelven una sola vez aquí; la función
+    devuelve None en cuanto falta un eslabón.
+    """
+    pasos = tuple((isinstance(p, int), p) for p in path)
+
+    def acceso(o):
+        for es_indice, p in pasos:
+            if o is None:
+                return None
+            o = _idx(o, p) if es_indice else getattr(o, p, None)
+        return o
+
+    return acceso
+
+
+_PLAN_IMAGEN = tuple(_compilar_ruta(p) for p in (
+    ('images', 'primary', 'large', 'url'),
+    ('images', 'primary', 'medium', 'url'),
+    ('images', 'primary', 'small', 'url'),
+    ('large_image', 'url'),
+    ('medium_image', 'url'),
+    ('small_image', 'url'),
+    ('image', 'url'),
+))
+
+_PLAN_TITULO = tuple(_compilar_ruta(p) for p in (
+    ('item_info', 'title', 'display_value'),
+    ('item_info', 'product_title', 'display_value'),
+    ('title',),
+    ('product_title',),
+))
+
+_listing = _compilar_ruta(('offers', 'listings', 0))
+_lowest_price = _compilar_ruta(('offers', 'summaries', 0, 'lowest_price'))
+
+
+def _get_image_url(it) -> str:
+    try:
+        # Plan A: atributos directos
+        direct = getattr(it, 'image_url', None) or getattr(it, 'large_image_url', None)
+        if direct:
+            return direct
+        # Plan B: rutas anidadas comunes
+        for acceso in _PLAN_IMAGEN:
+            v = acceso(it)
+            if isinstance(v, str) and v:
+                return v
+    except Exception:
+        pass
+    return ""
+
+
+def _get_title(it) -> str:
+    try:
+        for acceso in _PLAN_TITULO:
+            v = acceso(it)
+            if isinstance(v, str) and v.strip():
+                return v.strip()
+    except Exception:
+        pass
+    return getattr(it, 'title', None) or getattr(it, 'product_title', None) or ''
+
+
+def _formatear_importe(amount, currency) -> str:
+    amt = float(amount)
+    if str(currency).upper() in _EUR:
+        # Formato EUR bonito
+        return f"{amt:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
+    return f"{amt:.2f} {currency}"
+
+
+def _primero_no_nulo(*valores):
+    for v in valores:
+        if v is not None:
+            return v
+    return None
+
+
+def _a_float(v) -> Optional[float]:
+    if v is None or isinstance(v, bool):
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# Derivar el ahorro de precio de lista > precio cuando PAAPI no trae savings.
+# Cambia qué productos salen con tiene_descuento, así que va desactivado por defecto.
+PAAPI_DESCUENTO_DERIVADO = os.getenv('PAAPI_DESCUENTO_DERIVADO', 'false').strip().lower() in ('1', 'true', 'yes')
+
+
+def _importes(lp, lowp, ip, lst, ls, lows, listing, derivar: Optional[bool] = None) -> dict:
+    """Precio actual, precio de lista y ahorro como números (None si no constan).
+
+    Con ``derivar`` (PAAPI_DESCUENTO_DERIVADO por defecto), el ahorro que falte
+    se deriva de precio y precio de lista cuando ambos existen.
+    """
+    if derivar is None:
+        derivar = PAAPI_DESCUENTO_DERIVADO
+    amount = _a_float(_primero_no_nulo(getattr(lp, 'amount', None), getattr(lowp, 'amount', None),
+                                       getattr(ip, 'amount', None)))
+    currency = _primero_no_nulo(getattr(lp, 'currency', None), getattr(lowp, 'currency', None),
+                                getattr(ip, 'currency', None), getattr(lst, 'currency', None))
+    lista = (_a_float(getattr(ls, 'basis', None))
+             or _a_float(getattr(getattr(listing, 'saving_basis', None), 'amount', None))
+             or _a_float(getattr(lst, 'amount', None)))
+    pct = _a_float(getattr(ls, 'percentage', None)) or _a_float(getattr(lows, 'percentage', None))
+    ahorro = _a_float(getattr(ls, 'amount', None)) or _a_float(getattr(lows, 'amount', None))
+    if derivar and amount is not None and lista and lista > amount:
+        if ahorro is None:
+            ahorro = round(lista - amount, 2)
+        if pct is None:
+            pct = round((lista - amount) * 100 / lista, 1)
+    return {
+        "precio_amount": amount,
+        "precio_currency": str(currency).upper() if currency else None,
+        "precio_lista_amount": lista,
+        "ahorro_pct": pct,
+        "ahorro_amount": ahorro,
+    }
+
+
+def _extraer_precio(item) -> dict:
+    """Texto de precio enriquecido, flag de descuento y campos numéricos."""
+    # Sub-objetos resueltos una sola vez por item
+    listing = _listing(item)
+    lp = getattr(listing, 'price', None)
+    lowp = _lowest_price(item)
+    ip = getattr(item, 'price', None)
+    lst = getattr(item, 'list_price', None)
+    ls = getattr(lp, 'savings', None)
+    lows = getattr(lowp, 'savings', None)
+
+    # 1) display_amount si existe ("EUR 59,99" o similar)
+    precio = _SIN_PRECIO
+    for disp in (getattr(lp, 'display_amount', None), getattr(lowp, 'display_amount', None),
+                 getattr(ip, 'display_amount', None)):
+        if isinstance(disp, str) and disp.strip():
+            precio = disp.strip()
+            break
+
+    if precio == _SIN_PRECIO:
+        # 2) amount + currency
+        amount = _primero_no_nulo(getattr(lp, 'amount', None), getattr(lowp, 'amount', None),
+                                  getattr(lst, 'amount', None), getattr(ip, 'amount', None))
+        currency = _primero_no_nulo(getattr(lp, 'currency', None), getattr(lowp, 'currency', None),
+                                    getattr(lst, 'currency', None), getattr(ip, 'currency', None))
+        if amount and currency:
+            try:
+                precio = _formatear_importe(amount, currency)
+            except Exception:
+                precio = f"{amount} {currency}"
+
+    precio, has_discount = _enriquecer_precio(precio, ls, lows, lst, lp)
+    numeros = _importes(lp, lowp, ip, lst, ls, lows, listing)
+    # Ahorro numérico de PAAPI (o derivado, si está activado) también es
+    # descuento, pero solo si hay precio que mostrar junto a él
+    if precio != _SIN_PRECIO and (numeros["ahorro_pct"] or numeros["ahorro_amount"]):
+        has_discount = True
+    return {"precio": precio, "tiene_descuento": has_discount, **numeros}
+
+
+def _enriquecer_precio(precio: str, ls, lows, lst, lp):
+    """Añade precio de lista y ahorro al texto. Devuelve ``(precio, tiene_descuento)``."""
+    # 3) Enriquecer con precio de lista y ahorro si existe
+    # savings puede venir como display_amount/amount/percentage
+    list_amt = getattr(ls, 'basis', None) or getattr(lst, 'amount', None)
+    list_cur = getattr(lst, 'currency', None) or getattr(lp, 'currency', None)
+    save_pct = getattr(ls, 'percentage', None) or getattr(lows, 'percentage', None)
+    save_display = getattr(ls, 'display_amount', None) or getattr(lows, 'display_amount', None)
+    save_amount = getattr(ls, 'amount', None) or getattr(lows, 'amount', None)
+    try:
+        if list_amt and list_cur:
+            list_display = _formatear_importe(list_amt, list_cur)
+            if precio != _SIN_PRECIO:
+                if save_pct is not None:
+                    return f"{precio} (antes {list_display}, -{int(save_pct)}%)", True
+                if save_display or save_amount:
+                    if save_display:
+                        sd = str(save_display)
+                    else:
+                        sa = float(save_amount)
+                        sd = f"{sa:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + (" €" if str(list_cur).upper() in _EUR else f" {list_cur}")
+                    return f"{precio} (ahorro {sd}, antes {list_display})", True
+        elif precio != _SIN_PRECIO and save_pct is not None:
+            # Si no tenemos list price pero tenemos porcentaje de ahorro, añadimos el porcentaje solo
+            return f"{precio} (-{int(save_pct)}%)", True
+    except Exception:
+        pass
+    return precio, False
+
+
+def _extraer_producto(item) -> ProductoRespuesta:
+    # Construir URL de afiliado
+    url_base = getattr(item, 'detail_page_url', '') or getattr(item, 'url', '')
+    url_afiliado = f"{url_base}{'&' if '?' in url_base else '?'}tag={PARTNER_TAG}"
+
+    # Obtener precio
+    try:
+        precio = _extraer_precio(item)
+    except Exception:
+        precio = {"precio": _SIN_PRECIO, "tiene_descuento": False}
+
+    # Obtener marca
+    marca = getattr(item, 'brand', None) or getattr(item, 'manufacturer', None)
+
+    # Calificaciones (no garantizadas en este wrapper)
+    return ProductoRespuesta(
+        asin=getattr(item, 'asin', ''),
+        titulo=(_get_title(item) or "Sin título"),
+        url_imagen=_get_image_url(item),
+        url_producto=url_base,
+        url_afiliado=url_afiliado,
+        marca=marca,
+        calificacion=None,
+        total_valoraciones=None,
+        **precio,
+    )
+
+
+async def _buscar_en_amazon(busqueda: str, search_index: Optional[str], item_count: int,
+                            pagina: int, prio: int) -> List[ProductoRespuesta]:
+    """Llama a PAAPI (con el reintento conservador) y extrae las filas de respuesta."""
+    # Nota: python-amazon-paapi no expone un 'sort_by' directo en todas las operaciones.
+    # Priorizar num_resultados y categoría; la ordenación por SalesRank se aproxima según disponibilidad.
+    kwargs = {
+        "keywords": busqueda,
+        "item_count": item_count,
+        "item_page": pagina,
+    }
+    # Nota: algunos wrappers de PAAPI ya inyectan 'resources' internamente.
+    # Evitamos pasarlo aquí para no provocar 'multiple values for keyword argument "resources"'.
+    if search_index:
+        kwargs["search_index"] = search_index
+    try:
+        result = await llamar_paapi("search_items", prio, **kwargs)
+    except (RateLimitError, TooManyRequests):
+        # Sin cuota el reintento solo duplicaría la carga sobre Amazon
+        raise
+    except Exception as e:
+        # Reintento conservador: sin search_index y con menos resultados
+        safe_kwargs = {
+            "keywords": busqueda.strip(),
+            "item_count": min(5, item_count),
+            "item_page": pagina,
+        }
+        try:
+            result = await llamar_paapi("search_items", prio, **safe_kwargs)
+        except (RateLimitError, TooManyRequests):
+            raise
+        except Exception as e2:
+            detail = {
+                "error": "PAAPI invalid parameters",
+                "first_attempt": {k: v for k, v in kwargs.items() if k != "keywords"},
+                "second_attempt": {k: v for k, v in safe_kwargs.items() if k != "keywords"},
+                "message": str(e2) or str(e),
+            }
+            raise HTTPException(status_code=400, detail=detail)
+
+    return [_extraer_producto(item) for item in _to_list(result)]
+
+
+async def _buscar_y_cachear(clave: tuple, busqueda: str, search_index: Optional[str], item_count: int,
+                            pagina: int, prio: int) -> List[ProductoRespuesta]:
+    productos = await _buscar_en_amazon(busqueda, search_index, item_count, pagina, prio)
+    filas, size = _a_filas(productos)
+    search_cache.set(clave, filas, size)
+    _cachear_items(productos)
+    await _persistir(productos, search_index, clave)
+    return productos
+
+
+# Refrescos stale-while-revalidate en vuelo: el bucle de eventos solo guarda
+# referencias débiles a las tareas, así que sin esto podrían recogerse a medias
+_refrescos: set = set()
+
+
+def _refrescar_en_segundo_plano(clave: tuple, busqueda: str, search_index: Optional[str],
+                                item_count: int, pagina: int):
+    if clave in search_flight:
+        return
+
+    async def _refrescar():
+        try:
+            await search_flight.do(clave, lambda: _buscar_y_cachear(
+                clave, busqueda, search_index, item_count, pagina, PRIORIDADES["background"]))
+        except Exception as e:
+            logging.getLogger("uvicorn").warning(f"api-paapi: refresco de caché fallido {clave!r}: {e}")
+
+    tarea = asyncio.ensure_future(_refrescar())
+    _refrescos.add(tarea)
+    tarea.add_done_callback(_refrescos.discard)
+
 
 @app.get("/buscar", response_model=List[ProductoRespuesta])
 async def buscar_productos(
@@ -84,7 +1065,11 @@ async def buscar_productos(
     categoria: str = Query("All", description="Categoría de búsqueda"),
     num_resultados: int = Query(10, ge=1, le=50, description="Número de resultados solicitados (1-50)"),
     sort_by: str = Query("SalesRank", description="Orden (por ejemplo: SalesRank)"),
-    pagina: int = Query(1, ge=1, le=10, description="Página de resultados (1-10)")
+    pagina: int = Query(1, ge=1, le=10, description="Página de resultados (1-10)"),
+    prioridad: str = Query("interactiva", pattern="^(interactiva|lote|background)$",
+                           description="Prioridad en la cola de cuota PAAPI"),
+    modo: str = Query("amazon", pattern="^(amazon|local)$",
+                      description="'local': responder desde el almacén local si es fresco"),
 ):
     """
     Busca productos en Amazon y devuelve los resultados con enlaces de afiliado
@@ -99,310 +1084,340 @@ async def buscar_productos(
                 "country": COUNTRY,
             })
 
-        # Nota: python-amazon-paapi no expone un 'sort_by' directo en todas las operaciones.
-        # Priorizar num_resultados y categoría; la ordenación por SalesRank se aproxima según disponibilidad.
         # PAAPI limita item_count a [1,10] y item_page a [1,10]
         item_count = max(1, min(10, int(num_resultados)))
-        kwargs = {
-            "keywords": busqueda,
-            "item_count": item_count,
-            "item_page": pagina,
-        }
-        # Nota: algunos wrappers de PAAPI ya inyectan 'resources' internamente.
-        # Evitamos pasarlo aquí para no provocar 'multiple values for keyword argument "resources"'.
-        # Normalizar categoría: mapear nombres comunes en español a índices válidos de PAAPI
-        cat_in = (categoria or "").strip()
-        cat_l = cat_in.lower()
-        CATEGORY_MAP = {
-            "tecnologia": "Electronics",
-            "tecnología": "Electronics",
-            "electronica": "Electronics",
-            "electrónica": "Electronics",
-            "informatica": "Computers",
-            "informática": "Computers",
-            "videojuegos": "VideoGames",
-            "hogar": "HomeAndKitchen",
-            "cocina": "Kitchen",
-            "moda": "Fashion",
-            "deportes": "SportsAndOutdoors",
-            "libros": "Books",
-            "cine": "MoviesAndTV",
-            "peliculas": "MoviesAndTV",
-            "películas": "MoviesAndTV",
-            "series": "TV",
-            "juguetes": "ToysAndGames",
-        }
-        mapped = None
-        if cat_l and cat_l != "all":
-            mapped = CATEGORY_MAP.get(cat_l)
-            # Si el usuario ya pasó un índice válido (en inglés), permitirlo directamente
-            VALID_LIKE = {"Electronics","Computers","VideoGames","HomeAndKitchen","Kitchen","Fashion","SportsAndOutdoors","Books","MoviesAndTV","TV","ToysAndGames"}
-            if not mapped and cat_in in VALID_LIKE:
-                mapped = cat_in
-        if mapped:
-            kwargs["search_index"] = mapped
-        try:
-            result = amazon_api.search_items(**kwargs)
-        except Exception as e:
-            # Reintento conservador: sin search_index y con menos resultados
-            try:
-                safe_kwargs = {
-                    "keywords": busqueda.strip(),
-                    "item_count": min(5, item_count),
-                    "item_page": pagina,
-                }
-                result = amazon_api.search_items(**safe_kwargs)
-            except Exception as e2:
-                detail = {
-                    "error": "PAAPI invalid parameters",
-                    "first_attempt": {k: v for k, v in kwargs.items() if k != "keywords"},
-                    "second_attempt": {k: v for k, v in safe_kwargs.items() if k != "keywords"},
-                    "message": str(e2) or str(e),
-                }
-                raise HTTPException(status_code=400, detail=detail)
-
-        # Normalizar posibles envoltorios (p.ej., SearchResult) a lista de items
-        def _to_list(x):
-            if x is None:
-                return []
-            if isinstance(x, list):
-                return x
-            for attr in ("items", "search_result", "searchResult", "results", "Results"):
-                v = getattr(x, attr, None)
-                if v is not None:
-                    try:
-                        return list(v) if not isinstance(v, list) else v
-                    except Exception:
-                        pass
-            try:
-                return list(x)
-            except Exception:
-                return []
+        mapped = _mapear_categoria(categoria)
+        clave = _clave_busqueda(busqueda, mapped, item_count, pagina)
 
-        items = _to_list(result)
+        if prioridad == "interactiva":
+            prefetcher.registrar(clave, busqueda, mapped, item_count, pagina)
 
-        if not items:
-            return []
+        filas, estado = search_cache.get(clave)
+        if estado == "stale":
+            # Servimos al instante lo que tenemos y refrescamos en segundo plano
+            _refrescar_en_segundo_plano(clave, busqueda, mapped, item_count, pagina)
+        if estado is not None:
+            return _desde_filas(filas)
 
-        resultados = []
+        if modo == "local" and product_store is not None:
+            locales = await asyncio.to_thread(product_store.buscar, clave, PAAPI_STORE_MAX_AGE)
+            if locales is not None:
+                filas, size = _a_filas(locales)
+                search_cache.set(clave, filas, size)
+                return locales
 
-        def _get_image_url(it):
-            try:
-                # Plan A: atributos directos
-                direct = (
-                    getattr(it, 'image_url', None)
-                    or getattr(it, 'large_image_url', None)
-                )
-                if direct:
-                    return direct
-                # Plan B: rutas anidadas comunes
-                def walk(obj, path):
-                    cur = obj
-                    for p in path:
-                        cur = getattr(cur, p, None)
-                        if cur is None:
-                            return None
-                    return cur
-                candidates = [
-                    ('images', 'primary', 'large', 'url'),
-                    ('images', 'primary', 'medium', 'url'),
-                    ('images', 'primary', 'small', 'url'),
-                    ('large_image', 'url'),
-                    ('medium_image', 'url'),
-                    ('small_image', 'url'),
-                    ('image', 'url'),
-                ]
-                for path in candidates:
-                    v = walk(it, path)
-                    if isinstance(v, str) and v:
-                        return v
-            except Exception:
-                pass
-            return ""
-        def _get_title(it):
-            try:
-                def walk_any(obj, path):
-                    cur = obj
-                    for p in path:
-                        if isinstance(p, int):
-                            if isinstance(cur, (list, tuple)) and len(cur) > p:
-                                cur = cur[p]
-                            else:
-                                return None
-                        else:
-                            cur = getattr(cur, p, None)
-                            if cur is None:
-                                return None
-                    return cur
-
-                candidates = [
-                    ('item_info', 'title', 'display_value'),
-                    ('item_info', 'product_title', 'display_value'),
-                    ('title',),
-                    ('product_title',),
-                ]
-                for path in candidates:
-                    v = walk_any(it, path)
-                    if isinstance(v, str) and v.strip():
-                        return v.strip()
-            except Exception:
-                pass
-            return getattr(it, 'title', None) or getattr(it, 'product_title', None) or ''
-
-        for item in items:
-            # Construir URL de afiliado
-            url_base = getattr(item, 'detail_page_url', '') or getattr(item, 'url', '')
-            tag_afiliado = f"?tag={PARTNER_TAG}"
-            url_afiliado = f"{url_base}{tag_afiliado if '?' not in url_base else '&' + tag_afiliado[1:]}"
-            
-            # Obtener precio
-            precio = "Precio no disponible"
-            has_discount = False
-            try:
-                def walk_any(obj, path):
-                    cur = obj
-                    for p in path:
-                        if isinstance(p, int):
-                            if isinstance(cur, (list, tuple)) and len(cur) > p:
-                                cur = cur[p]
-                            else:
-                                return None
-                        else:
-                            cur = getattr(cur, p, None)
-                            if cur is None:
-                                return None
-                    return cur
-
-                # 1) display_amount si existe ("EUR 59,99" o similar)
-                display_candidates = [
-                    ('offers', 'listings', 0, 'price', 'display_amount'),
-                    ('offers', 'summaries', 0, 'lowest_price', 'display_amount'),
-                    ('price', 'display_amount'),
-                ]
-                for path in display_candidates:
-                    disp = walk_any(item, path)
-                    if isinstance(disp, str) and disp.strip():
-                        precio = disp.strip()
-                        break
-
-                if precio == "Precio no disponible":
-                    # 2) amount + currency
-                    amount_candidates = [
-                        ('offers', 'listings', 0, 'price', 'amount'),
-                        ('offers', 'summaries', 0, 'lowest_price', 'amount'),
-                        ('list_price', 'amount'),
-                        ('price', 'amount'),
-                    ]
-                    currency_candidates = [
-                        ('offers', 'listings', 0, 'price', 'currency'),
-                        ('offers', 'summaries', 0, 'lowest_price', 'currency'),
-                        ('list_price', 'currency'),
-                        ('price', 'currency'),
-                    ]
-                    amount = None
-                    currency = None
-                    for path in amount_candidates:
-                        v = walk_any(item, path)
-                        if v is not None:
-                            amount = v
-                            break
-                    for path in currency_candidates:
-                        v = walk_any(item, path)
-                        if v is not None:
-                            currency = v
-                            break
-                    if amount and currency:
-                        try:
-                            amt = float(amount)
-                            # Formato EUR bonito
-                            if str(currency).upper() in ("EUR", "EURO", "€"):
-                                precio = f"{amt:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
-                            else:
-                                precio = f"{amt:.2f} {currency}"
-                        except Exception:
-                            precio = f"{amount} {currency}"
-                
-                # 3) Enriquecer con precio de lista y ahorro si existe
-                try:
-                    # savings puede venir como display_amount/amount/percentage
-                    list_amt = (
-                        walk_any(item, ('offers','listings',0,'price','savings','basis'))
-                        or walk_any(item, ('list_price','amount'))
-                    )
-                    list_cur = (
-                        walk_any(item, ('list_price','currency'))
-                        or walk_any(item, ('offers','listings',0,'price','currency'))
-                    )
-                    save_pct = (
-                        walk_any(item, ('offers','listings',0,'price','savings','percentage'))
-                        or walk_any(item, ('offers','summaries',0,'lowest_price','savings','percentage'))
-                    )
-                    save_display = (
-                        walk_any(item, ('offers','listings',0,'price','savings','display_amount'))
-                        or walk_any(item, ('offers','summaries',0,'lowest_price','savings','display_amount'))
-                    )
-                    save_amount = (
-                        walk_any(item, ('offers','listings',0,'price','savings','amount'))
-                        or walk_any(item, ('offers','summaries',0,'lowest_price','savings','amount'))
-                    )
-                    if list_amt and list_cur:
-                        try:
-                            la = float(list_amt)
-                            if str(list_cur).upper() in ("EUR","EURO","€"):
-                                list_display = f"{la:,.2f}".replace(",","X").replace(".",",").replace("X",".") + " €"
-                            else:
-                                list_display = f"{la:.2f} {list_cur}"
-                            if precio != "Precio no disponible":
-                                if save_pct is not None:
-                                    precio = f"{precio} (antes {list_display}, -{int(save_pct)}%)"
-                                    has_discount = True
-                                elif save_display or save_amount:
-                                    try:
-                                        if save_display:
-                                            sd = str(save_display)
-                                        else:
-                                            sa = float(save_amount)
-                                            sd = f"{sa:,.2f}".replace(",","X").replace(".",",").replace("X",".") + (" €" if str(list_cur).upper() in ("EUR","EURO","€") else f" {list_cur}")
-                                        precio = f"{precio} (ahorro {sd}, antes {list_display})"
-                                        has_discount = True
-                                    except Exception:
-                                        pass
-                        except Exception:
-                            pass
-                    else:
-                        # Si no tenemos list price pero tenemos porcentaje de ahorro, añadimos el porcentaje solo
-                        if precio != "Precio no disponible" and save_pct is not None:
-                            precio = f"{precio} (-{int(save_pct)}%)"
-                            has_discount = True
-                except Exception:
-                    pass
-            except Exception:
-                pass
-
-            # Obtener marca
-            marca = getattr(item, 'brand', None) or getattr(item, 'manufacturer', None)
-            
-            # Calificaciones (no garantizadas en este wrapper)
-            calificacion = None
-            total_valoraciones = None
-            
-            resultados.append(ProductoRespuesta(
-                asin=getattr(item, 'asin', ''),
-                titulo=(_get_title(item) or "Sin título"),
-                precio=precio,
-                url_imagen=_get_image_url(item),
-                url_producto=url_base,
-                url_afiliado=url_afiliado,
-                marca=marca,
-                calificacion=calificacion,
-                total_valoraciones=total_valoraciones,
-                tiene_descuento=has_discount
-            ))
-        
-        return resultados
+        prio = PRIORIDADES[prioridad]
+        return await search_flight.do(clave, lambda: _buscar_y_cachear(
+            clave, busqueda, mapped, item_count, pagina, prio))
+    except HTTPException:
+        raise
+    except RateLimitError as e:
+        headers = {"Retry-After": str(max(1, int(e.retry_after or 1)))}
+        raise HTTPException(status_code=429, detail={"error": e.reason, "retry_after": e.retry_after}, headers=headers)
+    except TooManyRequests as e:
+        raise HTTPException(status_code=429, detail={"error": "PAAPI throttled", "message": str(e)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
+
+class ItemsRequest(BaseModel):
+    asins: List[str] = Field(..., min_length=1, max_length=PAAPI_ITEMS_MAX,
+                             description="ASIN a consultar (se agrupan de 10 en 10 para GetItems)")
+    prioridad: str = Field("lote", pattern="^(interactiva|lote|background)$")
+    modo: str = Field("amazon", pattern="^(amazon|local)$",
+                      description="'local': los ASIN frescos en el almacén local no se piden a Amazon")
+
+
+async def _get_items_lote(asins: List[str], prio: int) -> List[ProductoRespuesta]:
+    try:
+        result = await llamar_paapi("get_items", prio, items=asins)
+    except ItemsNotFound:
+        return []
+    productos = [_extraer_producto(item) for item in _to_list(result)]
+    _cachear_items(productos)
+    await _persistir(productos)
+    return productos
+
+
+@app.post("/items", response_model=List[ProductoRespuesta])
+async def obtener_items(req: ItemsRequest):
+    """
+    Devuelve los productos de una lista de ASIN en el orden pedido. Solo los
+    ASIN que faltan en caché (o han caducado) se piden a Amazon, en lotes
+    GetItems de 10 que pasan por el mismo limitador de cuota que /buscar.
+    Los ASIN que Amazon no devuelve se omiten.
+    """
+    try:
+        if amazon_api is None:
+            raise HTTPException(status_code=500, detail={"error": "PAAPI not initialized"})
+
+        asins = list(dict.fromkeys(a.strip().upper() for a in req.asins if a and a.strip()))
+        encontrados = {}
+        faltan = []
+        for asin in asins:
+            filas, estado = item_cache.get((COUNTRY, asin))
+            if estado == "fresh":
+                encontrados[asin] = _desde_filas(filas)[0]
+            else:
+                faltan.append(asin)
+
+        if faltan and req.modo == "local" and product_store is not None:
+            locales = await asyncio.to_thread(product_store.obtener, faltan, PAAPI_STORE_MAX_AGE)
+            _cachear_items(list(locales.values()))
+            encontrados.update(locales)
+            faltan = [a for a in faltan if a not in locales]
+
+        if faltan:
+            prio = PRIORIDADES[req.prioridad]
+            lotes = [faltan[i:i + GETITEMS_LOTE] for i in range(0, len(faltan), GETITEMS_LOTE)]
+            resultados = await asyncio.gather(*(_get_items_lote(l, prio) for l in lotes), return_exceptions=True)
+            errores = [r for r in resultados if isinstance(r, BaseException)]
+            if errores and len(errores) == len(lotes) and not encontrados:
+                raise errores[0]
+            for r in resultados:
+                if isinstance(r, BaseException):
+                    logging.getLogger("uvicorn").warning(f"api-paapi: lote GetItems fallido: {r}")
+                    continue
+                for p in r:
+                    encontrados[p.asin.upper()] = p
+
+        return [encontrados[a] for a in asins if a in encontrados]
+    except HTTPException:
+        raise
+    except RateLimitError as e:
+        headers = {"Retry-After": str(max(1, int(e.retry_after or 1)))}
+        raise HTTPException(status_code=429, detail={"error": e.reason, "retry_after": e.retry_after}, headers=headers)
+    except TooManyRequests as e:
+        raise HTTPException(status_code=429, detail={"error": "PAAPI throttled", "message": str(e)})
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error PAAPI GetItems: {str(e)}")
+
+# Precarga de búsquedas calientes (campañas y palabras clave más pedidas)
+PAAPI_PREFETCH_KEYWORDS = os.getenv('PAAPI_PREFETCH_KEYWORDS', '')  # "aspiradoras,auriculares@tecnologia"
+PAAPI_PREFETCH_PAGINAS = os.getenv('PAAPI_PREFETCH_PAGINAS', '1')  # "1", "1-3" o "1,2"
+PAAPI_PREFETCH_NUM = int(os.getenv('PAAPI_PREFETCH_NUM', 10))
+PAAPI_PREFETCH_LEARN_TOP = int(os.getenv('PAAPI_PREFETCH_LEARN_TOP', 20))
+PAAPI_PREFETCH_MIN_HITS = float(os.getenv('PAAPI_PREFETCH_MIN_HITS', 3))
+PAAPI_PREFETCH_HALF_LIFE = float(os.getenv('PAAPI_PREFETCH_HALF_LIFE', 6 * 3600))
+PAAPI_PREFETCH_MARGIN = float(os.getenv('PAAPI_PREFETCH_MARGIN', 120))
+PAAPI_PREFETCH_TICK = float(os.getenv('PAAPI_PREFETCH_TICK', 2))
+PAAPI_PREFETCH_RESERVE = float(os.getenv('PAAPI_PREFETCH_RESERVE', 0))
+PAAPI_PREFETCH_MAX_TPD_FRACTION = float(os.getenv('PAAPI_PREFETCH_MAX_TPD_FRACTION', 0.5))
+# Espera (s) tras un refresco fallido de una búsqueda; se dobla con cada fallo seguido
+PAAPI_PREFETCH_ERROR_BACKOFF = float(os.getenv('PAAPI_PREFETCH_ERROR_BACKOFF', 60))
+PAAPI_PREFETCH_ERROR_BACKOFF_MAX = float(os.getenv('PAAPI_PREFETCH_ERROR_BACKOFF_MAX', 3600))
+
+
+def _parse_paginas(txt: str) -> List[int]:
+    paginas = []
+    for parte in (txt or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if "-" in parte:
+            a, b = parte.split("-", 1)
+            paginas.extend(range(int(a), int(b) + 1))
+        else:
+            paginas.append(int(parte))
+    return [p for p in dict.fromkeys(paginas) if 1 <= p <= 10] or [1]
+
+
+class Prefetcher:
+    """Mantiene caliente en la caché un conjunto de búsquedas.
+
+    El conjunto es la lista configurada (``PAAPI_PREFETCH_KEYWORDS`` x páginas)
+    más las ``learn_top`` búsquedas interactivas más frecuentes, con una
+    frecuencia que decae con semivida ``half_life``. Cada ``tick`` refresca las
+    entradas que han caducado o están a menos de ``margin`` segundos de
+    hacerlo, pero solo mientras el limitador tenga tokens sobrantes (cola vacía)
+    y el consumo diario no supere ``max_tpd_fraction`` del tope.
+
+    Una búsqueda cuyo refresco falla no se reintenta hasta pasados
+    ``error_backoff`` segundos, el doble con cada fallo seguido (hasta
+    ``error_backoff_max``), y vuelve a la cola detrás de las demás pendientes:
+    cada intento puede costar dos tokens de PAAPI y no debe acaparar la cuota.
+    """
+
+    def __init__(self, keywords: str = "", paginas: str = "1", num: int = 10, learn_top: int = 0,
+                 min_hits: float = 3, half_life: float = 3600, margin: float = 120,
+                 reserve: float = 0, max_tpd_fraction: float = 0.5, error_backoff: float = 60,
+                 error_backoff_max: float = 3600, clock=time.monotonic):
+        self.learn_top = max(0, int(learn_top))
+        self.min_hits = float(min_hits)
+        self.half_life = max(1.0, float(half_life))
+        self.margin = float(margin)
+        self.reserve = float(reserve)
+        self.max_tpd_fraction = float(max_tpd_fraction)
+        self.error_backoff = max(0.0, float(error_backoff))
+        self.error_backoff_max = max(self.error_backoff, float(error_backoff_max))
+        self._clock = clock
+        self._configuradas = {}
+        # La clave se calcula con el mismo item_count acotado que usa /buscar
+        item_count = max(1, min(10, int(num)))
+        for entrada in (keywords or "").split(","):
+            kw, _, cat = entrada.partition("@")
+            kw = kw.strip()
+            if not kw:
+                continue
+            mapped = _mapear_categoria(cat)
+            for pagina in _parse_paginas(paginas):
+                clave = _clave_busqueda(kw, mapped, item_count, pagina)
+                self._configuradas[clave] = (kw, mapped, item_count, pagina)
+        self._frecuencias: dict = {}
+        self._estado: dict = {}
+        self.refrescos = 0
+        self.errores = 0
+        self.sin_margen = 0
+        self.en_espera = 0
+
+    @property
+    def activo(self) -> bool:
+        return bool(self._configuradas) or self.learn_top > 0
+
+    def _puntuacion(self, registro, now) -> float:
+        return registro[4] * 0.5 ** ((now - registro[5]) / self.half_life)
+
+    def registrar(self, clave: tuple, busqueda: str, search_index: Optional[str], item_count: int, pagina: int):
+        """Anota una búsqueda interactiva para aprender qué conviene precargar."""
+        if self.learn_top <= 0:
+            return
+        now = self._clock()
+        previo = self._frecuencias.get(clave)
+        score = (self._puntuacion(previo, now) if previo else 0.0) + 1.0
+        self._frecuencias[clave] = (busqueda, search_index, item_count, pagina, score, now)
+        if len(self._frecuencias) > 1000:
+            # Podar las menos frecuentes para acotar memoria
+            orden = sorted(self._frecuencias, key=lambda k: self._puntuacion(self._frecuencias[k], now))
+            for k in orden[:len(self._frecuencias) - 800]:
+                del self._frecuencias[k]
+
+    def conjunto(self) -> dict:
+        """clave -> (busqueda, search_index, item_count, pagina, origen) del conjunto caliente."""
+        now = self._clock()
+        warm = {k: (*v, "config") for k, v in self._configuradas.items()}
+        if self.learn_top:
+            aprendidas = sorted(
+                ((self._puntuacion(r, now), k, r) for k, r in self._frecuencias.items() if k not in warm),
+                key=lambda t: t[0], reverse=True,
+            )
+            for score, k, r in aprendidas[:self.learn_top]:
+                if score >= self.min_hits:
+                    warm[k] = (*r[:4], "aprendida")
+        return warm
+
+    async def tick(self) -> int:
+        """Refresca las entradas pendientes mientras sobre cuota. Devuelve cuántas refrescó."""
+        now = self._clock()
+        pendientes = []
+        en_espera = 0
+        for clave, entrada in self.conjunto().items():
+            estado, restante = search_cache.peek(clave)
+            st = self._estado.setdefault(clave, {"ultima": None, "refrescos": 0, "error": None,
+                                                 "pendiente_desde": None, "fallos": 0, "reintentar_en": None})
+            if estado == "fresh" and restante > self.margin:
+                st["pendiente_desde"] = None
+                continue
+            if st["reintentar_en"] is not None and now < st["reintentar_en"]:
+                en_espera += 1
+                continue
+            if st["pendiente_desde"] is None:
+                st["pendiente_desde"] = now
+            pendientes.append((st["pendiente_desde"], clave, entrada))
+        self.en_espera = en_espera
+        pendientes.sort(key=lambda t: t[0])
+
+        hechos = 0
+        for _, clave, (busqueda, search_index, item_count, pagina, _origen) in pendientes:
+            if not paapi_scheduler.hay_margen(self.reserve, self.max_tpd_fraction):
+                self.sin_margen += 1
+                break
+            st = self._estado[clave]
+            try:
+                await search_flight.do(clave, lambda: _buscar_y_cachear(
+                    clave, busqueda, search_index, item_count, pagina, PRIORIDADES["background"]))
+                st.update(ultima=time.time(), error=None, pendiente_desde=None, fallos=0, reintentar_en=None)
+                st["refrescos"] += 1
+                self.refrescos += 1
+            except Exception as e:
+                st["fallos"] += 1
+                espera = min(self.error_backoff_max, self.error_backoff * 2 ** (st["fallos"] - 1))
+                fin = self._clock()
+                # Al final de la cola: no adelanta a las que llevan más tiempo esperando
+                st.update(error=str(e), reintentar_en=fin + espera, pendiente_desde=fin + espera)
+                self.errores += 1
+            hechos += 1
+        return hechos
+
+    async def run(self, intervalo: float):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logging.getLogger("uvicorn").warning(f"api-paapi: precarga fallida: {e}")
+            await asyncio.sleep(intervalo)
+
+    def informe(self) -> dict:
+        now = self._clock()
+        entradas = []
+        for clave, (busqueda, search_index, item_count, pagina, origen) in self.conjunto().items():
+            estado, restante = search_cache.peek(clave)
+            st = self._estado.get(clave, {})
+            pendiente_desde = st.get("pendiente_desde")
+            ultima = st.get("ultima")
+            entradas.append({
+                "busqueda": busqueda,
+                "search_index": search_index,
+                "num_resultados": item_count,
+                "pagina": pagina,
+                "origen": origen,
+                "cache": estado or "miss",
+                "fresco_restante_s": round(restante, 1),
+                "ultima_actualizacion": datetime.fromtimestamp(ultima, timezone.utc).isoformat() if ultima else None,
+                "lag_s": round(max(0.0, now - pendiente_desde), 1) if pendiente_desde is not None else 0.0,
+                "refrescos": st.get("refrescos", 0),
+                "ultimo_error": st.get("error"),
+                "fallos_seguidos": st.get("fallos", 0),
+                "reintento_en_s": round(max(0.0, st["reintentar_en"] - now), 1) if st.get("reintentar_en") else None,
+            })
+        return {
+            "activo": self.activo,
+            "margin_s": self.margin,
+            "learn_top": self.learn_top,
+            "refrescos": self.refrescos,
+            "errores": self.errores,
+            "sin_margen": self.sin_margen,
+            "en_espera_por_error": self.en_espera,
+            "entradas": entradas,
+        }
+
+
+prefetcher = Prefetcher(
+    PAAPI_PREFETCH_KEYWORDS, PAAPI_PREFETCH_PAGINAS, PAAPI_PREFETCH_NUM, PAAPI_PREFETCH_LEARN_TOP,
+    PAAPI_PREFETCH_MIN_HITS, PAAPI_PREFETCH_HALF_LIFE, PAAPI_PREFETCH_MARGIN,
+    PAAPI_PREFETCH_RESERVE, PAAPI_PREFETCH_MAX_TPD_FRACTION,
+    PAAPI_PREFETCH_ERROR_BACKOFF, PAAPI_PREFETCH_ERROR_BACKOFF_MAX,
+)
+_prefetch_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def _iniciar_prefetch():
+    global _prefetch_task
+    if prefetcher.activo and amazon_api is not None:
+        _prefetch_task = asyncio.create_task(prefetcher.run(PAAPI_PREFETCH_TICK))
+
+
+@app.on_event("shutdown")
+async def _parar_prefetch():
+    if _prefetch_task is not None:
+        _prefetch_task.cancel()
+
+
+@app.get("/prefetch")
+async def estado_prefetch():
+    """Conjunto de búsquedas precargadas, su frescura en caché y el retraso de refresco."""
+    return prefetcher.informe()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,13 +1,31 @@
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 import os
 import httpx
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import functools
+import hashlib
+import heapq
+import importlib.util
 import io
+import json
+import logging
+import math
+import operator
+import sqlite3
+import threading
+import time
+import uuid
 import zipfile
 import re
+import tempfile
+import unicodedata
+from collections import OrderedDict
+from xml.sax.saxutils import escape
 
 load_dotenv()
 
@@ -42,6 +60,97 @@ API_PAAPI_URL = _ensure_url(os.getenv("API_PAAPI_URL", "http://localhost:8000"))
 GEN_CONTENT_URL = _ensure_url(os.getenv("GEN_CONTENT_URL", "http://localhost:8010"))
 DEFAULT_ITEMS_PER_ARTICLE = int(os.getenv("DEFAULT_ITEMS_PER_ARTICLE", 5))
 DEFAULT_CATEGORY = os.getenv("DEFAULT_SEARCH_INDEX", "All")
+# Páginas de api-paapi pedidas en paralelo por búsqueda (1 = en serie)
+PAAPI_FANOUT = max(1, int(os.getenv("FRONTEND_PAAPI_FANOUT", 4)))
+# Artículos de un lote generados a la vez
+GEN_CONCURRENCY = max(1, int(os.getenv("FRONTEND_GEN_CONCURRENCY", 4)))
+# Exportación ZIP: nivel de deflate (0 = sin comprimir, 9 = máximo) y bytes
+# del XML que se guardan en memoria antes de pasar a un fichero temporal
+ZIP_COMPRESSLEVEL = min(9, max(0, int(os.getenv("FRONTEND_ZIP_COMPRESSLEVEL", 6))))
+ZIP_SPOOL_MAX_BYTES = int(os.getenv("FRONTEND_ZIP_SPOOL_MAX_BYTES", 1024 * 1024))
+# Sobre-pedido adaptativo a PAAPI: se piden páginas hasta tener productos
+# suficientes que pasen los filtros, estimando cuántas hacen falta con el
+# rendimiento (EWMA) observado antes para la misma búsqueda.
+PAAPI_MAX_PAGINAS = 10
+FETCH_RENDIMIENTO_INICIAL = float(os.getenv("FRONTEND_FETCH_RENDIMIENTO_INICIAL", 0.5))
+FETCH_RENDIMIENTO_ALPHA = float(os.getenv("FRONTEND_FETCH_RENDIMIENTO_ALPHA", 0.3))
+FETCH_MARGEN = float(os.getenv("FRONTEND_FETCH_MARGEN", 1.2))
+FETCH_MAX_BUSQUEDAS = int(os.getenv("FRONTEND_FETCH_MAX_BUSQUEDAS", 2000))
+# Pesos del ranking de productos de un lote (ver rankear_productos)
+RANKING_PESOS = {
+    "descuento": float(os.getenv("FRONTEND_PESO_DESCUENTO", 1.0)),
+    "precio": float(os.getenv("FRONTEND_PESO_PRECIO", 1.0)),
+    "coincidencia": float(os.getenv("FRONTEND_PESO_COINCIDENCIA", 0.5)),
+    "posicion": float(os.getenv("FRONTEND_PESO_POSICION", 0.5)),
+    "marca": float(os.getenv("FRONTEND_PESO_MARCA", 0.3)),
+}
+# Títulos de producto cuyo tokenizado/stemming se guarda para el filtro por palabra clave
+TITLE_CACHE_SIZE = int(os.getenv("FRONTEND_TITLE_CACHE_SIZE", 20000))
+# Caché de lotes generados (por hash de la petición), compartida por
+# /generar-articulos y las exportaciones
+LOTE_CACHE_TTL = float(os.getenv("FRONTEND_LOTE_CACHE_TTL", 1800))
+LOTE_CACHE_MAX_ENTRIES = int(os.getenv("FRONTEND_LOTE_CACHE_MAX_ENTRIES", 64))
+
+# Clientes HTTP de larga vida (keep-alive) por upstream, con su propio
+# límite de conexiones y timeouts. HTTP/2 solo si está instalado 'h2' y el
+# upstream es https (httpx negocia HTTP/2 por ALPN).
+HTTP_UPSTREAMS = {
+    "paapi": {
+        "timeout": float(os.getenv("FRONTEND_PAAPI_TIMEOUT", 30)),
+        "max_connections": int(os.getenv("FRONTEND_PAAPI_MAX_CONNECTIONS", 20)),
+    },
+    "generador": {
+        "timeout": float(os.getenv("FRONTEND_GEN_TIMEOUT", 60)),
+        "max_connections": int(os.getenv("FRONTEND_GEN_MAX_CONNECTIONS", 10)),
+    },
+}
+HTTP_CONNECT_TIMEOUT = float(os.getenv("FRONTEND_HTTP_CONNECT_TIMEOUT", 5))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("FRONTEND_HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP2 = os.getenv("FRONTEND_HTTP2", "false").strip().lower() in ("1", "true", "yes")
+
+# upstream -> (cliente, event loop en el que se creó)
+_http_clients: dict = {}
+
+
+def _http2_disponible() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _nuevo_cliente(upstream: str) -> httpx.AsyncClient:
+    conf = HTTP_UPSTREAMS[upstream]
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(conf["timeout"], connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=conf["max_connections"],
+            max_keepalive_connections=conf["max_connections"],
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=HTTP2 and _http2_disponible(),
+    )
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """Cliente compartido del upstream. Se crea al arrancar; si no existe (o se
+    creó en otro event loop, como en los tests) se crea bajo demanda."""
+    loop = asyncio.get_running_loop()
+    actual = _http_clients.get(upstream)
+    if actual is None or actual[1] is not loop or actual[0].is_closed:
+        actual = _http_clients[upstream] = (_nuevo_cliente(upstream), loop)
+    return actual[0]
+
+
+@app.on_event("startup")
+async def _abrir_clientes_http():
+    for upstream in HTTP_UPSTREAMS:
+        get_http_client(upstream)
+
+
+@app.on_event("shutdown")
+async def _cerrar_clientes_http():
+    clientes = [c for c, _ in _http_clients.values()]
+    _http_clients.clear()
+    for c in clientes:
+        await c.aclose()
 
 APP_VERSION = os.getenv("APP_VERSION", "1.3.0")
 BUILD_ID = os.getenv("BUILD_ID", "dev")
@@ -66,6 +175,13 @@ async def health():
         "gen_content_url": GEN_CONTENT_URL,
         "default_items_per_article": DEFAULT_ITEMS_PER_ARTICLE,
         "default_category": DEFAULT_CATEGORY,
+        "paapi_fanout": PAAPI_FANOUT,
+        "gen_concurrency": GEN_CONCURRENCY,
+        "http2": HTTP2 and _http2_disponible(),
+        "lote_cache": lote_cache.stats(),
+        "fetch_adaptativo": rendimiento_busquedas.stats(),
+        "jobs": {**job_store.stats(), "workers": JOB_WORKERS,
+                 "en_cola": _job_queue.qsize() if _job_queue is not None else 0},
     }
 
 class Producto(BaseModel):
@@ -77,6 +193,12 @@ class Producto(BaseModel):
     marca: Optional[str] = None
     features: Optional[List[str]] = None
     tiene_descuento: Optional[bool] = None
+    asin: Optional[str] = None
+    precio_amount: Optional[float] = None
+    precio_currency: Optional[str] = None
+    precio_lista_amount: Optional[float] = None
+    ahorro_pct: Optional[float] = None
+    ahorro_amount: Optional[float] = None
 
 class LoteRequest(BaseModel):
     tema: Optional[str] = None
@@ -86,12 +208,15 @@ class LoteRequest(BaseModel):
     items_por_articulo: int = Field(default=DEFAULT_ITEMS_PER_ARTICLE, ge=1, le=10)
     palabra_clave_principal: Optional[str] = None
     palabras_clave_secundarias: Optional[List[str]] = Field(default_factory=list)
+    forzar: bool = Field(default=False, description="Regenerar sin leer la caché de lotes ni la de completions del generador")
 
 class Articulo(BaseModel):
     titulo: str
     subtitulo: str
     subtitulo_ia: Optional[str] = None
     articulo: str
+    # Presente solo si la generación de este artículo falló (lote parcial)
+    error: Optional[str] = None
 
 class LoteResponse(BaseModel):
     articulos: List[Articulo]
@@ -115,228 +240,722 @@ def _stem_es(word: str) -> str:
     return w
 
 
-async def buscar_productos(busqueda: str, categoria: str, total: int) -> List[Producto]:
+_RE_TOKEN = re.compile(r"\w+")
+_RE_FRASE = re.compile(r'"([^"]*)"')
+
+
+# Tildes habituales resueltas con una tabla; el resto de diacríticos, con NFKD
+_SIN_TILDES = str.maketrans("áéíóúüñàèìòùâêîôûäëïöç", "aeiouunaeiouaeiouaeioc")
+
+
+def _plegar(texto: str) -> str:
+    """Minúsculas y sin tildes/diacríticos ('Jabón' -> 'jabon', 'niño' -> 'nino')."""
+    texto = texto.lower()
+    if texto.isascii():
+        return texto
+    texto = texto.translate(_SIN_TILDES)
+    if texto.isascii():
+        return texto
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+@functools.lru_cache(maxsize=16384)
+def _raiz(token: str) -> str:
+    """Stem sin tildes de un token en minúsculas (el vocabulario de títulos se repite mucho)."""
+    return _stem_es(_plegar(token))
+
+
+def _stems(texto: str) -> Tuple[str, ...]:
+    return tuple(map(_raiz, _RE_TOKEN.findall(texto.lower())))
+
+
+@functools.lru_cache(maxsize=TITLE_CACHE_SIZE)
+def _stems_titulo(titulo: str) -> Tuple[Tuple[str, ...], frozenset]:
+    """Stems de un título (en orden y como conjunto). El título identifica al
+    producto, así que los productos que se repiten entre búsquedas (mismo
+    ASIN y título) no se vuelven a tokenizar."""
+    stems = _stems(titulo)
+    return stems, frozenset(stems)
+
+
+class KeywordMatcher:
+    """Filtro de títulos por palabra clave, compilado una vez por petición.
+
+    Basta con que una palabra de la clave (con stemming y sin tildes) aparezca
+    en el título. Los fragmentos entre comillas son frases: sus palabras deben
+    aparecer seguidas, p. ej. ``"robot aspirador" cable`` casa con títulos que
+    contengan "robot aspirador" o "cable".
+    """
+
+    def __init__(self, keyword: str):
+        keyword = keyword or ""
+        self.frases = [f for f in (_stems(m) for m in _RE_FRASE.findall(keyword)) if f]
+        self.palabras = frozenset(_stems(_RE_FRASE.sub(" ", keyword)))
+        # Una frase de una sola palabra es simplemente una palabra más
+        self.palabras |= {f[0] for f in self.frases if len(f) == 1}
+        self.frases = [f for f in self.frases if len(f) > 1]
+        self._total = len(self.palabras) + len(self.frases)
+        # fuerza() por título: seleccionar_grupos reordena los mismos productos
+        # en cada página pedida a PAAPI
+        self._fuerzas: Dict[str, float] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.palabras or self.frases)
+
+    @staticmethod
+    def _contiene_frase(stems: Tuple[str, ...], conjunto: frozenset, frase: Tuple[str, ...]) -> bool:
+        if not conjunto.issuperset(frase):
+            return False
+        n = len(frase)
+        return any(stems[i:i + n] == frase for i in range(len(stems) - n + 1))
+
+    def match(self, titulo: Optional[str]) -> bool:
+        stems, conjunto = _stems_titulo(titulo or "")
+        if not self.palabras.isdisjoint(conjunto):
+            return True
+        return any(self._contiene_frase(stems, conjunto, f) for f in self.frases)
+
+    def fuerza(self, titulo: Optional[str]) -> float:
+        """Fracción (0-1) de palabras y frases de la clave presentes en el título."""
+        if not self._total:
+            return 0.0
+        titulo = titulo or ""
+        fuerza = self._fuerzas.get(titulo)
+        if fuerza is None:
+            stems, conjunto = _stems_titulo(titulo)
+            presentes = len(self.palabras.intersection(conjunto))
+            if self.frases:
+                presentes += sum(1 for f in self.frases if self._contiene_frase(stems, conjunto, f))
+            fuerza = self._fuerzas[titulo] = presentes / self._total
+        return fuerza
+
+
+def _has_precio(p) -> bool:
+    if getattr(p, "precio_amount", None) is not None:
+        return True
+    v = (p.precio or '').strip().lower()
+    return bool(v) and not v.startswith('precio no disponible')
+
+
+def _descuento(p) -> Optional[float]:
+    """Profundidad del descuento en 0-1, o None si el producto no está rebajado.
+
+    Si solo sabemos que hay rebaja (flag o texto del precio), un valor bajo.
+    """
+    pct = getattr(p, "ahorro_pct", None)
+    ahorro = getattr(p, "ahorro_amount", None)
+    # Si api-paapi ya ha marcado el producto como rebajado, confiamos en ese flag;
+    # con los campos numéricos la detección es exacta sin parsear texto
+    if getattr(p, "tiene_descuento", None) is not True and not (pct or 0) > 0 and not (ahorro or 0) > 0:
+        if getattr(p, "precio_amount", None) is not None or not _descuento_en_texto(p):
+            return None
+    if pct is None and ahorro:
+        lista = getattr(p, "precio_lista_amount", None)
+        if lista:
+            pct = 100.0 * ahorro / lista
+    if pct is None:
+        return 0.1
+    return 0.0 if pct <= 0 else 1.0 if pct >= 100 else pct / 100.0
+
+
+def _descuento_en_texto(p) -> bool:
+    # Compatibilidad con respuestas antiguas que solo traen el texto de precio:
+    # api-paapi añade cosas como "(-20%)", "antes ..." o "ahorro ..." al precio.
+    v = (p.precio or '').strip().lower()
+    if not v or v.startswith('precio no disponible'):
+        return False
+    if '%' in v:
+        return True
+    return 'antes' in v or 'ahorro' in v
+
+
+_puntos_candidato = operator.itemgetter(0)
+
+
+def rankear_productos(productos: List[Producto], matcher: KeywordMatcher, max_total: int,
+                      black_friday: bool, pesos: Optional[dict] = None) -> List[Producto]:
+    """Elige los ``max_total`` mejores productos en una sola pasada.
+
+    Reglas de elegibilidad (las de siempre):
+      - Si hay alguno con descuento, solo entran los que tienen descuento.
+      - Si no hay ninguno, en búsquedas de Black Friday entran los que al menos
+        tienen precio (algunas ofertas no vienen marcadas en PAAPI); en el resto
+        no entra ninguno.
+      - Con palabra clave principal, el título tiene que casar con ella.
+
+    Entre los elegibles, la puntuación suma profundidad del descuento, precio
+    disponible, fuerza de la coincidencia con la clave y posición en PAAPI
+    (relevancia de Amazon), según ``pesos`` (RANKING_PESOS por defecto). Cada
+    producto de una marca ya elegida pierde ``pesos['marca']`` por repetición,
+    para variar marcas dentro del lote. Si entran todos o casi todos los
+    candidatos basta con ordenarlos; si se eligen pocos, salen de un heap.
+    """
+    pesos = pesos or RANKING_PESOS
+    n = len(productos) or 1
+    w_desc, w_precio, w_coinc, w_pos = pesos["descuento"], pesos["precio"], pesos["coincidencia"], pesos["posicion"]
+    fuerza_de = matcher.fuerza if matcher else None
+    # Las fuerzas ya calculadas se leen directamente del diccionario del
+    # matcher (sin la llamada al método, que es la mitad del coste)
+    fuerzas = matcher._fuerzas if matcher else {}
+    hay_descuento = False
+    con_descuento: list = []
+    con_precio: list = []
+    for pos, p in enumerate(productos):
+        profundidad = _descuento(p)
+        descuento = profundidad is not None
+        if descuento:
+            hay_descuento = True
+        elif hay_descuento or not black_friday:
+            # Sin descuento solo puede entrar como fallback de Black Friday, y
+            # únicamente mientras no haya aparecido ningún producto rebajado
+            continue
+        precio = _has_precio(p)
+        if not descuento and not precio:
+            continue
+        if fuerza_de is not None:
+            fuerza = fuerzas.get(p.titulo)
+            if fuerza is None:
+                fuerza = fuerza_de(p.titulo)
+            if not fuerza:
+                continue
+        else:
+            fuerza = 0.0
+        puntos = w_precio * precio + w_coinc * fuerza + w_pos * (1 - pos / n)
+        if descuento:
+            con_descuento.append((-(puntos + w_desc * profundidad), pos, p))
+        else:
+            con_precio.append((-puntos, pos, p))
+    # Si hay descuentos (aunque ninguno case con la clave) no hay fallback
+    candidatos = con_descuento if hay_descuento else con_precio
+    w_marca = pesos["marca"]
+
+    if max_total * 4 >= len(candidatos):
+        # Entran todos o casi (seleccionar_grupos pide el orden completo): los
+        # de una misma marca salen en orden de puntuación, así que el k-ésimo
+        # pierde k veces el peso de marca y basta con dos ordenaciones. Los
+        # candidatos están en orden de PAAPI, así que ordenar (estable) solo por
+        # puntos desempata por posición igual que comparar las tuplas enteras
+        candidatos.sort(key=_puntos_candidato)
+        if w_marca:
+            por_marca: dict = {}
+            penalizado = False
+            for i, (puntos, pos, p) in enumerate(candidatos):
+                marca = (p.marca or "").strip().lower()
+                if marca:
+                    repetidos = por_marca.get(marca, 0)
+                    por_marca[marca] = repetidos + 1
+                    if repetidos:
+                        candidatos[i] = (puntos + w_marca * repetidos, pos, p)
+                        penalizado = True
+            # Sin marcas repetidas la penalización no cambia el orden
+            if penalizado:
+                candidatos.sort()
+        return [c[2] for c in candidatos[:max_total]]
+
+    if not w_marca:
+        return [p for _, _, p in heapq.nsmallest(max_total, candidatos)]
+
+    # Top-k de muchos: heap (puntos, posición, repeticiones de marca ya descontadas,
+    # puntos sin penalizar, producto) con reevaluación perezosa de la
+    # penalización por marca repetida
+    heap = [(puntos, pos, 0, puntos, p) for puntos, pos, p in candidatos]
+    heapq.heapify(heap)
+    por_marca = {}
+    elegidos: List[Producto] = []
+    while heap and len(elegidos) < max_total:
+        puntos, pos, vistos, base, p = heapq.heappop(heap)
+        marca = (p.marca or "").strip().lower()
+        repetidos = por_marca.get(marca, 0) if marca else 0
+        if repetidos != vistos:
+            # La marca se ha repetido desde que se puntuó: penalizar y reencolar
+            heapq.heappush(heap, (base + w_marca * repetidos, pos, repetidos, base, p))
+            continue
+        elegidos.append(p)
+        if marca:
+            por_marca[marca] = repetidos + 1
+    return elegidos
+
+
+def repartir_productos(productos: List[Producto], num_articulos: int, items_por_articulo: int) -> List[List[Producto]]:
+    """Distribuye los productos de forma lo más equilibrada posible entre los
+    artículos, sin repetir productos y respetando el máximo items_por_articulo."""
+    total_disp = len(productos)
+    grupos: List[List[Producto]] = []
+    if total_disp == 0:
+        return grupos
+    base = total_disp // num_articulos
+    extra = total_disp % num_articulos
+    idx_p = 0
+    for i in range(num_articulos):
+        # Número objetivo para este artículo (no superar items_por_articulo)
+        target = base + (1 if i < extra else 0)
+        target = min(target, items_por_articulo)
+        if target <= 0:
+            grupos.append([])
+            continue
+        grupos.append(productos[idx_p: idx_p + target])
+        idx_p += target
+    return grupos
+
+
+def _producto_desde_api(d: dict) -> Producto:
+    return Producto(
+        titulo=d.get("titulo", ""),
+        url_producto=d.get("url_producto", ""),
+        url_afiliado=d.get("url_afiliado", ""),
+        url_imagen=d.get("url_imagen"),
+        precio=d.get("precio"),
+        marca=d.get("marca"),
+        features=None,
+        tiene_descuento=d.get("tiene_descuento"),
+        asin=d.get("asin"),
+        precio_amount=d.get("precio_amount"),
+        precio_currency=d.get("precio_currency"),
+        precio_lista_amount=d.get("precio_lista_amount"),
+        ahorro_pct=d.get("ahorro_pct"),
+        ahorro_amount=d.get("ahorro_amount"),
+    )
+
+
+async def _buscar_pagina(client: httpx.AsyncClient, busqueda: str, categoria_n: str, pagina: int,
+                         item_count: int) -> List[dict]:
+    params = {
+        "busqueda": busqueda,
+        "num_resultados": item_count,
+        "pagina": pagina,
+    }
+    if categoria_n:
+        params["categoria"] = categoria_n
+    r = await client.get(f"{API_PAAPI_URL}/buscar", params=params)
+    if r.status_code != 200:
+        # Reintento conservador: sin categoria y con n=5
+        retry_params = {
+            "busqueda": busqueda,
+            "num_resultados": min(5, item_count),
+            "pagina": pagina,
+        }
+        r_retry = await client.get(f"{API_PAAPI_URL}/buscar", params=retry_params)
+        if r_retry.status_code != 200:
+            raise HTTPException(status_code=502, detail=f"Error PAAPI (p{pagina} n{item_count} cat='{categoria_n}') and retry: {r.text} | retry: {r_retry.text}")
+        r = r_retry
+    return r.json() or []
+
+
+async def buscar_productos(busqueda: str, categoria: str, total: int, pagina_inicial: int = 1) -> List[Producto]:
     # Normalizar categoria: 'All' -> "" para evitar rechazos en PAAPI
     categoria_n = (categoria or "").strip()
     if categoria_n.lower() == "all":
         categoria_n = ""
 
+    # Todas las páginas con el mismo item_count (PAAPI máx 10 por request) para
+    # que no se solapen, y como mucho las 10 páginas que admite PAAPI. Se piden
+    # en paralelo (hasta PAAPI_FANOUT a la vez) y se fusionan en orden de página.
+    # Con pagina_inicial > 1 se continúa una búsqueda ya empezada (páginas de 10).
+    total = max(1, total)
+    item_count = min(10, total) if pagina_inicial == 1 else 10
+    paginas = range(pagina_inicial, min(PAAPI_MAX_PAGINAS, pagina_inicial - 1 + -(-total // item_count)) + 1)
+    sem = asyncio.Semaphore(PAAPI_FANOUT)
+
     productos: List[Producto] = []
-    remaining = max(1, total)
-    pagina = 1
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        while remaining > 0 and pagina <= 10:  # PAAPI pagina 1..10
-            item_count = min(10, remaining)     # PAAPI máx 10 por request
-            params = {
-                "busqueda": busqueda,
-                "num_resultados": item_count,
-                "pagina": pagina,
-            }
-            if categoria_n:
-                params["categoria"] = categoria_n
-            r = await client.get(f"{API_PAAPI_URL}/buscar", params=params)
-            if r.status_code != 200:
-                # Reintento conservador: sin categoria y con n=5
-                retry_params = {
-                    "busqueda": busqueda,
-                    "num_resultados": min(5, item_count),
-                    "pagina": pagina,
-                }
-                r_retry = await client.get(f"{API_PAAPI_URL}/buscar", params=retry_params)
-                if r_retry.status_code != 200:
-                    raise HTTPException(status_code=502, detail=f"Error PAAPI (p{pagina} n{item_count} cat='{categoria_n}') and retry: {r.text} | retry: {r_retry.text}")
-                r = r_retry
-            data = r.json() or []
-            for d in data:
-                productos.append(Producto(
-                    titulo=d.get("titulo", ""),
-                    url_producto=d.get("url_producto", ""),
-                    url_afiliado=d.get("url_afiliado", ""),
-                    url_imagen=d.get("url_imagen"),
-                    precio=d.get("precio"),
-                    marca=d.get("marca"),
-                    features=None,
-                    tiene_descuento=d.get("tiene_descuento"),
-                ))
-            remaining -= len(data) if data else item_count
-            pagina += 1
-    return productos
-
-
-async def generar_articulo(tema: str, productos: List[Producto], kw_main: Optional[str], kw_sec: List[str]) -> Articulo:
+    vistos = set()
+    client = get_http_client("paapi")
+
+    async def _pagina(pagina: int) -> List[dict]:
+        async with sem:
+            # Se cuentan las páginas pedidas de verdad a api-paapi, no las que se
+            # cancelan mientras esperan turno
+            rendimiento_busquedas.paginas += 1
+            return await _buscar_pagina(client, busqueda, categoria_n, pagina, item_count)
+
+    tareas = [asyncio.ensure_future(_pagina(p)) for p in paginas]
+    try:
+        for tarea in tareas:
+            for d in await tarea:
+                clave = d.get("asin") or d.get("url_producto")
+                if clave and clave in vistos:
+                    continue
+                vistos.add(clave)
+                productos.append(_producto_desde_api(d))
+    finally:
+        # Si una página falla, cancelar las que siguen pendientes. (Sin error se
+        # esperan todas: ``paginas`` ya es justo lo necesario para ``total``.)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+    return productos[:total]
+
+
+async def generar_articulo(tema: str, productos: List[Producto], kw_main: Optional[str], kw_sec: List[str],
+                           force_fresh: bool = False) -> Articulo:
     payload = {
         "tema": tema,
         "productos": [p.model_dump() for p in productos],
         "max_items": len(productos),
         "palabra_clave_principal": kw_main,
         "palabras_clave_secundarias": kw_sec,
+        "force_fresh": force_fresh,
     }
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        r = await client.post(f"{GEN_CONTENT_URL}/generar-articulo", json=payload)
+    r = await get_http_client("generador").post(f"{GEN_CONTENT_URL}/generar-articulo", json=payload)
     if r.status_code != 200:
         raise HTTPException(status_code=502, detail=f"Error Generador: {r.text}")
     data = r.json()
     return Articulo(**data)
 
 
-@app.post("/generar-articulos", response_model=LoteResponse)
-async def generar_articulos(req: LoteRequest):
-    try:
-        # Pedimos más productos a PAAPI de los que necesitamos para poder
-        # filtrar por descuento y palabra clave sin quedarnos tan cortos.
-        # Luego recortamos a max_total más abajo.
-        max_total = req.num_articulos * req.items_por_articulo
-        total_items = min(max_total * 2, 50)
-
-        # Construir keywords para PAAPI: si hay palabra_clave_principal, usamos
-        # exclusivamente esa (ej. "aspiradoras"), sin añadir "black friday" u
-        # otros términos. Si no hay principal, usamos busqueda.
-        base_kw = (req.busqueda or "").strip()
-        main_kw = (req.palabra_clave_principal or "").strip()
-        base_kw_lower = base_kw.lower()
-        if main_kw:
-            kw_paapi = main_kw
-        else:
-            # Modo especial Black Friday: usamos "Black Friday" como contexto
-            # editorial, pero no como keyword directa para PAAPI porque suele
-            # devolver pocos o ningún resultado útil. Intentamos extraer la
-            # parte de producto de la búsqueda, y si queda vacía usamos un
-            # genérico como "ofertas".
-            if "black friday" in base_kw_lower:
-                producto = base_kw_lower.replace("black friday", "").strip(" ,.-")
-                kw_paapi = producto or "ofertas"
-            else:
-                kw_paapi = base_kw
-
-        productos = await buscar_productos(kw_paapi, req.categoria, total_items)
-        # Reordenar: primero con precio disponible, luego el resto
-        def has_precio(p):
-            v = (p.precio or '').strip().lower()
-            return bool(v) and not v.startswith('precio no disponible')
-        productos = sorted(productos, key=lambda p: (not has_precio(p)))
-
-        # Para este generador, priorizamos SIEMPRE productos en oferta.
-        # api-paapi ya enriquece el campo precio con cosas como
-        # "(-20%)", "20%", "antes ...", "ahorro ..." cuando hay descuento.
-        # Consideramos que hay descuento si el texto del precio contiene "%"
-        # (porcentaje) o palabras como "antes"/"ahorro".
-        def tiene_descuento(p):
-            # Si api-paapi ya ha marcado el producto como rebajado, confiamos en ese flag.
-            if getattr(p, "tiene_descuento", None) is True:
-                return True
-            v = (p.precio or '').strip().lower()
-            if not v or v.startswith('precio no disponible'):
-                return False
-            if '%' in v:
-                return True
-            return 'antes' in v or 'ahorro' in v
-
-        productos_con_desc = [p for p in productos if tiene_descuento(p)]
-        if productos_con_desc:
-            productos = productos_con_desc
+class RendimientoBusquedas:
+    """Fracción de productos de PAAPI que acaban siendo elegibles (descuento +
+    palabra clave), por búsqueda, como media móvil exponencial. Acotado en
+    número de búsquedas (LRU)."""
+
+    def __init__(self, inicial: float, alpha: float, max_entries: int):
+        self.inicial = inicial
+        self.alpha = alpha
+        self.max_entries = max_entries
+        self._data: "OrderedDict[tuple, float]" = OrderedDict()
+        self.lotes = 0
+        self.paginas = 0
+        self.rondas_extra = 0
+
+    def estimar(self, clave: tuple) -> float:
+        valor = self._data.get(clave)
+        if valor is None:
+            return self.inicial
+        self._data.move_to_end(clave)
+        return valor
+
+    def observar(self, clave: tuple, rendimiento: float):
+        previo = self._data.get(clave)
+        self._data[clave] = rendimiento if previo is None else previo + self.alpha * (rendimiento - previo)
+        self._data.move_to_end(clave)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "busquedas": len(self._data), "lotes": self.lotes, "paginas": self.paginas,
+            "rondas_extra": self.rondas_extra,
+        }
+
+
+rendimiento_busquedas = RendimientoBusquedas(FETCH_RENDIMIENTO_INICIAL, FETCH_RENDIMIENTO_ALPHA, FETCH_MAX_BUSQUEDAS)
+
+
+def _items_a_pedir(faltan: int, rendimiento: float, paginas_libres: int) -> int:
+    """Items (en páginas completas de 10) que se espera que den ``faltan`` elegibles."""
+    n = faltan / max(rendimiento, 0.05) * FETCH_MARGEN
+    return min(paginas_libres, max(1, math.ceil(n / 10))) * 10
+
+
+async def seleccionar_grupos(req: LoteRequest) -> List[List[Producto]]:
+    """Busca productos para el lote, los filtra y los reparte entre los artículos."""
+    max_total = req.num_articulos * req.items_por_articulo
+
+    # Construir keywords para PAAPI: si hay palabra_clave_principal, usamos
+    # exclusivamente esa (ej. "aspiradoras"), sin añadir "black friday" u
+    # otros términos. Si no hay principal, usamos busqueda.
+    base_kw = (req.busqueda or "").strip()
+    main_kw = (req.palabra_clave_principal or "").strip()
+    base_kw_lower = base_kw.lower()
+    if main_kw:
+        kw_paapi = main_kw
+    else:
+        # Modo especial Black Friday: usamos "Black Friday" como contexto
+        # editorial, pero no como keyword directa para PAAPI porque suele
+        # devolver pocos o ningún resultado útil. Intentamos extraer la
+        # parte de producto de la búsqueda, y si queda vacía usamos un
+        # genérico como "ofertas".
+        if "black friday" in base_kw_lower:
+            producto = base_kw_lower.replace("black friday", "").strip(" ,.-")
+            kw_paapi = producto or "ofertas"
         else:
-            # Modo especial Black Friday: algunas ofertas reales no vienen marcadas
-            # limpiamente en PAAPI. Si la búsqueda contiene "black friday" y no
-            # hemos detectado descuentos, usamos como fallback los productos que al
-            # menos tienen un precio disponible, para no quedarnos sin artículos.
-            base_kw_lower = (req.busqueda or "").strip().lower()
-            if "black friday" in base_kw_lower:
-                candidatos_fallback = [p for p in productos if has_precio(p)]
-                productos = candidatos_fallback
-            else:
-                # En el resto de casos seguimos siendo estrictos: sin descuento,
-                # preferimos no generar artículos.
-                productos = []
-
-        # Filtrar por palabra clave principal en el título cuando exista.
-        # Si no hay coincidencias, preferimos quedarnos sin productos antes que mezclar categorías.
-        main_kw = (req.palabra_clave_principal or '').strip().lower()
-        if main_kw:
-            def match_main(p):
-                t = (p.titulo or '').lower()
-                # Comparamos por palabras con un stemming muy simple para cubrir
-                # singular/plural y masculino/femenino de forma genérica.
-                kw_tokens = [tok for tok in re.split(r"\W+", main_kw) if tok]
-                title_tokens = [tok for tok in re.split(r"\W+", t) if tok]
-                stem_kw = {_stem_es(tok) for tok in kw_tokens}
-                stem_title = {_stem_es(tok) for tok in title_tokens}
-                return bool(stem_kw & stem_title)
-            productos = [p for p in productos if match_main(p)]
-
-        # Distribuir los productos disponibles de forma lo más equilibrada posible
-        # entre los artículos, sin repetir productos y respetando el máximo
-        # items_por_articulo.
-        productos = productos[:max_total]
-        total_disp = len(productos)
-        grupos: List[List[Producto]] = []
-        if total_disp == 0:
-            grupos = []
+            kw_paapi = base_kw
+
+    # Para este generador, priorizamos SIEMPRE productos en oferta y, con
+    # palabra clave principal, que el título case con ella: si no hay
+    # coincidencias, preferimos quedarnos sin productos antes que mezclar categorías.
+    matcher = KeywordMatcher(req.palabra_clave_principal or '')
+    black_friday = "black friday" in base_kw_lower
+
+    # Pedimos a PAAPI más productos de los que necesitamos, porque parte no
+    # pasará los filtros: tantos como indique el rendimiento de esta búsqueda
+    # en lotes anteriores, y más páginas solo si aún faltan.
+    clave = (kw_paapi.lower(), (req.categoria or "").strip().lower(), main_kw.lower(), black_friday)
+    rendimiento = rendimiento_busquedas.estimar(clave)
+    productos: List[Producto] = []
+    vistos = set()
+    elegidos: List[Producto] = []
+    pagina = 1
+    while pagina <= PAAPI_MAX_PAGINAS:
+        pedir = _items_a_pedir(max_total - len(elegidos), rendimiento, PAAPI_MAX_PAGINAS - pagina + 1)
+        if pagina == 1:
+            nuevos = await buscar_productos(kw_paapi, req.categoria, pedir)
         else:
-            base = total_disp // req.num_articulos
-            extra = total_disp % req.num_articulos
-            idx_p = 0
-            for i in range(req.num_articulos):
-                # Número objetivo para este artículo (no superar items_por_articulo)
-                target = base + (1 if i < extra else 0)
-                target = min(target, req.items_por_articulo)
-                if target <= 0:
-                    grupos.append([])
-                    continue
-                grupos.append(productos[idx_p: idx_p + target])
-                idx_p += target
-
-        articulos: List[Articulo] = []
-        idx = 1
-        for grupo in grupos:
-            tema = req.tema or f"Selección de productos más vendidos de ({req.busqueda}) #{idx}"
-            articulo = await generar_articulo(tema, grupo, req.palabra_clave_principal, req.palabras_clave_secundarias)
-            articulos.append(articulo)
-            idx += 1
-        return LoteResponse(articulos=articulos)
+            rendimiento_busquedas.rondas_extra += 1
+            nuevos = await buscar_productos(kw_paapi, req.categoria, pedir, pagina_inicial=pagina)
+        pagina += pedir // 10
+        for p in nuevos:
+            clave_p = getattr(p, "asin", None) or p.url_producto
+            if clave_p not in vistos:
+                vistos.add(clave_p)
+                productos.append(p)
+        # El ranking es voraz: el top-k es el prefijo del ranking completo
+        elegidos = rankear_productos(productos, matcher, len(productos), black_friday)
+        if len(elegidos) >= max_total or len(nuevos) < pedir:
+            break
+        rendimiento = len(elegidos) / len(productos) if productos else rendimiento
+    rendimiento_busquedas.lotes += 1
+    if productos:
+        rendimiento_busquedas.observar(clave, len(elegidos) / len(productos))
+    return repartir_productos(elegidos[:max_total], req.num_articulos, req.items_por_articulo)
+
+
+def _tema_articulo(req: LoteRequest, idx: int) -> str:
+    return req.tema or f"Selección de productos más vendidos de ({req.busqueda}) #{idx}"
+
+
+async def _generar_aislado(req: LoteRequest, idx: int, grupo: List[Producto], sem: asyncio.Semaphore) -> Articulo:
+    """Genera un artículo; un fallo se devuelve como artículo con `error` en lugar de propagarse."""
+    tema = _tema_articulo(req, idx)
+    async with sem:
+        try:
+            return await generar_articulo(tema, grupo, req.palabra_clave_principal, req.palabras_clave_secundarias,
+                                          force_fresh=req.forzar)
+        except Exception as e:
+            detalle = e.detail if isinstance(e, HTTPException) else str(e)
+            return Articulo(titulo=tema, subtitulo="", articulo="", error=str(detalle))
+
+
+async def generar_grupos(req: LoteRequest, grupos: List[List[Producto]]) -> List[Articulo]:
+    """Genera los artículos en paralelo (hasta GEN_CONCURRENCY) en el orden de `grupos`."""
+    sem = asyncio.Semaphore(GEN_CONCURRENCY)
+    articulos = await asyncio.gather(*(
+        _generar_aislado(req, idx, grupo, sem) for idx, grupo in enumerate(grupos, start=1)
+    ))
+    if articulos and all(a.error for a in articulos):
+        # Si no ha salido ninguno, el lote entero es un error del generador
+        raise HTTPException(status_code=502, detail=f"Error Generador: {articulos[0].error}")
+    return list(articulos)
+
+
+async def iter_articulos(req: LoteRequest, grupos: List[List[Producto]]):
+    """Genera los artículos en paralelo y los entrega (idx, Articulo) según terminan.
+
+    Si el consumidor deja de iterar (p. ej. el cliente corta el stream), se
+    cancelan las generaciones pendientes.
+    """
+    sem = asyncio.Semaphore(GEN_CONCURRENCY)
+
+    async def uno(idx: int, grupo: List[Producto]):
+        return idx, await _generar_aislado(req, idx, grupo, sem)
+
+    tareas = [asyncio.create_task(uno(idx, grupo)) for idx, grupo in enumerate(grupos, start=1)]
+    try:
+        for siguiente in asyncio.as_completed(tareas):
+            yield await siguiente
+    finally:
+        for t in tareas:
+            t.cancel()
+
+
+def _evento_ndjson(evento: dict) -> bytes:
+    return (json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@app.post("/generar-articulos/stream")
+async def generar_articulos_stream(req: LoteRequest):
+    """Como /generar-articulos, pero en NDJSON: un evento por línea en cuanto
+    termina cada artículo.
+
+    Eventos: ``inicio`` (total), ``articulo`` (idx, articulo), ``error`` (idx,
+    titulo, error) para un artículo fallido, ``progreso`` (hechos, total) tras
+    cada uno y ``fin`` (hechos, errores). Los errores de búsqueda se devuelven
+    antes de empezar el stream, con su código HTTP.
+    """
+    req = _forzado(req, siempre=True)
+    try:
+        grupos = await seleccionar_grupos(req)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def eventos():
+        total = len(grupos)
+        hechos = errores = 0
+        yield _evento_ndjson({"tipo": "inicio", "total": total})
+        async for idx, articulo in iter_articulos(req, grupos):
+            hechos += 1
+            if articulo.error:
+                errores += 1
+                yield _evento_ndjson({"tipo": "error", "idx": idx, "titulo": articulo.titulo, "error": articulo.error})
+            else:
+                yield _evento_ndjson({"tipo": "articulo", "idx": idx, "articulo": articulo.model_dump()})
+            yield _evento_ndjson({"tipo": "progreso", "hechos": hechos, "total": total})
+        yield _evento_ndjson({"tipo": "fin", "hechos": hechos, "errores": errores})
 
-def build_wpai_xml(req: LoteRequest, articulos: List[Articulo]) -> str:
-    """Construye XML simple compatible con WP All Import.
-    El título del post se genera de forma sintética a partir de los parámetros
-    de búsqueda, para evitar restos como '#1' o '(Black Friday)'.
+    # X-Accel-Buffering: que un proxy intermedio no acumule el stream
+    return StreamingResponse(eventos(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class LoteCache:
+    """LRU con TTL de lotes ya generados, por hash canónico de la petición.
+
+    Solo se guardan lotes completos (sin artículos fallidos ni vacíos). Cada
+    entrada lleva un ETag derivado del contenido, para If-None-Match.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[str, Tuple[float, LoteResponse, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, clave: str) -> Optional[Tuple[LoteResponse, str]]:
+        entrada = self._data.get(clave)
+        if entrada is None or entrada[0] <= self._clock():
+            if entrada is not None:
+                del self._data[clave]
+            self.misses += 1
+            return None
+        self._data.move_to_end(clave)
+        self.hits += 1
+        return entrada[1], entrada[2]
+
+    def set(self, clave: str, lote: LoteResponse) -> Optional[str]:
+        """Guarda el lote si es cacheable y devuelve su ETag (None si no se guarda)."""
+        if self.max_entries <= 0 or not lote.articulos or any(a.error for a in lote.articulos):
+            return None
+        etag = '"' + hashlib.sha256(lote.model_dump_json().encode("utf-8")).hexdigest()[:32] + '"'
+        self._data[clave] = (self._clock() + self.ttl, lote, etag)
+        self._data.move_to_end(clave)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        return etag
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data), "max_entries": self.max_entries, "ttl": self.ttl,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        }
+
+
+lote_cache = LoteCache(LOTE_CACHE_MAX_ENTRIES, LOTE_CACHE_TTL)
+
+
+def clave_lote(req: LoteRequest) -> str:
+    """Hash canónico de los campos de LoteRequest (ignora `forzar` y campos de subclases como `formato`)."""
+    datos = req.model_dump(include=set(LoteRequest.model_fields) - {"forzar"})
+    canon = json.dumps(datos, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+def _no_modificado(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    if not if_none_match or not etag:
+        return False
+    etiquetas = {t.strip() for t in if_none_match.split(",")}
+    return "*" in etiquetas or etag in etiquetas or f"W/{etag}" in etiquetas
+
+
+def _sin_cache(cache_control: Optional[str]) -> bool:
+    """True si la petición pide saltarse la caché (Cache-Control: no-cache/no-store)."""
+    if not cache_control:
+        return False
+    directivas = {d.strip().lower() for d in cache_control.split(",")}
+    return bool(directivas & {"no-cache", "no-store"})
+
+
+def _forzado(req: LoteRequest, cache_control: Optional[str] = None, siempre: bool = False) -> LoteRequest:
+    """La petición con ``forzar`` activado si se pide (o Cache-Control: no-cache)."""
+    if req.forzar or not (siempre or _sin_cache(cache_control)):
+        return req
+    return req.model_copy(update={"forzar": True})
+
+
+async def obtener_lote(req: LoteRequest) -> Tuple[LoteResponse, Optional[str]]:
+    """Lote de la caché o recién generado (y cacheado), con su ETag si lo tiene.
+
+    Con ``req.forzar`` siempre se genera de nuevo (también en el generador,
+    sin su caché de completions), pero el resultado reemplaza la entrada: un
+    export posterior sirve lo que se acaba de generar.
     """
-    from xml.sax.saxutils import escape
-    xml_parts = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>", "<items>"]
-
-    def _synthetic_title(idx: int) -> str:
-        q = (req.busqueda or "").strip()
-        kw = (req.palabra_clave_principal or "").strip()
-        q_lower = q.lower()
-
-        # Caso especial: Black Friday u otras promos en la búsqueda
-        if "black friday" in q_lower:
-            contexto = "Black Friday"
-            # Intentar extraer el tipo de producto de la búsqueda si no hay palabra principal
-            producto = kw or q_lower.replace("black friday", "").strip(" ,-")
-            if producto:
-                return f"Selección de {producto} más vendidos en {contexto}"
-            return f"Selección de productos más vendidos en {contexto}"
-
-        # Caso general sin Black Friday
-        if kw and q:
-            # Ej: busqueda="jabón", kw="orgánico" -> "Selección de jabón orgánico más vendidos"
-            return f"Selección de {q} {kw} más vendidos"
-        if kw:
-            return f"Selección de {kw} más vendidos"
-        if q:
-            return f"Selección de {q} más vendidos"
-        return "Selección de productos más vendidos"
-
-    # Precalcular lista de hero válidas (no vacías) para rotación
-    heroes = [u for u in HERO_IMAGES if u]
-
-    for idx, a in enumerate(articulos, start=1):
-        xml_parts.append("  <item>")
-        post_title = _synthetic_title(idx)
+    clave = clave_lote(req)
+    cacheado = None if req.forzar else lote_cache.get(clave)
+    if cacheado is not None:
+        return cacheado
+    grupos = await seleccionar_grupos(req)
+    lote = LoteResponse(articulos=await generar_grupos(req, grupos))
+    return lote, lote_cache.set(clave, lote)
+
+
+@app.post("/generar-articulos", response_model=LoteResponse)
+async def generar_articulos(req: LoteRequest):
+    # Cada llamada genera contenido nuevo; las cachés solo las leen los exports
+    try:
+        lote, _ = await obtener_lote(_forzado(req, siempre=True))
+        return lote
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _synthetic_title(req: LoteRequest) -> str:
+    """Título del post generado a partir de los parámetros de búsqueda, para
+    evitar restos como '#1' o '(Black Friday)'."""
+    q = (req.busqueda or "").strip()
+    kw = (req.palabra_clave_principal or "").strip()
+    q_lower = q.lower()
+
+    # Caso especial: Black Friday u otras promos en la búsqueda
+    if "black friday" in q_lower:
+        contexto = "Black Friday"
+        # Intentar extraer el tipo de producto de la búsqueda si no hay palabra principal
+        producto = kw or q_lower.replace("black friday", "").strip(" ,-")
+        if producto:
+            return f"Selección de {producto} más vendidos en {contexto}"
+        return f"Selección de productos más vendidos en {contexto}"
+
+    # Caso general sin Black Friday
+    if kw and q:
+        # Ej: busqueda="jabón", kw="orgánico" -> "Selección de jabón orgánico más vendidos"
+        return f"Selección de {q} {kw} más vendidos"
+    if kw:
+        return f"Selección de {kw} más vendidos"
+    if q:
+        return f"Selección de {q} más vendidos"
+    return "Selección de productos más vendidos"
+
+
+class WpaiXmlWriter:
+    """Escribe el XML de WP All Import por trozos: cabecera, un ``<item>`` por
+    artículo según se van teniendo y pie. Nada se acumula entre items, así que
+    la memoria no crece con el número de artículos."""
+
+    CABECERA = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<items>\n"
+    PIE = "</items>"
+
+    def __init__(self, req: LoteRequest):
+        self.post_title = _synthetic_title(req)
+        # Precalcular lista de hero válidas (no vacías) para rotación
+        self.heroes = [u for u in HERO_IMAGES if u]
+        self.escritos = 0
+
+    def item(self, a: Articulo) -> str:
+        """Bloque ``<item>`` del artículo ('' si es un artículo fallido, que no se exporta)."""
+        if a.error:
+            return ""
+        self.escritos += 1
+        idx = self.escritos
+        post_title = self.post_title
+        xml_parts = ["  <item>"]
         xml_parts.append(f"    <post_title>{escape(post_title)}</post_title>")
         xml_parts.append(f"    <post_excerpt>{escape(a.subtitulo)}</post_excerpt>")
         xml_parts.append(f"    <post_content><![CDATA[{a.articulo}]]></post_content>")
@@ -347,12 +966,12 @@ def build_wpai_xml(req: LoteRequest, articulos: List[Articulo]) -> str:
         # un índice derivado del título sintético en lugar del índice
         # secuencial del artículo.
         # Si no hay ninguna configurada, simplemente no añadimos el campo.
-        if heroes:
+        if self.heroes:
             try:
-                h_idx = abs(hash(post_title)) % len(heroes)
+                h_idx = abs(hash(post_title)) % len(self.heroes)
             except Exception:
-                h_idx = (idx - 1) % len(heroes)
-            hero_url = heroes[h_idx]
+                h_idx = (idx - 1) % len(self.heroes)
+            hero_url = self.heroes[h_idx]
             xml_parts.append(f"    <featured_image>{escape(hero_url)}</featured_image>")
         # Campos auxiliares para WP All Import (evitar rellenar a mano)
         xml_parts.append("    <category>Productos recomendados</category>")
@@ -360,9 +979,123 @@ def build_wpai_xml(req: LoteRequest, articulos: List[Articulo]) -> str:
         xml_parts.append("    <caption>Amazon</caption>")
         xml_parts.append("    <post_status>draft</post_status>")
         xml_parts.append("    <post_type>post</post_type>")
-        xml_parts.append("  </item>")
-    xml_parts.append("</items>")
-    return "\n".join(xml_parts)
+        xml_parts.append("  </item>\n")
+        return "\n".join(xml_parts)
+
+
+def iter_wpai_xml(req: LoteRequest, articulos: Iterable[Articulo]) -> Iterator[str]:
+    """XML simple compatible con WP All Import, un trozo por artículo."""
+    writer = WpaiXmlWriter(req)
+    yield writer.CABECERA
+    for a in articulos:
+        bloque = writer.item(a)
+        if bloque:
+            yield bloque
+    yield writer.PIE
+
+
+def build_wpai_xml(req: LoteRequest, articulos: List[Articulo]) -> str:
+    """Construye XML simple compatible con WP All Import en un único string."""
+    return "".join(iter_wpai_xml(req, articulos))
+
+
+class _SalidaZip(io.RawIOBase):
+    """Destino de ZipFile que solo guarda lo escrito hasta que se vacía. Como
+    no es seekable, zipfile escribe cada entrada con data descriptor y nunca
+    vuelve atrás, así que lo ya vaciado se puede enviar al cliente."""
+
+    def __init__(self):
+        super().__init__()
+        self._trozos: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._trozos.append(bytes(b))
+        return len(b)
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._trozos)
+        self._trozos.clear()
+        return datos
+
+
+class ZipExport:
+    """ZIP de exportación (un Markdown por artículo y el XML de WP All Import)
+    producido por trozos.
+
+    Cada artículo se comprime y se entrega en cuanto llega; sus ``<item>`` se
+    van guardando en un SpooledTemporaryFile (pasa a disco por encima de
+    ZIP_SPOOL_MAX_BYTES) y el XML se escribe como última entrada. La memoria
+    usada no depende del tamaño del archivo.
+    """
+
+    NOMBRE_XML = "theobjective_articulos.xml"
+    TROZO_XML = 64 * 1024
+
+    def __init__(self, req: LoteRequest, compresslevel: Optional[int] = None):
+        nivel = ZIP_COMPRESSLEVEL if compresslevel is None else compresslevel
+        self._salida = _SalidaZip()
+        if nivel > 0:
+            self._zf = zipfile.ZipFile(self._salida, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=nivel)
+        else:
+            self._zf = zipfile.ZipFile(self._salida, mode="w", compression=zipfile.ZIP_STORED)
+        self._xml = WpaiXmlWriter(req)
+        self._spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES)
+        self._spool.write(self._xml.CABECERA.encode("utf-8"))
+
+    def _entrada(self, nombre: str, trozos: Iterable[bytes]) -> Iterator[bytes]:
+        # Abriendo por nombre, ZipFile aplica la compresión y el compresslevel
+        # del archivo. Las entradas llevan la fecha por defecto de zipfile, así
+        # que el mismo lote da siempre los mismos bytes (como promete su ETag)
+        with self._zf.open(nombre, mode="w") as f:
+            for trozo in trozos:
+                f.write(trozo)
+                datos = self._salida.vaciar()
+                if datos:
+                    yield datos
+        datos = self._salida.vaciar()
+        if datos:
+            yield datos
+
+    def articulo(self, a: Articulo) -> Iterator[bytes]:
+        """Bytes del ZIP correspondientes al artículo (nada si es un artículo fallido)."""
+        bloque = self._xml.item(a)
+        if not bloque:
+            return
+        self._spool.write(bloque.encode("utf-8"))
+        md = f"# {a.titulo}\n\n_{a.subtitulo}_\n\n{a.articulo}\n"
+        yield from self._entrada(f"articulo_{self._xml.escritos:02d}.md", [md.encode("utf-8")])
+
+    def finalizar(self) -> Iterator[bytes]:
+        """Entrada XML y directorio central."""
+        try:
+            self._spool.write(self._xml.PIE.encode("utf-8"))
+            self._spool.seek(0)
+            yield from self._entrada(self.NOMBRE_XML, iter(lambda: self._spool.read(self.TROZO_XML), b""))
+            self._zf.close()
+            yield self._salida.vaciar()
+        finally:
+            self.cerrar()
+
+    def cerrar(self):
+        self._spool.close()
+
+
+def iter_zip(req: LoteRequest, articulos: Iterable[Articulo]) -> Iterator[bytes]:
+    zip_export = ZipExport(req)
+    try:
+        for a in articulos:
+            yield from zip_export.articulo(a)
+        yield from zip_export.finalizar()
+    finally:
+        zip_export.cerrar()
+
+
+def build_zip(req: LoteRequest, articulos: List[Articulo]) -> bytes:
+    """ZIP con el XML de WP All Import y un Markdown por artículo."""
+    return b"".join(iter_zip(req, articulos))
 
 
 class ExportRequest(LoteRequest):
@@ -372,36 +1105,401 @@ class ExportResponse(BaseModel):
     xml: str
 
 @app.post("/export/wp-all-import", response_model=ExportResponse)
-async def export_wp_all_import(req: ExportRequest):
-    lote = await generar_articulos(req)
+async def export_wp_all_import(req: ExportRequest, response: Response,
+                               if_none_match: Optional[str] = Header(default=None),
+                               cache_control: Optional[str] = Header(default=None)):
+    req = _forzado(req, cache_control)
+    try:
+        lote, etag = await obtener_lote(req)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if _no_modificado(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if etag:
+        response.headers["ETag"] = etag
     xml = build_wpai_xml(req, lote.articulos)
     return ExportResponse(xml=xml)
 
 
+async def _articulos_export(req: LoteRequest, clave: str):
+    """Arranca la generación para un export en streaming.
+
+    Espera al primer artículo correcto (así el 502 de "fallaron todos" se da
+    antes de empezar a responder) y devuelve un iterador async de Articulo en
+    el orden del lote, igual que al servirlo desde la caché: los que terminan
+    antes que uno anterior esperan en un buffer de reordenación. Los ya
+    entregados solo se retienen si el lote puede quedar en caché, y al
+    agotarse, si salió completo, se guarda.
+    """
+    try:
+        grupos = await seleccionar_grupos(req)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    resto = iter_articulos(req, grupos)
+    pendientes = {}
+    async for idx, a in resto:
+        pendientes[idx] = a
+        if not a.error:
+            break
+    else:
+        if pendientes:
+            await resto.aclose()
+            primero = pendientes[min(pendientes)]
+            raise HTTPException(status_code=502, detail=f"Error Generador: {primero.error}")
+
+    async def articulos():
+        siguiente = 1
+        # Un lote con fallos no se cachea, así que tampoco se retiene
+        entregados: Optional[List[Articulo]] = [] if lote_cache.max_entries > 0 else None
+        try:
+            while siguiente <= len(grupos):
+                if siguiente not in pendientes:
+                    recibido = await anext(resto, None)
+                    if recibido is None:
+                        return
+                    pendientes[recibido[0]] = recibido[1]
+                    continue
+                a = pendientes.pop(siguiente)
+                siguiente += 1
+                if entregados is not None:
+                    if a.error:
+                        entregados = None
+                    else:
+                        entregados.append(a)
+                yield a
+        finally:
+            await resto.aclose()
+        if entregados is not None and len(entregados) == len(grupos):
+            lote_cache.set(clave, LoteResponse(articulos=entregados))
+
+    return articulos()
+
+
 @app.post("/export/wp-all-import/file")
-async def export_wp_all_import_file(req: ExportRequest):
-    lote = await generar_articulos(req)
-    xml = build_wpai_xml(req, lote.articulos)
+async def export_wp_all_import_file(req: ExportRequest, if_none_match: Optional[str] = Header(default=None),
+                                  cache_control: Optional[str] = Header(default=None)):
+    """XML en streaming. Con el lote en caché se sirve desde ahí (con ETag,
+    salvo ``forzar`` o ``Cache-Control: no-cache``); si no, cada ``<item>`` se
+    envía en cuanto están listos él y los anteriores (en el orden del lote),
+    sin montar el documento entero en memoria."""
     headers = {
         "Content-Disposition": "attachment; filename=theobjective_articulos.xml"
     }
-    return Response(content=xml, media_type="application/xml", headers=headers)
+    req = _forzado(req, cache_control)
+    clave = clave_lote(req)
+    cacheado = None if req.forzar else lote_cache.get(clave)
+    if cacheado is not None:
+        lote, etag = cacheado
+        if _no_modificado(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return StreamingResponse(iter_wpai_xml(req, lote.articulos), media_type="application/xml",
+                                 headers={**headers, "ETag": etag})
 
+    articulos = await _articulos_export(req, clave)
 
-@app.post("/export/wp-all-import/zip")
-async def export_wp_all_import_zip(req: ExportRequest):
-    lote = await generar_articulos(req)
-    xml = build_wpai_xml(req, lote.articulos)
+    async def trozos():
+        writer = WpaiXmlWriter(req)
+        try:
+            yield writer.CABECERA.encode("utf-8")
+            async for a in articulos:
+                bloque = writer.item(a)
+                if bloque:
+                    yield bloque.encode("utf-8")
+            yield writer.PIE.encode("utf-8")
+        finally:
+            await articulos.aclose()
+
+    return StreamingResponse(trozos(), media_type="application/xml", headers=headers)
 
-    memfile = io.BytesIO()
-    with zipfile.ZipFile(memfile, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("theobjective_articulos.xml", xml)
-        for idx, a in enumerate(lote.articulos, start=1):
-            md = f"# {a.titulo}\n\n_{a.subtitulo}_\n\n{a.articulo}\n"
-            zf.writestr(f"articulo_{idx:02d}.md", md)
-    memfile.seek(0)
+
+@app.post("/export/wp-all-import/zip")
+async def export_wp_all_import_zip(req: ExportRequest, if_none_match: Optional[str] = Header(default=None),
+                                 cache_control: Optional[str] = Header(default=None)):
+    """ZIP en streaming: cada Markdown sale en cuanto están listos su artículo
+    y los anteriores, y el XML va al final. Con el lote en caché se sirve desde
+    ahí (con ETag, salvo ``forzar`` o ``Cache-Control: no-cache``)."""
     headers = {"Content-Disposition": "attachment; filename=theobjective_export.zip"}
-    return Response(content=memfile.read(), media_type="application/zip", headers=headers)
+    req = _forzado(req, cache_control)
+    clave = clave_lote(req)
+    cacheado = None if req.forzar else lote_cache.get(clave)
+    if cacheado is not None:
+        lote, etag = cacheado
+        if _no_modificado(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return StreamingResponse(iter_zip(req, lote.articulos), media_type="application/zip",
+                                 headers={**headers, "ETag": etag})
+
+    articulos = await _articulos_export(req, clave)
+
+    async def trozos():
+        zip_export = ZipExport(req)
+        try:
+            async for a in articulos:
+                for datos in zip_export.articulo(a):
+                    yield datos
+            for datos in zip_export.finalizar():
+                yield datos
+        finally:
+            zip_export.cerrar()
+            await articulos.aclose()
+
+    return StreamingResponse(trozos(), media_type="application/zip", headers=headers)
+
+
+# Jobs asíncronos: el lote se genera en segundo plano y el cliente consulta
+# el progreso en /jobs/{id}. Con FRONTEND_JOBS_DB apuntando a un fichero (en
+# docker-compose, /data/frontend_jobs.sqlite3 en un volumen) los jobs
+# sobreviven a un reinicio y se reanudan generando solo lo que falte. Vacío =
+# en memoria, solo para desarrollo y tests: un reinicio pierde los jobs.
+# No pasan por lote_cache: como /generar-articulos, cada job genera contenido
+# nuevo, y su artefacto sale de los artículos guardados en el JobStore (los
+# mismos cuyo progreso se ha informado), que duran más que el TTL de la caché.
+JOBS_DB = os.getenv("FRONTEND_JOBS_DB") or ":memory:"
+JOB_WORKERS = max(1, int(os.getenv("FRONTEND_JOB_WORKERS", 2)))
+FORMATOS_JOB = ("json", "xml", "zip")
+
+
+class JobStore:
+    """Jobs de generación persistidos en SQLite (modo WAL).
+
+    ``jobs`` guarda la petición, el formato de exportación, el estado y los
+    grupos de productos ya seleccionados (para no repetir la búsqueda al
+    reanudar); ``job_articulos`` guarda cada artículo en cuanto termina. Las
+    operaciones son síncronas y cortas; el worker las ejecuta con
+    asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, estado TEXT NOT NULL, formato TEXT NOT NULL, "
+            "request TEXT NOT NULL, grupos TEXT, error TEXT, creado REAL NOT NULL, actualizado REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs (estado)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_articulos (job_id TEXT NOT NULL, idx INTEGER NOT NULL, "
+            "articulo TEXT NOT NULL, PRIMARY KEY (job_id, idx))"
+        )
+
+    def crear(self, req: LoteRequest, formato: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = self._clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, estado, formato, request, creado, actualizado) VALUES (?, 'pendiente', ?, ?, ?, ?)",
+                (job_id, formato, req.model_dump_json(), now, now),
+            )
+        return job_id
+
+    def obtener(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, estado, formato, request, grupos, error, creado, actualizado FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            hechos, errores = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(json_extract(articulo, '$.error') IS NOT NULL), 0) "
+                "FROM job_articulos WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        job = dict(zip(("id", "estado", "formato", "request", "grupos", "error", "creado", "actualizado"), row))
+        job["request"] = LoteRequest.model_validate_json(job["request"])
+        job["grupos"] = json.loads(job["grupos"]) if job["grupos"] is not None else None
+        job["total"] = len(job["grupos"]) if job["grupos"] is not None else None
+        job["hechos"] = hechos
+        job["errores"] = errores
+        return job
+
+    def guardar_grupos(self, job_id: str, grupos: List[List[dict]]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET grupos = ?, actualizado = ? WHERE id = ?",
+                (json.dumps(grupos, ensure_ascii=False), self._clock(), job_id),
+            )
+
+    def guardar_articulo(self, job_id: str, idx: int, articulo: Articulo):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_articulos (job_id, idx, articulo) VALUES (?, ?, ?)",
+                (job_id, idx, articulo.model_dump_json()),
+            )
+            self._conn.execute("UPDATE jobs SET actualizado = ? WHERE id = ?", (self._clock(), job_id))
+
+    def articulos(self, job_id: str) -> dict:
+        """idx (desde 1) -> Articulo de los que ya están generados."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, articulo FROM job_articulos WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        return {idx: Articulo.model_validate_json(a) for idx, a in rows}
+
+    def marcar(self, job_id: str, estado: str, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET estado = ?, error = ?, actualizado = ? WHERE id = ?",
+                (estado, error, self._clock(), job_id),
+            )
+
+    def pendientes(self) -> List[str]:
+        """Jobs sin terminar (también los que estaban en curso al caer el proceso)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE estado IN ('pendiente', 'en_curso') ORDER BY creado"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT estado, COUNT(*) FROM jobs GROUP BY estado").fetchall()
+        return {"path": self.path, **dict(rows)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+job_store = JobStore(JOBS_DB)
+_job_queue: Optional[asyncio.Queue] = None
+_job_workers: List[asyncio.Task] = []
+
+
+async def _ejecutar_job(job_id: str):
+    job = await asyncio.to_thread(job_store.obtener, job_id)
+    if job is None or job["estado"] not in ("pendiente", "en_curso"):
+        return
+    await asyncio.to_thread(job_store.marcar, job_id, "en_curso")
+    req = job["request"]
+    try:
+        if job["grupos"] is None:
+            grupos = await seleccionar_grupos(req)
+            await asyncio.to_thread(job_store.guardar_grupos, job_id, [[p.model_dump() for p in g] for g in grupos])
+        else:
+            grupos = [[Producto(**d) for d in g] for g in job["grupos"]]
+        # Al reanudar solo se generan los que faltan (y se reintentan los fallidos)
+        hechos = {i: a for i, a in (await asyncio.to_thread(job_store.articulos, job_id)).items() if not a.error}
+        sem = asyncio.Semaphore(GEN_CONCURRENCY)
+
+        async def generar(idx: int, grupo: List[Producto]) -> Articulo:
+            articulo = await _generar_aislado(req, idx, grupo, sem)
+            await asyncio.to_thread(job_store.guardar_articulo, job_id, idx, articulo)
+            return articulo
+
+        nuevos = await asyncio.gather(*(
+            generar(idx, grupo) for idx, grupo in enumerate(grupos, start=1) if idx not in hechos
+        ))
+        if not hechos and nuevos and all(a.error for a in nuevos):
+            await asyncio.to_thread(job_store.marcar, job_id, "error", f"Error Generador: {nuevos[0].error}")
+        else:
+            await asyncio.to_thread(job_store.marcar, job_id, "completado")
+    except HTTPException as e:
+        await asyncio.to_thread(job_store.marcar, job_id, "error", str(e.detail))
+    except Exception as e:
+        await asyncio.to_thread(job_store.marcar, job_id, "error", str(e))
+
+
+async def _worker_jobs():
+    while True:
+        job_id = await _job_queue.get()
+        try:
+            await _ejecutar_job(job_id)
+        finally:
+            _job_queue.task_done()
+
+
+@app.on_event("startup")
+async def _iniciar_jobs():
+    global _job_queue
+    if JOBS_DB == ":memory:":
+        logging.getLogger("uvicorn").warning(
+            "frontend-api: FRONTEND_JOBS_DB vacío, los jobs se guardan en memoria y se pierden al reiniciar")
+    _job_queue = asyncio.Queue()
+    for job_id in await asyncio.to_thread(job_store.pendientes):
+        _job_queue.put_nowait(job_id)
+    _job_workers[:] = [asyncio.create_task(_worker_jobs()) for _ in range(JOB_WORKERS)]
+
+
+@app.on_event("shutdown")
+async def _parar_jobs():
+    # Los jobs cortados quedan 'en_curso' y se reanudan en el siguiente arranque
+    for t in _job_workers:
+        t.cancel()
+    await asyncio.gather(*_job_workers, return_exceptions=True)
+    _job_workers.clear()
+
+
+class JobRequest(LoteRequest):
+    formato: str = Field(default="json", pattern=f"^({'|'.join(FORMATOS_JOB)})$", description="json | xml | zip")
+
+
+class JobEstado(BaseModel):
+    id: str
+    estado: str
+    formato: str
+    total: Optional[int] = None
+    hechos: int = 0
+    errores: int = 0
+    error: Optional[str] = None
+    artefacto: Optional[str] = None
+    creado: float
+    actualizado: float
+
+
+def _estado_job(job: dict) -> JobEstado:
+    return JobEstado(
+        id=job["id"], estado=job["estado"], formato=job["formato"], total=job["total"],
+        hechos=job["hechos"], errores=job["errores"], error=job["error"],
+        artefacto=f"/jobs/{job['id']}/artefacto" if job["estado"] == "completado" else None,
+        creado=job["creado"], actualizado=job["actualizado"],
+    )
+
+
+async def _job_o_404(job_id: str) -> dict:
+    job = await asyncio.to_thread(job_store.obtener, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
+
+
+@app.post("/jobs", response_model=JobEstado, status_code=202)
+async def crear_job(req: JobRequest):
+    if _job_queue is None:
+        raise HTTPException(status_code=503, detail="Workers de jobs no iniciados")
+    lote = _forzado(LoteRequest(**req.model_dump(exclude={"formato"})), siempre=True)
+    job_id = await asyncio.to_thread(job_store.crear, lote, req.formato)
+    _job_queue.put_nowait(job_id)
+    return _estado_job(await _job_o_404(job_id))
+
+
+@app.get("/jobs/{job_id}", response_model=JobEstado)
+async def estado_job(job_id: str):
+    return _estado_job(await _job_o_404(job_id))
+
+
+@app.get("/jobs/{job_id}/artefacto")
+async def artefacto_job(job_id: str):
+    job = await _job_o_404(job_id)
+    if job["estado"] != "completado":
+        raise HTTPException(status_code=409, detail=f"Job en estado '{job['estado']}'")
+    articulos = [a for _, a in sorted((await asyncio.to_thread(job_store.articulos, job_id)).items())]
+    req = job["request"]
+    if job["formato"] == "xml":
+        headers = {"Content-Disposition": "attachment; filename=theobjective_articulos.xml"}
+        return Response(content=build_wpai_xml(req, articulos), media_type="application/xml", headers=headers)
+    if job["formato"] == "zip":
+        headers = {"Content-Disposition": "attachment; filename=theobjective_export.zip"}
+        return Response(content=build_zip(req, articulos), media_type="application/zip", headers=headers)
+    return LoteResponse(articulos=articulos)
 
 
 if __name__ == "__main__":
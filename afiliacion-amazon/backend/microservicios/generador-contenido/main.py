@@ -1,14 +1,26 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from dotenv import load_dotenv
+import asyncio
+import hashlib
+import json
 import os
+import random
 import re
+import sqlite3
+import threading
+import time
 import unicodedata
+from collections import deque
 from html import unescape as html_unescape
 
+import httpx
 # OpenAI SDK v1.x
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
 
 load_dotenv()
 
@@ -16,11 +28,352 @@ app = FastAPI(title="Generador de Contenidos",
               description="Microservicio que genera artículos humanos para afiliación Amazon")
 DEFAULT_AFFILIATE_TAG = os.getenv("DEFAULT_AFFILIATE_TAG", "theobjective-21")
 
-def get_openai_client():
+# Cliente OpenAI asíncrono de larga vida: un pool de conexiones keep-alive
+# compartido por todas las peticiones y un tope de completions en vuelo, para
+# que un solo worker genere varios artículos a la vez sin bloquear el event loop.
+OPENAI_MAX_CONCURRENCY = max(1, int(os.getenv("OPENAI_MAX_CONCURRENCY", 8)))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 120))
+
+# Cuota de OpenAI de la cuenta: peticiones y tokens por minuto. Los 429, 5xx y
+# errores de conexión los reintenta crear_completion pasando por LLMScheduler
+# (el SDK no reintenta por su cuenta, para que cada intento cuente en la cuota).
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", 500))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", 200000))
+OPENAI_QUEUE_MAX = int(os.getenv("OPENAI_QUEUE_MAX", 200))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", 300))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 4))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", 1.0))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", 60))
+# Caracteres por token para estimar el coste del prompt antes de enviarlo
+CHARS_POR_TOKEN = 4.0
+
+# Caché en disco de completions (SQLite en modo WAL, compartible entre
+# workers). Vacío = sin caché.
+GEN_CACHE_PATH = os.getenv("GEN_CACHE_PATH", "")
+GEN_CACHE_MAX_AGE = float(os.getenv("GEN_CACHE_MAX_AGE", 30 * 24 * 3600))
+GEN_CACHE_MAX_BYTES = int(os.getenv("GEN_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+# (cliente, semáforo, event loop en el que se crearon)
+_openai: Optional[tuple] = None
+_openai_en_vuelo = 0
+
+
+class LLMRateLimitError(Exception):
+    """No hay cuota de OpenAI disponible (cola llena, espera agotada o 429 persistente)."""
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    """Dos token buckets (RPM y TPM) delante de chat.completions.
+
+    Cada petición consume 1 del bucket de peticiones y su coste estimado en
+    tokens (prompt + max_tokens) del de tokens; ambos se reponen de forma
+    continua hasta su tope por minuto. Lo que no cabe espera en una cola FIFO
+    (nadie se cuela, aunque pida menos tokens) como mucho ``timeout`` segundos.
+    Un 429 de OpenAI pausa a todos durante el Retry-After (``pausar``). Al
+    terminar, ``ajustar`` corrige el bucket con los tokens reales del ``usage``.
+    """
+
+    def __init__(self, rpm: float, tpm: float, max_queue: int = 200, timeout: float = 300,
+                 clock=time.monotonic):
+        self.rpm = max(1.0, float(rpm))
+        self.tpm = max(1.0, float(tpm))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = float(timeout)
+        self._clock = clock
+        self._peticiones = self.rpm
+        self._tokens = self.tpm
+        self._last = clock()
+        self._pausa_hasta = 0.0
+        self._cola: deque = deque()
+        self._esperas: deque = deque(maxlen=1000)
+        self._en_vuelo: deque = deque(maxlen=1000)
+        self.acquired = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.errores_transitorios = 0
+        self.max_queue_depth = 0
+
+    def _refill(self):
+        now = self._clock()
+        dt = now - self._last
+        self._peticiones = min(self.rpm, self._peticiones + dt * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + dt * self.tpm / 60)
+        self._last = now
+
+    def _cabe(self, coste: float) -> bool:
+        return self._clock() >= self._pausa_hasta and self._peticiones >= 1 and self._tokens >= coste
+
+    def _espera_necesaria(self, coste: float) -> float:
+        return max(
+            self._pausa_hasta - self._clock(),
+            (1 - self._peticiones) * 60 / self.rpm,
+            (coste - self._tokens) * 60 / self.tpm,
+        )
+
+    def _tomar(self, coste: float, waited: float):
+        self._peticiones -= 1
+        self._tokens -= coste
+        self.acquired += 1
+        self._esperas.append(waited)
+
+    def _despertar(self):
+        if self._cola:
+            self._cola[0].set()
+
+    async def acquire(self, coste: float) -> float:
+        """Espera turno y cuota para una petición de ``coste`` tokens. Devuelve los segundos en cola."""
+        # Una petición mayor que el bucket entero no cabría nunca: que espere a tenerlo lleno
+        coste = min(float(coste), self.tpm)
+        self._refill()
+        if not self._cola and self._cabe(coste):
+            self._tomar(coste, 0.0)
+            return 0.0
+        if len(self._cola) >= self.max_queue:
+            self.rejected += 1
+            raise LLMRateLimitError("OpenAI queue full", retry_after=self._espera_necesaria(coste))
+
+        start = self._clock()
+        entry = asyncio.Event()
+        self._cola.append(entry)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._cola))
+        try:
+            while True:
+                self._refill()
+                waited = self._clock() - start
+                if self._cola[0] is entry and self._cabe(coste):
+                    self._cola.popleft()
+                    self._tomar(coste, waited)
+                    self._despertar()
+                    return waited
+                remaining = self.timeout - waited
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise LLMRateLimitError("OpenAI queue timeout", retry_after=self._espera_necesaria(coste))
+                delay = remaining
+                if self._cola[0] is entry:
+                    delay = min(remaining, self._espera_necesaria(coste))
+                entry.clear()
+                try:
+                    await asyncio.wait_for(entry.wait(), timeout=max(delay, 0.001))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if entry in self._cola:
+                self._cola.remove(entry)
+                self._despertar()
+
+    def pausar(self, segundos: float):
+        """OpenAI ha devuelto 429: nadie sale de la cola hasta dentro de ``segundos``."""
+        self.rate_limited += 1
+        self._pausa_hasta = max(self._pausa_hasta, self._clock() + segundos)
+
+    def ajustar(self, estimado: float, real: Optional[int]):
+        """Devuelve (o cobra) la diferencia entre el coste estimado y el real."""
+        if real is None:
+            return
+        self._refill()
+        self._tokens = min(self.tpm, self._tokens + min(estimado, self.tpm) - real)
+
+    def registrar_en_vuelo(self, segundos: float):
+        self._en_vuelo.append(segundos)
+
+    def stats(self) -> dict:
+        self._refill()
+
+        def _resumen(valores: deque) -> dict:
+            v = sorted(valores)
+            if not v:
+                return {"avg_s": 0.0, "p50_s": 0.0, "p95_s": 0.0, "max_s": 0.0}
+            return {
+                "avg_s": round(sum(v) / len(v), 4),
+                "p50_s": round(v[int(0.50 * (len(v) - 1))], 4),
+                "p95_s": round(v[int(0.95 * (len(v) - 1))], 4),
+                "max_s": round(v[-1], 4),
+            }
+
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "peticiones_disponibles": round(self._peticiones, 3),
+            "tokens_disponibles": round(self._tokens, 1),
+            "pausa_restante_s": round(max(0.0, self._pausa_hasta - self._clock()), 3),
+            "queue_depth": len(self._cola),
+            "max_queue_depth": self.max_queue_depth,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "errores_transitorios": self.errores_transitorios,
+            "en_cola": _resumen(self._esperas),
+            "en_vuelo": _resumen(self._en_vuelo),
+        }
+
+
+llm_scheduler = LLMScheduler(OPENAI_RPM, OPENAI_TPM, OPENAI_QUEUE_MAX, OPENAI_QUEUE_TIMEOUT)
+
+
+def estimar_tokens(messages: List[dict], max_tokens: int) -> int:
+    """Coste aproximado de una completion: prompt (por caracteres) + max_tokens."""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return int(chars / CHARS_POR_TOKEN) + 4 * len(messages) + int(max_tokens or 0)
+
+
+def _retry_after(e: "openai.APIStatusError") -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    for nombre, escala in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        valor = headers.get(nombre)
+        if valor:
+            try:
+                return max(0.0, float(valor) * escala)
+            except ValueError:
+                continue
+    return None
+
+
+def _backoff(intento: int, retry_after: Optional[float]) -> float:
+    """Espera antes del reintento ``intento`` (desde 0): el Retry-After de
+    OpenAI si lo hay, si no exponencial, con jitter para no reintentar todos a la vez."""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 0.1 * retry_after + 0.05)
+    return random.uniform(0.5, 1.0) * min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** intento)
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Cliente compartido. Se crea bajo demanda y se recrea si cambia el event
+    loop (como en los tests, donde cada petición tiene el suyo)."""
+    global _openai
     key = os.getenv("OPENAI_API_KEY")
     if not key:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY no configurada")
-    return OpenAI(api_key=key)
+    loop = asyncio.get_running_loop()
+    if _openai is None or _openai[2] is not loop:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+        )
+        client = AsyncOpenAI(api_key=key, http_client=http_client, timeout=OPENAI_TIMEOUT, max_retries=0)
+        _openai = (client, asyncio.Semaphore(OPENAI_MAX_CONCURRENCY), loop)
+    return _openai[0]
+
+
+# Fallos que se reintentan con el backoff de los 429: el SDK tiene sus propios
+# reintentos desactivados para que cada intento pase por la cuota de llm_scheduler.
+# APITimeoutError es subclase de APIConnectionError.
+_ERRORES_REINTENTABLES = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _intento_fallido(e: Exception, intento: int, coste: float) -> float:
+    """Contabiliza un intento fallido y devuelve cuánto esperar antes del
+    siguiente (0 en los 429: la pausa la aplica la cola). Si no quedan
+    reintentos, relanza el error (como LLMRateLimitError en los 429)."""
+    if isinstance(e, openai.RateLimitError):
+        espera = _backoff(intento, _retry_after(e))
+        llm_scheduler.pausar(espera)
+        # Una petición rechazada no consume tokens: se devuelve la estimación
+        llm_scheduler.ajustar(coste, 0)
+        if intento >= OPENAI_MAX_RETRIES:
+            raise LLMRateLimitError("OpenAI rate limit", retry_after=espera) from e
+        llm_scheduler.retries += 1
+        return 0.0
+    llm_scheduler.errores_transitorios += 1
+    if isinstance(e, openai.InternalServerError):
+        llm_scheduler.ajustar(coste, 0)
+    if intento >= OPENAI_MAX_RETRIES:
+        raise e
+    llm_scheduler.retries += 1
+    return _backoff(intento, _retry_after(e) if isinstance(e, openai.APIStatusError) else None)
+
+
+async def crear_completion(**kwargs):
+    """chat.completions.create con el cliente compartido: pasa por la cuota
+    RPM/TPM de llm_scheduler, como mucho OPENAI_MAX_CONCURRENCY a la vez, y
+    reintenta los 429 (respetando Retry-After), los 5xx y los errores de
+    conexión o timeout."""
+    global _openai_en_vuelo
+    client = get_openai_client()
+    coste = estimar_tokens(kwargs.get("messages", []), kwargs.get("max_tokens", 0))
+    for intento in range(OPENAI_MAX_RETRIES + 1):
+        await llm_scheduler.acquire(coste)
+        espera = None
+        async with _openai[1]:
+            _openai_en_vuelo += 1
+            inicio = time.monotonic()
+            try:
+                completion = await client.chat.completions.create(**kwargs)
+            except _ERRORES_REINTENTABLES as e:
+                espera = _intento_fallido(e, intento, coste)
+            finally:
+                _openai_en_vuelo -= 1
+                llm_scheduler.registrar_en_vuelo(time.monotonic() - inicio)
+        if espera is not None:
+            # Fuera del semáforo: el hueco queda libre mientras se espera
+            await asyncio.sleep(espera)
+            continue
+        usage = getattr(completion, "usage", None)
+        llm_scheduler.ajustar(coste, getattr(usage, "total_tokens", None))
+        return completion
+
+
+async def crear_completion_stream(fin: Optional[dict] = None, **kwargs):
+    """Como crear_completion, pero con stream=True: va devolviendo el texto
+    de cada delta según llega. El hueco de concurrencia se mantiene hasta
+    agotar (o cerrar) el stream; solo se reintenta al abrirlo, antes de
+    haber entregado nada. Si se pasa ``fin``, recibe el ``finish_reason``."""
+    global _openai_en_vuelo
+    client = get_openai_client()
+    coste = estimar_tokens(kwargs.get("messages", []), kwargs.get("max_tokens", 0))
+    for intento in range(OPENAI_MAX_RETRIES + 1):
+        await llm_scheduler.acquire(coste)
+        espera = None
+        total_tokens = None
+        async with _openai[1]:
+            _openai_en_vuelo += 1
+            inicio = time.monotonic()
+            try:
+                try:
+                    stream = await client.chat.completions.create(
+                        stream=True, stream_options={"include_usage": True}, **kwargs)
+                except _ERRORES_REINTENTABLES as e:
+                    espera = _intento_fallido(e, intento, coste)
+                else:
+                    async with stream:
+                        async for chunk in stream:
+                            if chunk.usage is not None:
+                                total_tokens = chunk.usage.total_tokens
+                            for choice in chunk.choices:
+                                if choice.finish_reason and fin is not None:
+                                    fin["finish_reason"] = choice.finish_reason
+                                if choice.delta.content:
+                                    yield choice.delta.content
+            finally:
+                _openai_en_vuelo -= 1
+                llm_scheduler.registrar_en_vuelo(time.monotonic() - inicio)
+        if espera is not None:
+            await asyncio.sleep(espera)
+            continue
+        llm_scheduler.ajustar(coste, total_tokens)
+        return
+
+
+@app.on_event("shutdown")
+async def _cerrar_openai():
+    global _openai
+    if _openai is not None:
+        client = _openai[0]
+        _openai = None
+        await client.close()
+    if completion_cache is not None:
+        completion_cache.close()
 
 @app.get("/")
 async def root():
@@ -30,7 +383,15 @@ async def root():
 async def health():
     try:
         has_key = bool(os.getenv("OPENAI_API_KEY"))
-        return {"status": "ok", "openai_configured": has_key, "affiliate_tag": DEFAULT_AFFILIATE_TAG}
+        return {
+            "status": "ok",
+            "openai_configured": has_key,
+            "affiliate_tag": DEFAULT_AFFILIATE_TAG,
+            "openai_max_concurrency": OPENAI_MAX_CONCURRENCY,
+            "openai_en_vuelo": _openai_en_vuelo,
+            "llm_scheduler": llm_scheduler.stats(),
+            "completion_cache": completion_cache.stats() if completion_cache is not None else None,
+        }
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
@@ -43,6 +404,115 @@ class Producto(BaseModel):
     url_imagen: Optional[str] = None
     features: Optional[List[str]] = None
 
+class CompletionCache:
+    """Completions ya pagadas, por huella del prompt (SQLite en modo WAL).
+
+    La clave es un hash de modelo, temperatura, max_tokens, prompts y
+    productos; se guarda el texto devuelto por el modelo (el HTML final se
+    vuelve a montar con los productos, que es barato). Varios workers pueden
+    compartir el fichero. Se expulsan las entradas más antiguas que
+    ``max_age`` y, por encima de ``max_bytes``, las menos usadas. Las
+    operaciones son síncronas y cortas; el endpoint las ejecuta con
+    asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, max_age: float, max_bytes: int, clock=time.time):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions (clave TEXT PRIMARY KEY, contenido TEXT NOT NULL, "
+            "modelo TEXT, tokens INTEGER, tamano INTEGER NOT NULL, creado REAL NOT NULL, usado REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_creado ON completions (creado)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_usado ON completions (usado)")
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def clave(params: dict, productos: List["Producto"]) -> str:
+        datos = {
+            "model": params.get("model"),
+            "temperature": params.get("temperature"),
+            "max_tokens": params.get("max_tokens"),
+            "messages": params.get("messages"),
+            "productos": [p.model_dump() for p in productos],
+        }
+        canon = json.dumps(datos, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+    def get(self, clave: str) -> Optional[str]:
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT contenido FROM completions WHERE clave = ? AND creado >= ?", (clave, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET usado = ? WHERE clave = ?", (now, clave))
+        self.hits += 1
+        return row[0]
+
+    def set(self, clave: str, contenido: str, modelo: Optional[str] = None, tokens: Optional[int] = None):
+        now = self._clock()
+        tamano = len(contenido.encode("utf-8"))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO completions (clave, contenido, modelo, tokens, tamano, creado, usado) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (clave, contenido, modelo, tokens, tamano, now, now),
+                )
+                self.evictions += self._conn.execute(
+                    "DELETE FROM completions WHERE creado < ?", (now - self.max_age,)
+                ).rowcount
+                total = self._conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM completions").fetchone()[0]
+                if total > self.max_bytes:
+                    # Las menos usadas fuera hasta volver al límite
+                    sobrantes = []
+                    for c, t in self._conn.execute("SELECT clave, tamano FROM completions ORDER BY usado"):
+                        if total <= self.max_bytes:
+                            break
+                        sobrantes.append((c,))
+                        total -= t
+                    self._conn.executemany("DELETE FROM completions WHERE clave = ?", sobrantes)
+                    self.evictions += len(sobrantes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.writes += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entradas, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM completions"
+            ).fetchone()
+        return {
+            "path": self.path, "entries": entradas, "bytes": total, "max_bytes": self.max_bytes,
+            "max_age": self.max_age, "hits": self.hits, "misses": self.misses,
+            "writes": self.writes, "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+completion_cache: Optional[CompletionCache] = (
+    CompletionCache(GEN_CACHE_PATH, GEN_CACHE_MAX_AGE, GEN_CACHE_MAX_BYTES) if GEN_CACHE_PATH else None
+)
+
+
 class GenerarArticuloRequest(BaseModel):
     tema: Optional[str] = None
     productos: List[Producto] = Field(default_factory=list)
@@ -50,6 +520,8 @@ class GenerarArticuloRequest(BaseModel):
     tono: str = Field(default="humano, cercano, coloquial pero profesional")
     palabra_clave_principal: Optional[str] = None
     palabras_clave_secundarias: Optional[List[str]] = Field(default_factory=list)
+    # Ignora la caché de completions y pide una nueva (que sustituye a la guardada)
+    force_fresh: bool = False
 
 class GenerarArticuloResponse(BaseModel):
     titulo: str
@@ -57,6 +529,8 @@ class GenerarArticuloResponse(BaseModel):
     subtitulo_ia: Optional[str] = None
     articulo: str
     resumen: Optional[str] = None
+    # cache: hit | miss | bypass | off; clave (prefijo de la huella) y ms del paso LLM
+    meta: Optional[dict] = None
 
 STYLE_RULES = (
     "Actúa como redactor humano especializado en tecnología, consumo y tendencias digitales para The Objective. "
@@ -76,13 +550,16 @@ Eres un redactor humano de The Objective. Aplica estrictamente estas pautas edit
 {STYLE_RULES}
 """
 
+_VALLA_CODIGO = re.compile(r"```\s*[a-zA-Z]*\s*\n")
+
+
 def normalize_model_html(s: str) -> str:
     try:
         if not s:
             return ""
         txt = s.strip()
         # Remove any fenced code blocks
-        txt = re.sub(r"```\s*[a-zA-Z]*\s*\n", "", txt)
+        txt = _VALLA_CODIGO.sub("", txt)
         txt = txt.replace("```", "")
         # Unescape HTML entities if needed
         if '&lt;' in txt and '&gt;' in txt:
@@ -107,32 +584,269 @@ def ensure_affiliate(url: str, tag: str) -> str:
         sep = '&' if '?' in base else '?'
         return f"{base}{sep}tag={tag}"
 
-@app.post("/generar-articulo", response_model=GenerarArticuloResponse)
-async def generar_articulo(req: GenerarArticuloRequest):
-    try:
-        # 1. Preparar productos y mapa por ID
-        productos = req.productos[: req.max_items]
-        for p in productos:
-            p.url_afiliado = ensure_affiliate(p.url_afiliado or p.url_producto, DEFAULT_AFFILIATE_TAG)
-        
-        productos_map = {str(i): p for i, p in enumerate(productos, 1)}
-
-        # 2. Construir contexto de entrada para el LLM
-        productos_context = []
-        for idx, p in enumerate(productos, start=1):
-            feats = ", ".join(p.features or [])
-            productos_context.append(
-                f"ID {idx}: {p.titulo}\n"
-                f"   Marca: {p.marca or '-'} | Precio: {p.precio or '-'}\n"
-                f"   Características: {feats}\n"
-            )
-        productos_str = "\n".join(productos_context)
-
-        keywords_main = req.palabra_clave_principal or (req.tema or "").strip()
-        keywords_sec = ", ".join(req.palabras_clave_secundarias or [])
-
-        # 3. Prompt con estructura XML estricta
-        user_prompt = f"""
+_ANCLA = re.compile(r"<a([^>]*)>", re.IGNORECASE)
+_ANCLA_TARGET = re.compile(r"\s+target=\"[^\"]*\"", re.IGNORECASE)
+_ANCLA_REL = re.compile(r"\s+rel=\"[^\"]*\"", re.IGNORECASE)
+_BOTON_MODELO = re.compile(r'<div[^>]*class="btn-buy-amz[^>]*>.*?</div>', re.DOTALL)
+
+
+def _normalize_anchor(match: re.Match) -> str:
+    attrs = match.group(1) or ""
+    attrs = _ANCLA_TARGET.sub("", attrs)
+    attrs = _ANCLA_REL.sub("", attrs)
+    attrs = attrs.rstrip()
+    extra = ' target="_blank" rel="noreferrer noopener sponsored nofollow"'
+    return f"<a{attrs}{extra}>"
+
+
+def normalizar_enlaces(html: str) -> str:
+    if "<a" not in html and "<A" not in html:
+        return html
+    return _ANCLA.sub(_normalize_anchor, html)
+
+
+def _render_item_block(product_obj: "Producto", nombre: Optional[str], texto: Optional[str]) -> str:
+    """Bloque de un producto. Construcción determinista: H2 -> Imagen -> Texto -> Precio -> Botón."""
+    h2 = f"<h2>{nombre or product_obj.titulo}</h2>"
+
+    figure = ""
+    if product_obj.url_imagen:
+        alt_text = (product_obj.marca or product_obj.titulo)[:100].replace('"', '')
+        figure = (
+            f'<figure class="product-figure">'
+            f'<img src="{product_obj.url_imagen}" alt="{alt_text}" loading="lazy" />'
+            f'</figure>'
+        )
+
+    texto_clean = texto or ""
+    if "btn-buy-amz" in texto_clean:
+        texto_clean = _BOTON_MODELO.sub('', texto_clean)
+
+    price_div = ""
+    if product_obj.precio and not "no disponible" in str(product_obj.precio).lower():
+        price_div = f'<div class="text-muted small">Precio orientativo: {product_obj.precio}</div>'
+
+    btn_div = ""
+    link = product_obj.url_afiliado or product_obj.url_producto
+    if link:
+        btn_div = (
+            f'<div class="btn-buy-amz-wrapper" style="margin-top:0.5rem;margin-bottom:1.25rem;">'
+            f'<a class="btn-buy-amz" style="display:inline-block;padding:0.35rem 0.9rem;'
+            f'border-radius:0.25rem;background-color:rgb(251,225,11);color:#000000;'
+            f'text-decoration:none;font-size:0.9rem;" '
+            f'href="{link}" target="_blank" rel="noreferrer noopener sponsored nofollow">Comprar en Amazon</a>'
+            f'</div>'
+        )
+
+    return f"{h2}\n{figure}\n{texto_clean}\n{price_div}\n{btn_div}\n"
+
+
+class Seccion(NamedTuple):
+    """Sección cerrada de la salida del modelo. En los items, ``contenido`` es
+    el interior completo y ``nombre``/``texto`` sus campos (None si faltan)."""
+    tag: str
+    id: Optional[str]
+    contenido: str
+    nombre: Optional[str] = None
+    texto: Optional[str] = None
+
+
+class ParserArticulo:
+    """Parser incremental de una pasada del pseudo-XML que devuelve el modelo.
+
+    Un único patrón precompilado localiza las etiquetas del formato (el resto
+    del HTML pasa como contenido) y una pequeña máquina de estados arma las
+    secciones: titular, subtitulo, intro, cada item (con su nombre y texto) y
+    cierre. ``feed`` recibe la salida a trozos (p. ej. los deltas del stream de
+    OpenAI) y devuelve las secciones ya cerradas, en el orden en que llegan;
+    cada carácter se examina una sola vez aunque llegue de uno en uno.
+
+    Con la salida mal formada no reproduce al pie de la letra las expresiones
+    regulares a las que sustituye, que tomaban todo lo que hubiera entre la
+    primera apertura y el primer cierre. Solo cuenta una sección (o un
+    nombre/texto) cerrada con su propia etiqueta, y su contenido empieza en la
+    última apertura: con ``<titular>`` repetido sale ``Título``, no
+    ``<titular>Título``. Si antes de cerrarla se abre otra sección (u otro
+    campo, dentro de un item), se cierra el contenedor (``</items>``,
+    ``</articulo>``) o se acaba la salida, la abierta se descarta en vez de
+    arrastrar esas etiquetas como contenido; un ``<item>`` dentro de otro sin
+    cerrar es contenido del primero. No normaliza la entrada: para una salida
+    completa, ``parsear_salida``.
+    """
+
+    _ETIQUETA = re.compile(
+        r"<(/?)(articulo|titular|subtitulo|intro|items|item|nombre|texto|cierre)\b([^>]*)>", re.IGNORECASE)
+    _SECCIONES = frozenset(("titular", "subtitulo", "intro", "item", "cierre"))
+    _CAMPOS = frozenset(("nombre", "texto"))
+    _ID = re.compile(r"""id\s*=\s*["']?(\d+)""", re.IGNORECASE)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buf = ""
+        self._pos = 0
+        # Sección abierta: (tag, id, inicio del contenido)
+        self._abierta: Optional[tuple] = None
+        # Dentro de un item: campos ya cerrados y el abierto, (tag, inicio)
+        self._campos: dict = {}
+        self._campo: Optional[tuple] = None
+
+    def _descartar(self):
+        self._abierta = None
+        self._campos = {}
+        self._campo = None
+
+    def _cerrar(self, fin: int) -> Seccion:
+        tag, pid, inicio = self._abierta
+        contenido = self._buf[inicio:fin].strip()
+        campos = self._campos
+        self._descartar()
+        if tag != "item":
+            return Seccion(tag, None, contenido)
+        return Seccion(tag, pid, contenido, campos.get("nombre"), campos.get("texto"))
+
+    def _secciones(self, final: bool = False) -> List[Seccion]:
+        buf = self._buf
+        limite = len(buf)
+        if not final:
+            # Un '<' posterior al último '>' puede ser una etiqueta a medias
+            ultimo = buf.rfind(">", self._pos)
+            corte = buf.find("<", ultimo + 1 if ultimo >= 0 else self._pos)
+            if corte >= 0:
+                limite = corte
+        secciones = []
+        for m in self._ETIQUETA.finditer(buf, self._pos, limite):
+            cierre, tag = m.group(1), m.group(2).lower()
+            abierta = self._abierta
+            if tag in self._CAMPOS:
+                if abierta is None or abierta[0] != "item":
+                    continue
+                if not cierre:
+                    self._campo = (tag, m.end())
+                elif self._campo is not None and self._campo[0] == tag:
+                    self._campos.setdefault(tag, buf[self._campo[1]:m.start()].strip())
+                    self._campo = None
+            elif cierre:
+                if abierta is not None:
+                    if tag == abierta[0]:
+                        secciones.append(self._cerrar(m.start()))
+                    elif tag not in self._SECCIONES:
+                        self._descartar()
+            elif abierta is not None and abierta[0] == "item" == tag:
+                continue
+            else:
+                if abierta is not None:
+                    self._descartar()
+                if tag in self._SECCIONES:
+                    pid = None
+                    if tag == "item":
+                        mid = self._ID.search(m.group(3))
+                        pid = mid.group(1) if mid else None
+                    self._abierta = (tag, pid, m.end())
+        self._pos = limite
+        if final:
+            self._descartar()
+        return secciones
+
+    def feed(self, texto: str) -> List[Seccion]:
+        self._buf += texto
+        return self._secciones()
+
+    def close(self) -> List[Seccion]:
+        """Fin de la salida: procesa lo pendiente y descarta lo que siga abierto."""
+        return self._secciones(final=True)
+
+
+def parsear_salida(raw_output: Optional[str]) -> List[Seccion]:
+    """Secciones de una salida completa del modelo, ya normalizada (bloques
+    de código y entidades escapadas) como antes de parsear."""
+    parser = ParserArticulo()
+    return parser.feed(normalize_model_html(raw_output or "")) + parser.close()
+
+
+class MontajeArticulo:
+    """Monta el artículo a partir de las secciones de ParserArticulo.
+
+    ``añadir`` devuelve el evento de stream de cada sección útil (con los
+    bloques de producto ya renderizados) o None si se descarta: ids que no
+    están en la petición o secciones repetidas.
+    """
+
+    def __init__(self, req: "GenerarArticuloRequest", productos_map: dict):
+        self.req = req
+        self.productos_map = productos_map
+        self.titulo: Optional[str] = None
+        self.subtitulo_ia: Optional[str] = None
+        self.intro = ""
+        self.cierre = ""
+        self.items: List[str] = []
+        self._vistas = set()
+
+    def añadir(self, seccion: Seccion) -> Optional[dict]:
+        tag, pid, contenido = seccion.tag, seccion.id, seccion.contenido
+        if tag == "item":
+            product_obj = self.productos_map.get(pid)
+            if not product_obj:
+                return None
+            bloque = normalizar_enlaces(_render_item_block(product_obj, seccion.nombre, seccion.texto))
+            self.items.append(bloque)
+            return {"tipo": "item", "id": pid, "html": bloque}
+        if tag in self._vistas:
+            return None
+        self._vistas.add(tag)
+        if tag == "titular":
+            self.titulo = contenido or None
+            return {"tipo": "titular", "titulo": self.titulo}
+        if tag == "subtitulo":
+            self.subtitulo_ia = contenido or None
+            return {"tipo": "subtitulo", "subtitulo_ia": self.subtitulo_ia}
+        html = normalizar_enlaces(contenido)
+        setattr(self, tag, html)
+        return {"tipo": tag, "html": html} if html else None
+
+    def respuesta(self, meta: Optional[dict] = None) -> "GenerarArticuloResponse":
+        partes = [p for p in (self.intro, *self.items, self.cierre) if p]
+        subtitulo_fijo = (
+            "Este artículo se ha elaborado con apoyo de herramientas de análisis y generación de "
+            "contenido para seleccionar y describir los productos más relevantes disponibles en Amazon."
+        )
+        return GenerarArticuloResponse(
+            titulo=self.titulo or self.req.tema or "Artículo Recomendado",
+            subtitulo=subtitulo_fijo,
+            subtitulo_ia=self.subtitulo_ia,
+            articulo="\n".join(partes),
+            resumen=None,
+            meta=meta,
+        )
+
+
+def preparar_generacion(req: "GenerarArticuloRequest"):
+    """Productos de la petición (con tag de afiliado), mapa por ID y
+    parámetros de la completion."""
+    # 1. Preparar productos y mapa por ID
+    productos = req.productos[: req.max_items]
+    for p in productos:
+        p.url_afiliado = ensure_affiliate(p.url_afiliado or p.url_producto, DEFAULT_AFFILIATE_TAG)
+
+    productos_map = {str(i): p for i, p in enumerate(productos, 1)}
+
+    # 2. Construir contexto de entrada para el LLM
+    productos_context = []
+    for idx, p in enumerate(productos, start=1):
+        feats = ", ".join(p.features or [])
+        productos_context.append(
+            f"ID {idx}: {p.titulo}\n"
+            f"   Marca: {p.marca or '-'} | Precio: {p.precio or '-'}\n"
+            f"   Características: {feats}\n"
+        )
+    productos_str = "\n".join(productos_context)
+
+    keywords_main = req.palabra_clave_principal or (req.tema or "").strip()
+    keywords_sec = ", ".join(req.palabras_clave_secundarias or [])
+
+    # 3. Prompt con estructura XML estricta
+    user_prompt = f"""
 Escribe un artículo sobre: {req.tema or 'selección de productos'}.
 Palabra clave principal: {keywords_main}
 Palabras clave secundarias: {keywords_sec}
@@ -171,118 +885,160 @@ REGLAS DE CONTENIDO:
 4. Redacción humana, sin muletillas de IA.
 """
 
-        client = get_openai_client()
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-            max_tokens=2000,
-        )
-        raw_output = completion.choices[0].message.content
-        
-        # 4. Parseo del XML (Pseudo-XML con Regex para robustez)
-        raw_clean = normalize_model_html(raw_output)
-        
-        def extract_tag(tag, text, flags=re.IGNORECASE | re.DOTALL):
-            m = re.search(f"<{tag}>(.*?)</{tag}>", text, flags)
-            return m.group(1).strip() if m else None
-
-        titulo_model = extract_tag("titular", raw_clean) or req.tema
-        subtitulo_ia = extract_tag("subtitulo", raw_clean)
-        intro_html = extract_tag("intro", raw_clean) or ""
-        cierre_html = extract_tag("cierre", raw_clean) or ""
-        
-        # Extraer items
-        items_block_match = re.search(r"<items>(.*?)</items>", raw_clean, re.IGNORECASE | re.DOTALL)
-        items_block = items_block_match.group(1) if items_block_match else raw_clean
-        
-        items_iter = re.finditer(r'<item\s+id=["\']?(\d+)["\']?\s*>(.*?)</item>', items_block, re.IGNORECASE | re.DOTALL)
-        
-        article_body_parts = []
-        
-        if intro_html:
-            article_body_parts.append(intro_html)
-            
-        for m in items_iter:
-            pid = m.group(1)
-            content_inner = m.group(2)
-            
-            product_obj = productos_map.get(pid)
-            if not product_obj:
-                continue
-                
-            nombre_editorial = extract_tag("nombre", content_inner) or product_obj.titulo
-            texto_editorial = extract_tag("texto", content_inner) or ""
-            
-            # Construcción Determinista: H2 -> Imagen -> Texto -> Precio -> Botón
-            h2 = f"<h2>{nombre_editorial}</h2>"
-            
-            figure = ""
-            if product_obj.url_imagen:
-                alt_text = (product_obj.marca or product_obj.titulo)[:100].replace('"', '')
-                figure = (
-                    f'<figure class="product-figure">'
-                    f'<img src="{product_obj.url_imagen}" alt="{alt_text}" loading="lazy" />'
-                    f'</figure>'
-                )
-            
-            texto_clean = re.sub(r'<div[^>]*class="btn-buy-amz[^>]*>.*?</div>', '', texto_editorial, flags=re.DOTALL)
-            
-            price_div = ""
-            if product_obj.precio and not "no disponible" in str(product_obj.precio).lower():
-                price_div = f'<div class="text-muted small">Precio orientativo: {product_obj.precio}</div>'
-            
-            btn_div = ""
-            link = product_obj.url_afiliado or product_obj.url_producto
-            if link:
-                btn_div = (
-                    f'<div class="btn-buy-amz-wrapper" style="margin-top:0.5rem;margin-bottom:1.25rem;">'
-                    f'<a class="btn-buy-amz" style="display:inline-block;padding:0.35rem 0.9rem;'
-                    f'border-radius:0.25rem;background-color:rgb(251,225,11);color:#000000;'
-                    f'text-decoration:none;font-size:0.9rem;" '
-                    f'href="{link}" target="_blank" rel="noreferrer noopener sponsored nofollow">Comprar en Amazon</a>'
-                    f'</div>'
-                )
-            
-            block_html = f"{h2}\n{figure}\n{texto_clean}\n{price_div}\n{btn_div}\n"
-            article_body_parts.append(block_html)
-
-        if cierre_html:
-            article_body_parts.append(cierre_html)
-            
-        full_html = "\n".join(article_body_parts)
-        
-        def _normalize_anchor(match: re.Match) -> str:
-            attrs = match.group(1) or ""
-            attrs = re.sub(r"\s+target=\"[^\"]*\"", "", attrs, flags=re.IGNORECASE)
-            attrs = re.sub(r"\s+rel=\"[^\"]*\"", "", attrs, flags=re.IGNORECASE)
-            attrs = attrs.rstrip()
-            extra = ' target="_blank" rel="noreferrer noopener sponsored nofollow"'
-            return f"<a{attrs}{extra}>"
-
-        full_html = re.sub(r"<a([^>]*)>", _normalize_anchor, full_html, flags=re.IGNORECASE)
-        
-        subtitulo_fijo = (
-            "Este artículo se ha elaborado con apoyo de herramientas de análisis y generación de "
-            "contenido para seleccionar y describir los productos más relevantes disponibles en Amazon."
-        )
+    params = dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+        temperature=0.7,
+        max_tokens=2000,
+    )
+    return productos, productos_map, params
 
-        return GenerarArticuloResponse(
-            titulo=titulo_model or "Artículo Recomendado",
-            subtitulo=subtitulo_fijo,
-            subtitulo_ia=subtitulo_ia,
-            articulo=full_html,
-            resumen=None,
-        )
 
+async def _leer_cache(req: "GenerarArticuloRequest", clave: str):
+    """(salida cacheada o None, estado para meta.cache)."""
+    if completion_cache is None:
+        return None, "off"
+    if req.force_fresh:
+        return None, "bypass"
+    raw_output = await asyncio.to_thread(completion_cache.get, clave)
+    return raw_output, "hit" if raw_output is not None else "miss"
+
+
+async def _guardar_cache(clave: str, raw_output: Optional[str], modelo: str, finish_reason: Optional[str],
+                         secciones: List[Seccion], tokens: Optional[int] = None):
+    """Solo se cachean completions terminadas con normalidad (no cortadas por
+    max_tokens ni filtros) y con algún item: una salida mala no debe volver a
+    servirse durante semanas."""
+    if completion_cache is None or not raw_output or finish_reason != "stop":
+        return
+    if not any(s.tag == "item" for s in secciones):
+        return
+    await asyncio.to_thread(completion_cache.set, clave, raw_output, modelo, tokens)
+
+
+@app.post("/generar-articulo", response_model=GenerarArticuloResponse)
+async def generar_articulo(req: GenerarArticuloRequest):
+    try:
+        productos, productos_map, params = preparar_generacion(req)
+
+        inicio = time.perf_counter()
+        clave = CompletionCache.clave(params, productos)
+        raw_output, estado_cache = await _leer_cache(req, clave)
+        completion = None
+        if raw_output is None:
+            completion = await crear_completion(**params)
+            raw_output = completion.choices[0].message.content
+        meta = {"cache": estado_cache, "clave": clave[:16], "modelo": params["model"],
+                "llm_ms": round((time.perf_counter() - inicio) * 1000, 1)}
+
+        # 4. Parseo del pseudo-XML y montaje determinista de los bloques
+        secciones = parsear_salida(raw_output)
+        if completion is not None:
+            usage = getattr(completion, "usage", None)
+            await _guardar_cache(clave, raw_output, params["model"], completion.choices[0].finish_reason,
+                                 secciones, getattr(usage, "total_tokens", None))
+        montaje = MontajeArticulo(req, productos_map)
+        for seccion in secciones:
+            montaje.añadir(seccion)
+        return montaje.respuesta(meta)
+
+    except HTTPException:
+        raise
+    except LLMRateLimitError as e:
+        headers = {"Retry-After": str(max(1, int(e.retry_after + 0.999)))} if e.retry_after else None
+        raise HTTPException(status_code=429, detail=e.reason, headers=headers)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def _evento_ndjson(evento: dict) -> bytes:
+    return (json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@app.post("/generar-articulo/stream")
+async def generar_articulo_stream(req: GenerarArticuloRequest):
+    """Como /generar-articulo, pero en NDJSON y con la completion en stream:
+    cada sección sale en cuanto el modelo la cierra.
+
+    Eventos: ``inicio`` (total, cache), ``titular`` (titulo), ``subtitulo``
+    (subtitulo_ia), ``intro`` y ``cierre`` (html), ``item`` (id, html del
+    bloque ya renderizado con H2, imagen, precio y botón) y ``fin`` con la
+    respuesta completa de /generar-articulo, que manda si difiere de lo ya
+    emitido (salida que solo se entiende normalizada). Si la completion falla
+    a mitad se emite ``error`` (status, detail y retry_after en los 429) y se
+    corta.
+    """
+    try:
+        productos, productos_map, params = preparar_generacion(req)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def eventos():
+        inicio = time.perf_counter()
+        clave = CompletionCache.clave(params, productos)
+        montaje = MontajeArticulo(req, productos_map)
+        try:
+            raw_output, estado_cache = await _leer_cache(req, clave)
+            yield _evento_ndjson({"tipo": "inicio", "total": len(productos_map), "cache": estado_cache})
+            if raw_output is not None:
+                for seccion in parsear_salida(raw_output):
+                    evento = montaje.añadir(seccion)
+                    if evento:
+                        yield _evento_ndjson(evento)
+            else:
+                parser = ParserArticulo()
+                trozos = []
+                fin = {}
+                flujo = crear_completion_stream(fin=fin, **params)
+                try:
+                    async for delta in flujo:
+                        trozos.append(delta)
+                        for seccion in parser.feed(delta):
+                            evento = montaje.añadir(seccion)
+                            if evento:
+                                yield _evento_ndjson(evento)
+                finally:
+                    # Si el cliente se ha ido, cortar ya el stream de OpenAI y
+                    # devolver su hueco de concurrencia, sin esperar a que acabe
+                    await flujo.aclose()
+                raw_output = "".join(trozos)
+                # fin, como /generar-articulo, sale de la salida completa normalizada
+                # (p. ej. si el modelo devolvió las etiquetas escapadas)
+                secciones = parsear_salida(raw_output)
+                await _guardar_cache(clave, raw_output, params["model"], fin.get("finish_reason"), secciones)
+                montaje = MontajeArticulo(req, productos_map)
+                for seccion in secciones:
+                    montaje.añadir(seccion)
+        except LLMRateLimitError as e:
+            yield _evento_ndjson({"tipo": "error", "status": 429, "detail": e.reason, "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield _evento_ndjson({"tipo": "error", "status": 500, "detail": str(e)})
+            return
+        meta = {"cache": estado_cache, "clave": clave[:16], "modelo": params["model"],
+                "llm_ms": round((time.perf_counter() - inicio) * 1000, 1)}
+        yield _evento_ndjson({"tipo": "fin", **montaje.respuesta(meta).model_dump()})
+
+    gen = eventos()
+
+    async def cerrar():
+        # Al desconectarse el cliente Starlette cancela el envío pero no cierra
+        # el generador; la tarea de fondo corre en ambos casos. (Una función
+        # async: gen.aclose a secas lo mandaría al threadpool sin esperarlo.)
+        await gen.aclose()
+
+    # X-Accel-Buffering: que un proxy intermedio no acumule el stream
+    return StreamingResponse(gen, media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(cerrar))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 8010)))
@@ -3,6 +3,7 @@ from fastapi.testclient import TestClient
 
 import os
 import sys
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'microservicios', 'generador-contenido')))
 
 from main import app  # noqa: E402
@@ -40,3 +41,467 @@ def test_generar_articulo_incluye_enlaces():
     from main import ensure_affiliate, DEFAULT_AFFILIATE_TAG
     assert ensure_affiliate("https://www.amazon.es/dp/B000000001", DEFAULT_AFFILIATE_TAG).endswith(f"tag={DEFAULT_AFFILIATE_TAG}")
     assert "tag=" in ensure_affiliate("https://www.amazon.es/dp/B000000002?ref_=abc", DEFAULT_AFFILIATE_TAG)
+
+
+XML_FAKE = (
+    "<articulo><titular>Titular</titular><subtitulo>Sub</subtitulo><intro><p>Intro</p></intro>"
+    "<items><item id=\"1\"><nombre>Auriculares X</nombre><texto><p>Texto</p></texto></item></items>"
+    "<cierre><p>Cierre</p></cierre></articulo>"
+)
+
+
+def _respuesta_openai(content, finish_reason="stop"):
+    return {
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                     "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def test_completions_concurrentes_con_cliente_compartido(monkeypatch):
+    import asyncio
+    import httpx
+    import main
+
+    en_vuelo = {"actual": 0, "max": 0}
+    clientes = []
+
+    async def handler(request):
+        en_vuelo["actual"] += 1
+        en_vuelo["max"] = max(en_vuelo["max"], en_vuelo["actual"])
+        await asyncio.sleep(0.05)
+        en_vuelo["actual"] -= 1
+        return httpx.Response(200, json=_respuesta_openai(XML_FAKE))
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(handler), **kw)
+            clientes.append(self)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "OPENAI_MAX_CONCURRENCY", 3)
+    monkeypatch.setattr(main, "_openai", None)
+
+    req = main.GenerarArticuloRequest(
+        tema="Auriculares",
+        productos=[{"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001"}],
+    )
+
+    async def lote():
+        return await asyncio.gather(*(main.generar_articulo(req) for _ in range(6)))
+
+    respuestas = asyncio.run(lote())
+    assert all(r.titulo == "Titular" and "<h2>Auriculares X</h2>" in r.articulo for r in respuestas)
+    # En paralelo hasta el tope, con un único cliente HTTP para todas
+    assert en_vuelo["max"] == 3
+    assert len(clientes) == 1
+
+
+def test_llm_scheduler_tpm_y_cola_fifo():
+    import asyncio
+    import main
+
+    async def escenario():
+        # 6000 tokens/min = 100 tokens/s; el bucket empieza lleno
+        sched = main.LLMScheduler(rpm=10_000, tpm=6000)
+        assert await sched.acquire(6000) == 0.0
+        orden = []
+
+        async def pedir(nombre, coste):
+            esperado = await sched.acquire(coste)
+            orden.append(nombre)
+            return esperado
+
+        # La grande llega antes: la pequeña no se le cuela aunque ya cupiera
+        grande, pequena = await asyncio.gather(pedir("grande", 20), pedir("pequena", 1))
+        assert orden == ["grande", "pequena"]
+        assert 0.15 <= grande <= 0.5 and pequena >= grande
+        # Tokens reales menores que los estimados vuelven al bucket
+        sched.ajustar(20, 5)
+        stats = sched.stats()
+        assert stats["acquired"] == 3 and stats["en_cola"]["max_s"] >= 0.15
+        assert main.estimar_tokens([{"role": "user", "content": "x" * 400}], 100) == 100 + 4 + 100
+
+    asyncio.run(escenario())
+
+
+def test_reintenta_429_respetando_retry_after(monkeypatch):
+    import asyncio
+    import httpx
+    import main
+
+    respuestas = [
+        httpx.Response(429, headers={"retry-after-ms": "50"}, json={"error": {"message": "Rate limit", "type": "requests"}}),
+        httpx.Response(200, json=_respuesta_openai(XML_FAKE)),
+    ]
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(lambda request: respuestas.pop(0)), **kw)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "_openai", None)
+    sched = main.LLMScheduler(rpm=1000, tpm=1_000_000)
+    monkeypatch.setattr(main, "llm_scheduler", sched)
+
+    req = main.GenerarArticuloRequest(
+        tema="Auriculares",
+        productos=[{"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001"}],
+    )
+    t0 = time.perf_counter()
+    r = asyncio.run(main.generar_articulo(req))
+    assert r.titulo == "Titular"
+    assert time.perf_counter() - t0 >= 0.05
+    stats = sched.stats()
+    assert (stats["rate_limited"], stats["retries"], stats["acquired"]) == (1, 1, 2)
+
+    # Sin reintentos disponibles el 429 llega al cliente con Retry-After
+    respuestas[:] = [httpx.Response(429, headers={"retry-after": "7"}, json={"error": {"message": "Rate limit"}})]
+    monkeypatch.setattr(main, "OPENAI_MAX_RETRIES", 0)
+    monkeypatch.setattr(main, "_openai", None)
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(main.generar_articulo(req))
+    assert exc.value.status_code == 429 and int(exc.value.headers["Retry-After"]) >= 7
+
+
+def test_cache_de_completions_en_disco(monkeypatch, tmp_path):
+    import asyncio
+    import httpx
+    import main
+
+    llamadas = []
+
+    def responder(request):
+        llamadas.append(request)
+        return httpx.Response(200, json=_respuesta_openai(XML_FAKE))
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(responder), **kw)
+
+    ahora = [1000.0]
+    cache = main.CompletionCache(str(tmp_path / "completions.sqlite3"), max_age=3600, max_bytes=10**6,
+                                 clock=lambda: ahora[0])
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "_openai", None)
+    monkeypatch.setattr(main, "completion_cache", cache)
+
+    datos = {
+        "tema": "Auriculares",
+        "productos": [{"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001"}],
+    }
+    primera = asyncio.run(main.generar_articulo(main.GenerarArticuloRequest(**datos)))
+    segunda = asyncio.run(main.generar_articulo(main.GenerarArticuloRequest(**datos)))
+    assert (primera.meta["cache"], segunda.meta["cache"]) == ("miss", "hit")
+    assert segunda.articulo == primera.articulo and len(llamadas) == 1
+
+    # Otro producto cambia la huella; force_fresh no lee la caché
+    otro = dict(datos, productos=[dict(datos["productos"][0], precio="19,99 €")])
+    assert asyncio.run(main.generar_articulo(main.GenerarArticuloRequest(**otro))).meta["cache"] == "miss"
+    fresca = asyncio.run(main.generar_articulo(main.GenerarArticuloRequest(**datos, force_fresh=True)))
+    assert fresca.meta["cache"] == "bypass" and len(llamadas) == 3
+
+    # Otro worker con el mismo fichero la comparte; caducada ya no sirve
+    otra = main.CompletionCache(cache.path, max_age=3600, max_bytes=10**6, clock=lambda: ahora[0])
+    assert otra.stats()["entries"] == 2
+    monkeypatch.setattr(main, "completion_cache", otra)
+    assert asyncio.run(main.generar_articulo(main.GenerarArticuloRequest(**datos))).meta["cache"] == "hit"
+    monkeypatch.setattr(main, "completion_cache", cache)
+    ahora[0] += 3601
+    assert asyncio.run(main.generar_articulo(main.GenerarArticuloRequest(**datos))).meta["cache"] == "miss"
+    assert cache.stats()["entries"] == 1 and cache.stats()["evictions"] == 1
+
+
+
+def test_cache_solo_guarda_completions_completas_con_items(monkeypatch, tmp_path):
+    import asyncio
+    import json
+    import httpx
+    import main
+
+    respuestas = []
+
+    def responder(request):
+        if json.loads(request.content).get("stream"):
+            trozos = [XML_FAKE[:40], XML_FAKE[40:]]
+            chunks = [{"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+                       "choices": [{"index": 0, "delta": {"content": t},
+                                    "finish_reason": "stop" if i == len(trozos) - 1 else None}]}
+                      for i, t in enumerate(trozos)]
+            sse = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=sse.encode())
+        return httpx.Response(200, json=respuestas.pop(0))
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(responder), **kw)
+
+    cache = main.CompletionCache(str(tmp_path / "completions.sqlite3"), max_age=3600, max_bytes=10**6)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "_openai", None)
+    monkeypatch.setattr(main, "completion_cache", cache)
+    datos = {"tema": "Auriculares",
+             "productos": [{"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001"}]}
+    req = main.GenerarArticuloRequest(**datos)
+
+    # Cortada por max_tokens o sin ningún item: no se cachea
+    sin_items = XML_FAKE.split("<items>")[0] + "<items></items></articulo>"
+    for respuesta in (_respuesta_openai(XML_FAKE[:200], "length"), _respuesta_openai(sin_items)):
+        respuestas.append(respuesta)
+        assert asyncio.run(main.generar_articulo(req)).meta["cache"] == "miss"
+        assert cache.stats()["entries"] == 0
+
+    # Terminada con normalidad (también en stream): sí
+    resp = client.post("/generar-articulo/stream", json=datos)
+    assert json.loads(resp.text.splitlines()[-1])["tipo"] == "fin"
+    assert cache.stats()["entries"] == 1
+    assert asyncio.run(main.generar_articulo(req)).meta["cache"] == "hit"
+
+def test_cache_de_completions_expulsa_por_tamano(tmp_path):
+    import main
+
+    ahora = [0.0]
+    cache = main.CompletionCache(str(tmp_path / "c.sqlite3"), max_age=3600, max_bytes=250, clock=lambda: ahora[0])
+    for clave in ("a", "b", "c"):
+        ahora[0] += 1
+        cache.set(clave, "x" * 100)
+    assert cache.get("a") is None and cache.get("c") == "x" * 100
+    ahora[0] += 1
+    assert cache.get("b") == "x" * 100  # b pasa a ser la más reciente
+    cache.set("d", "x" * 100)
+    assert cache.get("c") is None and cache.get("b") and cache.get("d")
+
+
+def test_parser_incremental_emite_cada_item_al_cerrarse():
+    import main
+
+    salida = XML_FAKE.replace("</items>", "<item id=\"2\"><texto><p>Otro</p></texto></item></items>")
+    parser = main.ParserArticulo()
+    vistas = []
+    for i, caracter in enumerate(salida):
+        for seccion in parser.feed(caracter):
+            vistas.append((seccion.tag, seccion.id, i))
+    assert [(t, p) for t, p, _ in vistas] == [
+        ("titular", None), ("subtitulo", None), ("intro", None), ("item", "1"), ("item", "2"), ("cierre", None)]
+    # El primer item sale justo al llegar su </item>, no al final de la salida
+    assert vistas[3][2] == salida.index("</item>") + len("</item>") - 1
+    assert parser.close() == []
+
+
+def test_generar_articulo_stream_ndjson(monkeypatch):
+    import json
+    import httpx
+    import main
+
+    trozos = [XML_FAKE[i:i + 7] for i in range(0, len(XML_FAKE), 7)]
+    chunks = [
+        {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+         "choices": [{"index": 0, "delta": {"content": t}, "finish_reason": None}]}
+        for t in trozos
+    ] + [{"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini", "choices": [],
+          "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}]
+    sse = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+    peticiones = []
+
+    def responder(request):
+        peticiones.append(json.loads(request.content))
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=sse.encode())
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(responder), **kw)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "_openai", None)
+    monkeypatch.setattr(main, "completion_cache", None)
+
+    payload = {"tema": "Auriculares", "productos": [
+        {"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001", "precio": "59,99 €"}]}
+    resp = client.post("/generar-articulo/stream", json=payload)
+    assert resp.status_code == 200 and resp.headers["content-type"].startswith("application/x-ndjson")
+    assert peticiones[0]["stream"] is True
+    eventos = [json.loads(linea) for linea in resp.text.splitlines()]
+    assert [e["tipo"] for e in eventos] == ["inicio", "titular", "subtitulo", "intro", "item", "cierre", "fin"]
+    item = eventos[4]
+    assert item["id"] == "1" and item["html"].startswith("<h2>Auriculares X</h2>")
+    assert "Precio orientativo: 59,99 €" in item["html"] and "btn-buy-amz" in item["html"]
+    # fin trae la misma respuesta que /generar-articulo
+    fin = eventos[-1]
+    assert fin["titulo"] == "Titular" and item["html"] in fin["articulo"]
+
+
+def test_parser_tolera_etiquetas_sin_cerrar():
+    import main
+
+    salida = (
+        "<articulo><titular>Titular</titular><intro><p>Intro sin cerrar</p>"
+        "<items><item id=\"1\"><nombre>Uno</nombre><texto><p>Texto uno</p></texto>"
+        "<item id='2'><texto><p>Texto dos</p></texto></item>"
+        "<item id=\"3\"><nombre>Tres<texto><p>Texto tres</p></texto></item>"
+        "<item id=\"4\"><nombre>Cortado</nombre><texto><p>Sin fin"
+    )
+    parser = main.ParserArticulo()
+    secciones = parser.feed(salida)
+    # Como las regex de antes: la intro sin cerrar se descarta, el item 2 sin
+    # </item> propio queda dentro del 1 y un campo sin cerrar no cuenta
+    assert [(s.tag, s.id, s.nombre, s.texto) for s in secciones] == [
+        ("titular", None, None, None),
+        ("item", "1", "Uno", "<p>Texto uno</p>"),
+        ("item", "3", None, "<p>Texto tres</p>"),
+    ]
+    # Lo que sigue abierto al acabar la salida no se emite
+    assert parser.close() == []
+
+    # parsear_salida normaliza antes de parsear
+    secciones = main.parsear_salida("```xml\n&lt;titular&gt;Hola&lt;/titular&gt;\n```")
+    assert [(s.tag, s.contenido) for s in secciones] == [("titular", "Hola")]
+    parser.reset()
+    assert parser.feed("<titular>Otra</titular>") == [main.Seccion("titular", None, "Otra")]
+
+
+def test_parser_apertura_repetida_empieza_en_la_ultima():
+    import main
+
+    # Las regex de antes devolvían "<titular>Titulo bueno", "<intro><p>Intro</p>",
+    # "<nombre>Uno" y "<texto><p>Texto</p>"; el parser se queda con lo que
+    # sigue a la última apertura
+    salida = (
+        "<titular><titular>Titulo bueno</titular><intro><intro><p>Intro</p></intro>"
+        "<items><item id=\"1\"><nombre><nombre>Uno</nombre><texto><texto><p>Texto</p></texto></item>"
+        "</items><subtitulo><intro>Sub</subtitulo><cierre>Fin</cierre>"
+    )
+    assert [(s.tag, s.contenido, s.nombre, s.texto) for s in main.parsear_salida(salida)] == [
+        ("titular", "Titulo bueno", None, None),
+        ("intro", "<p>Intro</p>", None, None),
+        ("item", "<nombre><nombre>Uno</nombre><texto><texto><p>Texto</p></texto>", "Uno", "<p>Texto</p>"),
+        # Otra sección abierta dentro descarta el subtitulo (antes: "<intro>Sub")
+        ("cierre", "Fin", None, None),
+    ]
+
+def test_reintenta_5xx_y_errores_de_conexion_y_devuelve_tokens(monkeypatch):
+    import asyncio
+    import httpx
+    import main
+
+    respuestas = [
+        httpx.ConnectError("conexión rechazada"),
+        httpx.Response(503, json={"error": {"message": "Overloaded"}}),
+        httpx.Response(429, headers={"retry-after-ms": "10"}, json={"error": {"message": "Rate limit"}}),
+        httpx.Response(200, json=_respuesta_openai(XML_FAKE)),
+    ]
+
+    def responder(request):
+        r = respuestas.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(responder), **kw)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "_openai", None)
+    monkeypatch.setattr(main, "OPENAI_BACKOFF_BASE", 0.01)
+    sched = main.LLMScheduler(rpm=1000, tpm=20000)
+    monkeypatch.setattr(main, "llm_scheduler", sched)
+
+    req = main.GenerarArticuloRequest(
+        tema="Auriculares",
+        productos=[{"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001"}],
+    )
+    assert asyncio.run(main.generar_articulo(req)).titulo == "Titular"
+    stats = sched.stats()
+    assert (stats["acquired"], stats["retries"], stats["errores_transitorios"], stats["rate_limited"]) == (4, 3, 2, 1)
+    # Solo queda cobrado el intento sin respuesta (conexión), unos 2.6k tokens
+    # estimados; sin devolver el 503 y el 429 faltarían más de 5k
+    assert sched.tpm - 3500 < stats["tokens_disponibles"] < sched.tpm - 2000
+
+    # Agotados los reintentos, el error transitorio llega como 500
+    respuestas[:] = [httpx.Response(500, json={"error": {"message": "boom"}})] * 2
+    monkeypatch.setattr(main, "OPENAI_MAX_RETRIES", 1)
+    monkeypatch.setattr(main, "_openai", None)
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(main.generar_articulo(req))
+    assert exc.value.status_code == 500 and respuestas == []
+
+
+def test_stream_corta_openai_si_el_cliente_se_desconecta(monkeypatch):
+    import asyncio
+    import json
+    import httpx
+    import main
+
+    estado = {"enviados": 0, "cerrado": False}
+    # El item 1 llega enseguida; el resto tardaría 30 s
+    trozos = [XML_FAKE[:XML_FAKE.index("</item>") + 7]] + [XML_FAKE[XML_FAKE.index("</item>") + 7:]] * 30
+
+    class SSE(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for i, t in enumerate(trozos):
+                if i:
+                    await asyncio.sleep(1)
+                chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+                         "choices": [{"index": 0, "delta": {"content": t}, "finish_reason": None}]}
+                estado["enviados"] += 1
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+
+        async def aclose(self):
+            estado["cerrado"] = True
+
+    class Cliente(httpx.AsyncClient):
+        def __init__(self, **kw):
+            super().__init__(transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=SSE())), **kw)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main.httpx, "AsyncClient", Cliente)
+    monkeypatch.setattr(main, "_openai", None)
+    monkeypatch.setattr(main, "completion_cache", None)
+    monkeypatch.setattr(main, "llm_scheduler", main.LLMScheduler(rpm=1000, tpm=1_000_000))
+
+    cuerpo = json.dumps({"tema": "Auriculares", "productos": [
+        {"titulo": "Auriculares X", "url_producto": "https://www.amazon.es/dp/B000000001"}]}).encode()
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": "/generar-articulo/stream", "raw_path": b"/generar-articulo/stream",
+             "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+             "client": ("test", 1), "server": ("test", 80)}
+
+    async def escenario():
+        desconectar = asyncio.Event()
+        pedido = [False]
+        recibido = []
+
+        async def receive():
+            if not pedido[0]:
+                pedido[0] = True
+                return {"type": "http.request", "body": cuerpo, "more_body": False}
+            await desconectar.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(mensaje):
+            cuerpo_msg = mensaje.get("body", b"")
+            recibido.append(cuerpo_msg)
+            if b'"tipo": "item"' in cuerpo_msg:
+                # La desconexión llega mientras se envía el item: el generador
+                # queda parado en su yield, no esperando a OpenAI
+                desconectar.set()
+                await asyncio.sleep(30)
+
+        t0 = time.perf_counter()
+        await asyncio.wait_for(main.app(scope, receive, send), timeout=10)
+        # Al volver la petición, el stream de OpenAI ya está cerrado y su hueco libre
+        return (time.perf_counter() - t0, b"".join(recibido), estado["cerrado"],
+                main._openai_en_vuelo, main._openai[1]._value)
+
+    duracion, recibido, cerrado, en_vuelo, huecos = asyncio.run(escenario())
+    assert b'"tipo": "item"' in recibido and b'"tipo": "fin"' not in recibido
+    assert duracion < 5 and cerrado and estado["enviados"] < len(trozos)
+    assert en_vuelo == 0 and huecos == main.OPENAI_MAX_CONCURRENCY
@@ -50,7 +50,7 @@ async function generarArticulos() {
   preview.innerHTML = '';
 
   try {
-    const res = await fetch(`${apiBase}/generar-articulos`, {
+    const res = await fetch(`${apiBase}/generar-articulos/stream`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify(payload)
@@ -59,22 +59,56 @@ async function generarArticulos() {
       const txt = await res.text();
       throw new Error(`Error ${res.status}: ${txt}`);
     }
-    const data = await res.json();
-    const arts = data.articulos || [];
 
-    if (!arts.length) {
-      preview.innerHTML = '<div class="alert alert-warning">No se generaron artículos.</div>';
-    } else {
-      const html = arts.map((a, i) => `
-        <div class="mb-4">
-          <h4 class="mb-1">${escapeHtml(a.titulo || `Artículo ${i+1}`)}</h4>
+    // Cada artículo se pinta en su hueco en cuanto llega, en el orden del lote
+    let fallidos = 0;
+    let recibidos = 0;
+    const onEvento = (ev) => {
+      if (ev.tipo === 'inicio') {
+        if (!ev.total) {
+          preview.innerHTML = '<div class="alert alert-warning">No se generaron artículos.</div>';
+          return;
+        }
+        preview.innerHTML = Array.from({ length: ev.total }, (_, i) =>
+          `<div class="mb-4" id="articulo_${i+1}"><div class="text-muted small">Artículo ${i+1}: generando...</div></div>`
+        ).join('');
+        status.textContent = `Generando artículos... (0/${ev.total})`;
+      } else if (ev.tipo === 'articulo') {
+        const a = ev.articulo || {};
+        recibidos++;
+        document.getElementById(`articulo_${ev.idx}`).innerHTML = `
+          <h4 class="mb-1">${escapeHtml(a.titulo || `Artículo ${ev.idx}`)}</h4>
           <div class="text-muted mb-2">${escapeHtml(a.subtitulo || '')}</div>
           <div class="border rounded p-3 bg-white">${a.articulo}</div>
-        </div>
-      `).join('');
-      preview.innerHTML = html;
+        `;
+      } else if (ev.tipo === 'error') {
+        fallidos++;
+        document.getElementById(`articulo_${ev.idx}`).innerHTML = `
+          <h4 class="mb-1">${escapeHtml(ev.titulo || `Artículo ${ev.idx}`)}</h4>
+          <div class="alert alert-danger">No se pudo generar: ${escapeHtml(ev.error)}</div>
+        `;
+      } else if (ev.tipo === 'progreso') {
+        status.textContent = `Generando artículos... (${ev.hechos}/${ev.total})`;
+      }
+    };
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lineas = buffer.split('\n');
+      buffer = lineas.pop();
+      lineas.filter(Boolean).forEach(l => onEvento(JSON.parse(l)));
+    }
+    if (buffer.trim()) onEvento(JSON.parse(buffer));
+
+    if (!recibidos && !fallidos) {
+      preview.innerHTML = '<div class="alert alert-warning">No se generaron artículos.</div>';
     }
-    status.textContent = 'Completado';
+    status.textContent = fallidos ? `Completado (${fallidos} con error)` : 'Completado';
   } catch (err) {
     status.textContent = 'Error';
     preview.innerHTML = `<div class="alert alert-danger">${escapeHtml(err.message)}</div>`;
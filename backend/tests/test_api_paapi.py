@@ -90,3 +90,445 @@ def test_buscar_construye_enlace_afiliado(monkeypatch):
     assert len(data) == 2
     assert data[0]['url_afiliado'].startswith('https://www.amazon.es/dp/ASIN1')
     assert 'tag=theobjective-21' in data[0]['url_afiliado']
+
+
+def test_rate_limiter_prioriza_interactivas():
+    import asyncio
+
+    async def escenario():
+        sched = api_module.TokenBucketScheduler(tps=50, burst=1, max_queue=10, timeout=2)
+        await sched.acquire()  # agota el único token
+        orden = []
+
+        async def pedir(nombre, prio):
+            await sched.acquire(prio)
+            orden.append(nombre)
+
+        bulk = asyncio.create_task(pedir('bulk', api_module.PRIORIDADES['background']))
+        await asyncio.sleep(0)
+        interactiva = asyncio.create_task(pedir('interactiva', api_module.PRIORIDADES['interactiva']))
+        await asyncio.gather(bulk, interactiva)
+        return orden, sched.stats()
+
+    orden, stats = asyncio.run(escenario())
+    assert orden == ['interactiva', 'bulk']
+    assert stats['acquired'] == 3 and stats['queue_depth'] == 0
+    assert stats['max_queue_depth'] == 2
+
+
+def test_rate_limiter_cola_llena_devuelve_429(monkeypatch):
+    import asyncio
+
+    sched = api_module.TokenBucketScheduler(tps=0.01, burst=1, max_queue=0, timeout=1)
+    asyncio.run(sched.acquire())  # sin tokens ni hueco en cola
+    monkeypatch.setattr(api_module, 'paapi_scheduler', sched)
+    api_module.search_cache.clear()
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=lambda **kw: _Response(1)))
+    resp = client.get('/buscar', params={'busqueda': 'auriculares'})
+    assert resp.status_code == 429
+    assert 'Retry-After' in resp.headers
+
+
+def test_buscar_cache_ttl_y_stale_while_revalidate(monkeypatch):
+    ahora = [1000.0]
+    cache = api_module.ResultCache(max_entries=10, max_bytes=10**6, ttl=60, stale_ttl=300, clock=lambda: ahora[0])
+    monkeypatch.setattr(api_module, 'search_cache', cache)
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    llamadas = []
+
+    def fake_search_items(**kwargs):
+        llamadas.append(kwargs)
+        return _Response(3)
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=fake_search_items))
+
+    params = {'busqueda': 'Aspiradoras', 'num_resultados': 3}
+    primera = client.get('/buscar', params=params).json()
+    # Misma búsqueda normalizada (mayúsculas/espacios): se sirve desde caché
+    segunda = client.get('/buscar', params={'busqueda': '  aspiradoras ', 'num_resultados': 3}).json()
+    assert len(llamadas) == 1
+    assert segunda == primera
+
+    ahora[0] += 120  # pasado el TTL pero dentro de la ventana stale
+    stale = client.get('/buscar', params=params).json()
+    assert stale == primera
+    assert len(llamadas) == 2  # refresco en segundo plano
+
+    stats = client.get('/health').json()['cache']
+    assert stats['hits'] == 1 and stats['stale_hits'] == 1 and stats['misses'] == 1
+
+
+def test_refresco_en_segundo_plano_guarda_referencia(monkeypatch):
+    import asyncio
+
+    cache = api_module.ResultCache(max_entries=10, max_bytes=10**6, ttl=60)
+    monkeypatch.setattr(api_module, 'search_cache', cache)
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=lambda **kw: _Response(2)))
+
+    async def escenario():
+        api_module._refrescar_en_segundo_plano(('aspiradoras', None, 2, 1), 'aspiradoras', None, 2, 1)
+        en_vuelo = len(api_module._refrescos)
+        await asyncio.gather(*api_module._refrescos)
+        return en_vuelo
+
+    assert asyncio.run(escenario()) == 1
+    assert not api_module._refrescos
+    assert len(cache) == 1
+
+
+def test_result_cache_expulsa_lru():
+    cache = api_module.ResultCache(max_entries=2, max_bytes=100, ttl=60)
+    cache.set('a', 1, size=10)
+    cache.set('b', 2, size=10)
+    cache.get('a')
+    cache.set('c', 3, size=10)  # expulsa 'b', la menos usada
+    assert cache.get('b') == (None, None)
+    cache.set('d', 4, size=85)  # supera los bytes: expulsa 'a' hasta caber
+    assert cache.get('a') == (None, None)
+    assert cache.stats()['evictions'] == 2 and len(cache) == 2
+
+
+def test_single_flight_50_peticiones_identicas_una_llamada(monkeypatch):
+    import asyncio
+    import threading
+    import time
+    import httpx
+
+    monkeypatch.setattr(api_module, 'search_cache', api_module.ResultCache(100, 10**6, ttl=60))
+    monkeypatch.setattr(api_module, 'search_flight', api_module.SingleFlight())
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    llamadas = []
+    lock = threading.Lock()
+
+    def fake_search_items(**kwargs):
+        with lock:
+            llamadas.append(kwargs)
+        time.sleep(0.2)
+        return _Response(2)
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=fake_search_items))
+
+    async def escenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as ac:
+            return await asyncio.gather(*(
+                ac.get('/buscar', params={'busqueda': 'auriculares', 'num_resultados': 2})
+                for _ in range(50)
+            ))
+
+    respuestas = asyncio.run(escenario())
+    assert len(llamadas) == 1
+    assert all(r.status_code == 200 for r in respuestas)
+    assert len({r.text for r in respuestas}) == 1
+    assert api_module.search_flight.stats()['coalesced'] == 49
+
+
+def test_items_lotes_de_10_y_cache_por_asin(monkeypatch):
+    monkeypatch.setattr(api_module, 'item_cache', api_module.ResultCache(1000, 10**6, ttl=60))
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    lotes = []
+
+    def fake_get_items(items):
+        lotes.append(list(items))
+        # Amazon no devuelve ASIN24
+        return [_Item(int(a[4:])) for a in items if a != 'ASIN24']
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(get_items=fake_get_items))
+
+    asins = [f'ASIN{i}' for i in range(1, 26)]
+    r = client.post('/items', json={'asins': asins})
+    assert r.status_code == 200
+    assert [p['asin'] for p in r.json()] == [a for a in asins if a != 'ASIN24']
+    assert sorted(len(l) for l in lotes) == [5, 10, 10]
+
+    lotes.clear()
+    r = client.post('/items', json={'asins': ['asin3', 'ASIN24', 'ASIN30']})
+    assert [p['asin'] for p in r.json()] == ['ASIN3', 'ASIN30']
+    assert lotes == [['ASIN24', 'ASIN30']]
+
+
+def test_campos_numericos_de_precio():
+    item = _Item(1)
+    item.offers.listings[0].price.savings = types.SimpleNamespace(percentage=25, amount=20.0, display_amount=None)
+    item.list_price = types.SimpleNamespace(amount=79.99, currency='EUR')
+    item.offers.listings[0].price.amount = 59.99
+    p = api_module._extraer_producto(item)
+    assert p.precio == '59,99 € (antes 79,99 €, -25%)'
+    assert (p.precio_amount, p.precio_currency, p.precio_lista_amount) == (59.99, 'EUR', 79.99)
+    assert (p.ahorro_pct, p.ahorro_amount, p.tiene_descuento) == (25.0, 20.0, True)
+
+    sin_oferta = api_module._extraer_producto(_Item(2))
+    assert sin_oferta.precio_amount == 19.99 and sin_oferta.ahorro_pct is None
+    assert sin_oferta.tiene_descuento is False
+
+    # Con ahorro pero sin precio no hay descuento que anunciar
+    sin_precio = _Item(3)
+    sin_precio.offers.listings[0].price = types.SimpleNamespace(
+        amount=None, currency=None, savings=types.SimpleNamespace(percentage=25, amount=20.0))
+    p = api_module._extraer_producto(sin_precio)
+    assert p.precio == api_module._SIN_PRECIO and p.precio_amount is None
+    assert p.ahorro_pct == 25.0 and p.tiene_descuento is False
+
+
+def test_descuento_derivado_del_precio_de_lista_solo_con_flag(monkeypatch):
+    # Precio de lista por encima del precio, sin savings de PAAPI
+    item = _Item(1)
+    item.offers.listings[0].price.amount = 59.99
+    item.list_price = types.SimpleNamespace(amount=79.99, currency='EUR')
+
+    monkeypatch.setattr(api_module, 'PAAPI_DESCUENTO_DERIVADO', False)
+    p = api_module._extraer_producto(item)
+    assert p.precio_lista_amount == 79.99
+    assert (p.ahorro_pct, p.ahorro_amount, p.tiene_descuento) == (None, None, False)
+
+    monkeypatch.setattr(api_module, 'PAAPI_DESCUENTO_DERIVADO', True)
+    derivado = api_module._extraer_producto(item)
+    assert (derivado.ahorro_pct, derivado.ahorro_amount, derivado.tiene_descuento) == (25.0, 20.0, True)
+    # El texto del precio no cambia: solo se enriquece con savings de PAAPI
+    assert derivado.precio == p.precio
+
+
+def test_almacen_local_sirve_busquedas_e_items_tras_reinicio(monkeypatch, tmp_path):
+    store = api_module.ProductStore(str(tmp_path / 'paapi.sqlite3'))
+    monkeypatch.setattr(api_module, 'product_store', store)
+    monkeypatch.setattr(api_module, 'search_cache', api_module.ResultCache(100, 10**6, ttl=60))
+    monkeypatch.setattr(api_module, 'item_cache', api_module.ResultCache(100, 10**6, ttl=60))
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=lambda **kw: _Response(3)))
+
+    params = {'busqueda': 'auriculares', 'categoria': 'tecnologia', 'num_resultados': 3}
+    original = client.get('/buscar', params=params).json()
+    assert store.stats()['productos'] == 3 and store.stats()['busquedas'] == 1
+    journal = store._conn.execute('PRAGMA journal_mode').fetchone()[0]
+    assert journal == 'wal'
+
+    # "Reinicio": cachés en memoria vacías y Amazon no disponible
+    monkeypatch.setattr(api_module, 'search_cache', api_module.ResultCache(100, 10**6, ttl=60))
+    monkeypatch.setattr(api_module, 'item_cache', api_module.ResultCache(100, 10**6, ttl=60))
+    pedidos = []
+
+    def fake_get_items(items):
+        pedidos.append(list(items))
+        return [_Item(int(a[4:])) for a in items]
+
+    def sin_amazon(**kw):
+        raise AssertionError('no debería llamar a Amazon')
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=sin_amazon, get_items=fake_get_items))
+
+    assert client.get('/buscar', params={**params, 'modo': 'local'}).json() == original
+    r = client.post('/items', json={'asins': ['ASIN1', 'ASIN2', 'ASIN7'], 'modo': 'local'})
+    assert [p['asin'] for p in r.json()] == ['ASIN1', 'ASIN2', 'ASIN7']
+    assert pedidos == [['ASIN7']]
+    store.close()
+
+
+def test_prefetch_calienta_conjunto_con_tokens_sobrantes(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(api_module, 'search_cache', api_module.ResultCache(100, 10**6, ttl=600))
+    monkeypatch.setattr(api_module, 'search_flight', api_module.SingleFlight())
+    llamadas = []
+
+    def fake_search_items(**kwargs):
+        llamadas.append((kwargs['keywords'], kwargs['item_page'], kwargs.get('search_index')))
+        return _Response(2)
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=fake_search_items))
+
+    pf = api_module.Prefetcher('aspiradoras, auriculares@tecnologia', '1-2', num=10, learn_top=5, min_hits=1.5)
+    monkeypatch.setattr(api_module, 'prefetcher', pf)
+    # Dos búsquedas interactivas iguales: se aprende como caliente
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    for _ in range(2):
+        assert client.get('/buscar', params={'busqueda': 'freidora de aire'}).status_code == 200
+    llamadas.clear()
+    api_module.search_cache.clear()
+
+    # Sin tokens sobrantes no se precarga nada
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=0.001, burst=1))
+    asyncio.run(api_module.paapi_scheduler.acquire())
+    assert asyncio.run(pf.tick()) == 0 and llamadas == []
+    assert pf.informe()['sin_margen'] == 1
+
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    assert asyncio.run(pf.tick()) == 5
+    assert sorted(llamadas) == [
+        ('aspiradoras', 1, None), ('aspiradoras', 2, None),
+        ('auriculares', 1, 'Electronics'), ('auriculares', 2, 'Electronics'),
+        ('freidora de aire', 1, None),
+    ]
+    assert asyncio.run(pf.tick()) == 0  # todo fresco
+
+    informe = client.get('/prefetch').json()
+    assert len(informe['entradas']) == 5
+    assert {e['origen'] for e in informe['entradas']} == {'config', 'aprendida'}
+    assert all(e['cache'] == 'fresh' and e['lag_s'] == 0 for e in informe['entradas'])
+
+
+def test_prefetch_acota_num_como_buscar(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(api_module, 'search_cache', api_module.ResultCache(100, 10**6, ttl=600))
+    monkeypatch.setattr(api_module, 'search_flight', api_module.SingleFlight())
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    llamadas = []
+
+    def fake_search_items(**kwargs):
+        llamadas.append((kwargs['keywords'], kwargs['item_count']))
+        return _Response(2)
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=fake_search_items))
+
+    pf = api_module.Prefetcher('aspiradoras', '1', num=20)
+    monkeypatch.setattr(api_module, 'prefetcher', pf)
+    assert asyncio.run(pf.tick()) == 1
+    assert llamadas == [('aspiradoras', 10)]
+
+    # /buscar con num_resultados=20 usa la misma clave: sale de la caché precargada
+    r = client.get('/buscar', params={'busqueda': 'aspiradoras', 'num_resultados': 20})
+    assert r.status_code == 200 and len(r.json()) == 2
+    assert llamadas == [('aspiradoras', 10)]
+    assert asyncio.run(pf.tick()) == 0
+
+
+def test_prefetch_espera_tras_fallos_sin_colarse(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(api_module, 'search_cache', api_module.ResultCache(100, 10**6, ttl=600))
+    monkeypatch.setattr(api_module, 'search_flight', api_module.SingleFlight())
+    monkeypatch.setattr(api_module, 'paapi_scheduler', api_module.TokenBucketScheduler(tps=1000, burst=100))
+    llamadas = []
+
+    def fake_search_items(**kwargs):
+        llamadas.append(kwargs['keywords'])
+        if kwargs['keywords'] == 'rota':
+            raise RuntimeError('InvalidParameterValue')
+        return _Response(2)
+    monkeypatch.setattr(api_module, 'amazon_api', types.SimpleNamespace(search_items=fake_search_items))
+
+    ahora = [1000.0]
+    pf = api_module.Prefetcher('rota,aspiradoras', '1', error_backoff=60, error_backoff_max=200,
+                               clock=lambda: ahora[0])
+    asyncio.run(pf.tick())
+    intentos = llamadas.count('rota')
+    assert intentos >= 1 and 'aspiradoras' in llamadas
+    entrada = next(e for e in pf.informe()['entradas'] if e['busqueda'] == 'rota')
+    assert entrada['fallos_seguidos'] == 1 and entrada['reintento_en_s'] == 60
+
+    # Dentro de la espera no se vuelve a pedir aunque los ticks sigan
+    for _ in range(5):
+        ahora[0] += 10
+        assert asyncio.run(pf.tick()) == 0
+    assert llamadas.count('rota') == intentos and pf.informe()['en_espera_por_error'] == 1
+
+    # aspiradoras caduca mientras no sobra cuota: pendiente desde t=1050
+    api_module.search_cache.clear()
+    pf.reserve = 10**6
+    assert asyncio.run(pf.tick()) == 0
+    pf.reserve = 0
+
+    # Pasada la espera se reintenta, pero detrás de la que llevaba más tiempo
+    # pendiente; el siguiente fallo dobla la espera (con tope)
+    ahora[0] += 20
+    llamadas.clear()
+    asyncio.run(pf.tick())
+    assert llamadas[0] == 'aspiradoras' and 'rota' in llamadas
+    entrada = next(e for e in pf.informe()['entradas'] if e['busqueda'] == 'rota')
+    assert entrada['fallos_seguidos'] == 2 and entrada['reintento_en_s'] == 120
+    ahora[0] += 121
+    asyncio.run(pf.tick())
+    entrada = next(e for e in pf.informe()['entradas'] if e['busqueda'] == 'rota')
+    assert entrada['reintento_en_s'] == 200
+
+
+# Getters de antes de compilar las rutas (copia literal), como referencia
+def _walk_antiguo(obj, path):
+    cur = obj
+    for p in path:
+        if isinstance(p, int):
+            if isinstance(cur, (list, tuple)) and len(cur) > p:
+                cur = cur[p]
+            else:
+                return None
+        else:
+            cur = getattr(cur, p, None)
+            if cur is None:
+                return None
+    return cur
+
+
+def _imagen_antigua(it):
+    try:
+        direct = getattr(it, 'image_url', None) or getattr(it, 'large_image_url', None)
+        if direct:
+            return direct
+        for path in [('images', 'primary', 'large', 'url'), ('images', 'primary', 'medium', 'url'),
+                     ('images', 'primary', 'small', 'url'), ('large_image', 'url'), ('medium_image', 'url'),
+                     ('small_image', 'url'), ('image', 'url')]:
+            v = _walk_antiguo(it, path)
+            if isinstance(v, str) and v:
+                return v
+    except Exception:
+        pass
+    return ""
+
+
+def _titulo_antiguo(it):
+    try:
+        for path in [('item_info', 'title', 'display_value'), ('item_info', 'product_title', 'display_value'),
+                     ('title',), ('product_title',)]:
+            v = _walk_antiguo(it, path)
+            if isinstance(v, str) and v.strip():
+                return v.strip()
+    except Exception:
+        pass
+    return getattr(it, 'title', None) or getattr(it, 'product_title', None) or ''
+
+
+class _ItemRaro:
+    """Objeto del SDK cuyas propiedades fallan al leerlas."""
+    title = "Título directo"
+
+    @property
+    def images(self):
+        raise RuntimeError("sin imágenes")
+
+    @property
+    def item_info(self):
+        raise RuntimeError("sin item_info")
+
+
+def test_extraccion_coincide_con_los_getters_antiguos_en_objetos_parciales():
+    NS = types.SimpleNamespace
+    EUR = "EUR"
+    # (item, precio que daba la extracción antigua)
+    casos = [
+        (NS(), "Precio no disponible"),
+        (None, "Precio no disponible"),
+        (NS(image_url="https://img/a.jpg", item_info=NS(title=NS(display_value="  Aspiradora  "))),
+         "Precio no disponible"),
+        (NS(images=NS(primary=NS(large=None, medium=NS(url="https://img/m.jpg"), small=None)),
+            item_info=NS(title=NS(display_value="   "), product_title=NS(display_value="Producto")), title="Directo"),
+         "Precio no disponible"),
+        (NS(images=NS(primary=None), image=NS(url=""), small_image=NS(url="https://img/s.jpg"),
+            item_info=NS(title=NS(display_value=123)), product_title="PT"), "Precio no disponible"),
+        (_ItemRaro(), "Precio no disponible"),
+        (NS(offers=NS(listings=[], summaries=[NS(lowest_price=NS(amount=12.5, currency=EUR, display_amount=None))])),
+         "12,50 €"),
+        (NS(offers=NS(listings=None, summaries=None), price=NS(display_amount="  EUR 9,99 ")), "EUR 9,99"),
+        (NS(offers=NS(listings=[NS(price=NS(amount=30, currency="USD", display_amount=None,
+                                            savings=NS(percentage=None, amount=5, display_amount=None, basis=35)))])),
+         "30.00 USD (ahorro 5,00 USD, antes 35.00 USD)"),
+        (NS(offers=NS(listings=[NS(price=NS(amount=20, currency=EUR, display_amount="20,00 €",
+                                            savings=NS(percentage=25, amount=None, display_amount=None, basis=None)))])),
+         "20,00 € (-25%)"),
+        (NS(offers=NS(listings=[NS(price=NS(amount="no-num", currency=EUR, display_amount=None, savings=None))])),
+         "no-num EUR"),
+    ]
+    for item, precio in casos:
+        assert api_module._get_title(item) == _titulo_antiguo(item)
+        assert api_module._get_image_url(item) == _imagen_antigua(item)
+        p = api_module._extraer_producto(item)
+        assert (p.titulo, p.url_imagen, p.precio) == (_titulo_antiguo(item) or "Sin título", _imagen_antigua(item), precio)
+
+    # Rutas compiladas: índices fuera de rango o sobre algo que no es lista dan None
+    ruta = api_module._compilar_ruta(('offers', 'listings', 0, 'price'))
+    assert ruta(NS(offers=NS(listings=[]))) is None
+    assert ruta(NS(offers=NS(listings="no-lista"))) is None
+    assert ruta(NS(offers=NS(listings=[NS(price=7)]))) == 7
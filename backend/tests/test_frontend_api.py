@@ -12,20 +12,31 @@ app = fe_module.app  # noqa
 client = TestClient(app)
 
 
-async def _fake_buscar_productos(busqueda, categoria, total):
-    # Devuelve productos mínimos
+@pytest.fixture(autouse=True)
+def _lote_cache_vacia():
+    # Cada test genera sus propios lotes con sus propios fakes
+    fe_module.lote_cache.clear()
+    yield
+    fe_module.lote_cache.clear()
+
+
+async def _fake_buscar_productos(busqueda, categoria, total, pagina_inicial=1):
+    # Devuelve productos mínimos; con pagina_inicial > 1 continúa la numeración
+    # (páginas de 10) como api-paapi
     items = []
-    for i in range(total):
+    for i in range((pagina_inicial - 1) * 10, (pagina_inicial - 1) * 10 + total):
         items.append(type('P', (), {
-            'titulo': f'Producto {i+1}',
+            'titulo': f'Auriculares Producto {i+1}',
             'url_producto': f'https://www.amazon.es/dp/ASIN{i+1}',
             'url_afiliado': f'https://www.amazon.es/dp/ASIN{i+1}?tag=theobjective-21',
             'url_imagen': 'https://example.com/img.jpg',
             'precio': '19.99 EUR',
             'marca': 'Marca',
             'features': None,
+            'tiene_descuento': True,
+            'ahorro_pct': 20.0,
             'model_dump': lambda self=None: {
-                'titulo': f'Producto {i+1}',
+                'titulo': f'Auriculares Producto {i+1}',
                 'url_producto': f'https://www.amazon.es/dp/ASIN{i+1}',
                 'url_afiliado': f'https://www.amazon.es/dp/ASIN{i+1}?tag=theobjective-21',
                 'url_imagen': 'https://example.com/img.jpg',
@@ -37,13 +48,13 @@ async def _fake_buscar_productos(busqueda, categoria, total):
     return items
 
 
-async def _fake_generar_articulo(tema, productos, kw_main, kw_sec):
+async def _fake_generar_articulo(tema, productos, kw_main, kw_sec, force_fresh=False):
     body = "Contenido demo con enlace contextual a Amazon y tono editorial."
-    return type('A', (), {
-        'titulo': tema,
-        'subtitulo': 'Subtitulo demo',
-        'articulo': body,
-    })()
+    return fe_module.Articulo(
+        titulo=tema,
+        subtitulo='Subtitulo demo',
+        articulo=body,
+    )
 
 
 def test_generar_articulos_y_xml(monkeypatch):
@@ -91,3 +102,510 @@ def test_ensure_url_normalization():
     assert mod._ensure_url('example.com') == 'https://example.com'
     assert mod._ensure_url('https://example.com') == 'https://example.com'
     assert mod._ensure_url('') == ''
+
+
+def test_buscar_productos_paginas_en_paralelo_fusion_y_dedupe(monkeypatch):
+    import asyncio
+    import httpx
+
+    pedidas = []
+
+    def handler(request):
+        pagina = int(request.url.params['pagina'])
+        pedidas.append(pagina)
+        # Cada página repite el último ASIN de la anterior
+        data = [{'asin': f'A{(pagina - 1) * 10 + i}', 'titulo': f'P{(pagina - 1) * 10 + i}',
+                 'url_producto': 'u', 'url_afiliado': 'u'} for i in range(0, 11)]
+        return httpx.Response(200, json=data)
+
+    cliente_original = httpx.AsyncClient
+    monkeypatch.setattr(fe_module.httpx, 'AsyncClient',
+                        lambda **kw: cliente_original(transport=httpx.MockTransport(handler), **kw))
+    monkeypatch.setattr(fe_module, 'rendimiento_busquedas', fe_module.RendimientoBusquedas(0.5, 1.0, 10))
+    productos = asyncio.run(fe_module.buscar_productos('auriculares', 'All', 25))
+    assert [p.asin for p in productos] == [f'A{i}' for i in range(25)]
+    assert sorted(pedidas) == [1, 2, 3]
+    assert fe_module.rendimiento_busquedas.paginas == 3
+
+    # Una página que falla también se ha pedido y cuenta
+    monkeypatch.setattr(fe_module.httpx, 'AsyncClient',
+                        lambda **kw: cliente_original(transport=httpx.MockTransport(
+                            lambda request: httpx.Response(500, text='caída')), **kw))
+    with pytest.raises(fe_module.HTTPException):
+        asyncio.run(fe_module.buscar_productos('auriculares', 'All', 5))
+    assert fe_module.rendimiento_busquedas.paginas == 4
+
+
+def test_generar_articulos_lote_parcial_en_orden(monkeypatch):
+    import asyncio
+
+    mod = fe_module
+    en_vuelo = {'actual': 0, 'max': 0}
+
+    async def generar(tema, productos, kw_main, kw_sec, force_fresh=False):
+        en_vuelo['actual'] += 1
+        en_vuelo['max'] = max(en_vuelo['max'], en_vuelo['actual'])
+        # Los primeros terminan los últimos: el orden debe respetarse igualmente
+        n = int(productos[0].titulo.rsplit(' ', 1)[1])
+        await asyncio.sleep(0.01 * (6 - n))
+        en_vuelo['actual'] -= 1
+        if n == 5:
+            raise mod.HTTPException(status_code=502, detail='Error Generador: timeout')
+        return await _fake_generar_articulo(productos[0].titulo, productos, kw_main, kw_sec)
+
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', generar)
+    monkeypatch.setattr(mod, 'GEN_CONCURRENCY', 2)
+
+    payload = {'busqueda': 'auriculares', 'num_articulos': 3, 'items_por_articulo': 2,
+               'palabra_clave_principal': 'auriculares'}
+    r = client.post('/generar-articulos', json=payload)
+    assert r.status_code == 200
+    arts = r.json()['articulos']
+    assert [a['error'] for a in arts] == [None, None, 'Error Generador: timeout']
+    assert [a['titulo'] for a in arts[:2]] == ['Auriculares Producto 1', 'Auriculares Producto 3']
+    assert en_vuelo['max'] == 2
+
+    # El XML solo exporta los artículos generados
+    xml = client.post('/export/wp-all-import', json=payload).json()['xml']
+    assert xml.count('<item>') == 2
+
+
+def _esperar_job(c, job_id, timeout=5.0):
+    import time
+    limite = time.time() + timeout
+    while time.time() < limite:
+        estado = c.get(f'/jobs/{job_id}').json()
+        if estado['estado'] in ('completado', 'error'):
+            return estado
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} sin terminar: {estado}')
+
+
+def test_job_xml_en_segundo_plano(monkeypatch, tmp_path):
+    mod = fe_module
+    monkeypatch.setattr(mod, 'job_store', mod.JobStore(str(tmp_path / 'jobs.sqlite3')))
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', _fake_generar_articulo)
+
+    payload = {'busqueda': 'auriculares', 'num_articulos': 3, 'items_por_articulo': 2,
+               'palabra_clave_principal': 'auriculares', 'formato': 'xml'}
+    with TestClient(app) as c:
+        r = c.post('/jobs', json=payload)
+        assert r.status_code == 202
+        job_id = r.json()['id']
+        estado = _esperar_job(c, job_id)
+        assert (estado['estado'], estado['total'], estado['hechos']) == ('completado', 3, 3)
+        r = c.get(estado['artefacto'])
+        assert r.headers['content-type'].startswith('application/xml')
+        assert r.text.count('<item>') == 3
+        assert c.get('/jobs/no-existe').status_code == 404
+        r = c.post('/jobs', json={**payload, 'formato': 'pdf'})
+        assert r.status_code == 422 and r.json()['detail'][0]['loc'] == ['body', 'formato']
+
+
+def test_job_se_reanuda_tras_reinicio_sin_repetir_articulos(monkeypatch, tmp_path):
+    mod = fe_module
+    path = str(tmp_path / 'jobs.sqlite3')
+    # Estado que dejó un proceso anterior: grupos elegidos y el artículo 1 hecho
+    anterior = mod.JobStore(path)
+    req = mod.LoteRequest(busqueda='auriculares', num_articulos=2, items_por_articulo=1)
+    job_id = anterior.crear(req, 'json')
+    grupos = [[{'titulo': f'Auriculares Producto {i}', 'url_producto': 'u', 'url_afiliado': 'u'}] for i in (1, 2)]
+    anterior.guardar_grupos(job_id, grupos)
+    anterior.guardar_articulo(job_id, 1, mod.Articulo(titulo='Previo', subtitulo='', articulo='ya generado'))
+    anterior.marcar(job_id, 'en_curso')
+    anterior.close()
+
+    generados = []
+
+    async def generar(tema, productos, kw_main, kw_sec, force_fresh=False):
+        generados.append(productos[0].titulo)
+        return await _fake_generar_articulo(tema, productos, kw_main, kw_sec)
+
+    async def no_buscar(*a, **kw):
+        raise AssertionError('no debe repetirse la búsqueda')
+
+    monkeypatch.setattr(mod, 'job_store', mod.JobStore(path))
+    monkeypatch.setattr(mod, 'buscar_productos', no_buscar)
+    monkeypatch.setattr(mod, 'generar_articulo', generar)
+    with TestClient(app) as c:
+        estado = _esperar_job(c, job_id)
+        assert (estado['estado'], estado['hechos']) == ('completado', 2)
+        arts = c.get(f'/jobs/{job_id}/artefacto').json()['articulos']
+    assert generados == ['Auriculares Producto 2']
+    assert [a['articulo'] for a in arts][0] == 'ya generado'
+
+
+def test_generar_articulos_stream_ndjson_segun_terminan(monkeypatch):
+    import asyncio
+    import json
+
+    mod = fe_module
+
+    async def generar(tema, productos, kw_main, kw_sec, force_fresh=False):
+        n = int(productos[0].titulo.rsplit(' ', 1)[1])
+        # El primero es el más lento: debe llegar el último
+        await asyncio.sleep(0.05 if n == 1 else 0)
+        if n == 3:
+            raise RuntimeError('LLM caído')
+        return await _fake_generar_articulo(f'Art {n}', productos, kw_main, kw_sec)
+
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', generar)
+    payload = {'busqueda': 'auriculares', 'num_articulos': 3, 'items_por_articulo': 1,
+               'palabra_clave_principal': 'auriculares'}
+    r = client.post('/generar-articulos/stream', json=payload)
+    assert r.status_code == 200
+    assert r.headers['content-type'].startswith('application/x-ndjson')
+    eventos = [json.loads(l) for l in r.text.splitlines()]
+    assert eventos[0] == {'tipo': 'inicio', 'total': 3}
+    assert eventos[-1] == {'tipo': 'fin', 'hechos': 3, 'errores': 1}
+    resultados = [(e['tipo'], e['idx']) for e in eventos if e['tipo'] in ('articulo', 'error')]
+    assert resultados[-1] == ('articulo', 1)
+    assert ('error', 3) in resultados
+    assert [e['hechos'] for e in eventos if e['tipo'] == 'progreso'] == [1, 2, 3]
+
+
+def test_export_xml_file_en_streaming(monkeypatch):
+    import xml.etree.ElementTree as ET
+
+    mod = fe_module
+
+    async def generar(tema, productos, kw_main, kw_sec, force_fresh=False):
+        if productos[0].titulo.endswith('Producto 1'):
+            raise RuntimeError('LLM caído')
+        return await _fake_generar_articulo(tema, productos, kw_main, kw_sec)
+
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', generar)
+    payload = {'busqueda': 'auriculares', 'num_articulos': 3, 'items_por_articulo': 1,
+               'palabra_clave_principal': 'auriculares'}
+    with client.stream('POST', '/export/wp-all-import/file', json=payload) as r:
+        assert r.status_code == 200
+        assert 'content-length' not in r.headers
+        trozos = list(r.iter_bytes())
+    doc = ET.fromstring(b''.join(trozos))
+    assert len(doc.findall('item')) == 2
+
+    async def falla(*a, **kw):
+        raise RuntimeError('LLM caído')
+
+    monkeypatch.setattr(mod, 'generar_articulo', falla)
+    assert client.post('/export/wp-all-import/file', json=payload).status_code == 502
+
+
+def test_export_file_en_orden_del_lote_con_y_sin_cache(monkeypatch):
+    import asyncio
+
+    mod = fe_module
+
+    async def generar(tema, productos, kw_main, kw_sec, force_fresh=False):
+        n = int(productos[0].titulo.rsplit(' ', 1)[1])
+        # Los primeros terminan los últimos
+        await asyncio.sleep(0.01 * (4 - n))
+        art = await _fake_generar_articulo(tema, productos, kw_main, kw_sec)
+        return art.model_copy(update={'articulo': f'Cuerpo {n}'})
+
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', generar)
+    payload = {'busqueda': 'auriculares', 'num_articulos': 3, 'items_por_articulo': 1,
+               'palabra_clave_principal': 'auriculares'}
+    fallo = client.post('/export/wp-all-import/file', json=payload).text
+    acierto = client.post('/export/wp-all-import/file', json=payload)
+    assert 'etag' in acierto.headers
+    assert fallo == acierto.text
+    assert [fallo.index(f'Cuerpo {n}') for n in (1, 2, 3)] == sorted(fallo.index(f'Cuerpo {n}') for n in (1, 2, 3))
+
+    # Sin caché no se retienen los artículos ya escritos
+    mod.lote_cache.clear()
+    monkeypatch.setattr(mod.lote_cache, 'max_entries', 0)
+    assert client.post('/export/wp-all-import/file', json=payload).text == fallo
+    assert mod.lote_cache.stats()['entries'] == 0
+
+
+@pytest.mark.parametrize('nivel', [0, 1])
+def test_export_zip_en_streaming(monkeypatch, nivel):
+    import io
+    import zipfile
+    import zlib
+
+    mod = fe_module
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', _fake_generar_articulo)
+    monkeypatch.setattr(mod, 'ZIP_COMPRESSLEVEL', nivel)
+    # Spool mínimo: el XML pasa a disco desde el primer artículo
+    monkeypatch.setattr(mod, 'ZIP_SPOOL_MAX_BYTES', 16)
+    payload = {'busqueda': 'auriculares', 'num_articulos': 3, 'items_por_articulo': 1,
+               'palabra_clave_principal': 'auriculares'}
+    with client.stream('POST', '/export/wp-all-import/zip', json=payload) as r:
+        assert r.status_code == 200
+        assert r.headers['content-type'] == 'application/zip'
+        datos = b''.join(r.iter_bytes())
+    with zipfile.ZipFile(io.BytesIO(datos)) as zf:
+        assert zf.testzip() is None
+        nombres = zf.namelist()
+        assert nombres == ['articulo_01.md', 'articulo_02.md', 'articulo_03.md', 'theobjective_articulos.xml']
+        esperado = zipfile.ZIP_STORED if nivel == 0 else zipfile.ZIP_DEFLATED
+        assert {i.compress_type for i in zf.infolist()} == {esperado}
+        assert zf.read('theobjective_articulos.xml').decode('utf-8').count('<item>') == 3
+        if nivel:
+            # Se aplica el nivel de compresión configurado
+            xml = zf.getinfo('theobjective_articulos.xml')
+            comp = zlib.compressobj(nivel, zlib.DEFLATED, -15)
+            crudo = zf.read(xml.filename)
+            assert xml.compress_size == len(comp.compress(crudo) + comp.flush())
+    # El mismo lote da los mismos bytes
+    arts = [mod.Articulo(titulo=f'T{i}', subtitulo='s', articulo='x' * 500) for i in range(2)]
+    req = mod.LoteRequest(**payload)
+    assert mod.build_zip(req, arts) == mod.build_zip(req, arts)
+
+
+def test_exports_reutilizan_lote_cacheado_con_etag(monkeypatch):
+    import io
+    import zipfile
+
+    mod = fe_module
+    llamadas = []
+    frescos = []
+
+    async def generar(tema, productos, kw_main, kw_sec, force_fresh=False):
+        llamadas.append(productos[0].titulo)
+        frescos.append(force_fresh)
+        return await _fake_generar_articulo(tema, productos, kw_main, kw_sec)
+
+    monkeypatch.setattr(mod, 'buscar_productos', _fake_buscar_productos)
+    monkeypatch.setattr(mod, 'generar_articulo', generar)
+    payload = {'busqueda': 'auriculares', 'num_articulos': 2, 'items_por_articulo': 1,
+               'palabra_clave_principal': 'auriculares', 'palabras_clave_secundarias': []}
+
+    # El ZIP en streaming genera y deja el lote en caché
+    r = client.post('/export/wp-all-import/zip', json=payload)
+    assert r.status_code == 200 and 'etag' not in r.headers
+    assert len(llamadas) == 2
+
+    # El resto de formatos (y la misma petición con otro orden de claves) no regeneran
+    r = client.post('/export/wp-all-import', json=dict(reversed(list(payload.items()))))
+    etag = r.headers['etag']
+    assert r.json()['xml'].count('<item>') == 2
+    r = client.post('/export/wp-all-import/file', json=payload)
+    assert r.headers['etag'] == etag and r.text.count('<item>') == 2
+    r = client.post('/export/wp-all-import/zip', json=payload)
+    assert r.headers['etag'] == etag
+    assert len(zipfile.ZipFile(io.BytesIO(r.content)).namelist()) == 3
+    assert len(llamadas) == 2
+
+    for ruta in ('/export/wp-all-import', '/export/wp-all-import/file', '/export/wp-all-import/zip'):
+        r = client.post(ruta, json=payload, headers={'If-None-Match': etag})
+        assert r.status_code == 304 and r.headers['etag'] == etag and r.content == b''
+
+    # Cache-Control: no-cache regenera (y deja el lote nuevo en caché)
+    for ruta in ('/export/wp-all-import', '/export/wp-all-import/file', '/export/wp-all-import/zip'):
+        r = client.post(ruta, json=payload, headers={'Cache-Control': 'no-cache'})
+        assert r.status_code == 200
+    assert len(llamadas) == 8
+    # ... y pide al generador que tampoco use su caché de completions
+    assert frescos == [False] * 2 + [True] * 6
+
+    # /generar-articulos siempre genera contenido nuevo, y los exports sirven
+    # después ese mismo lote
+    r = client.post('/generar-articulos', json=payload)
+    assert r.status_code == 200 and len(llamadas) == 10
+    client.post('/generar-articulos', json=payload)
+    assert len(llamadas) == 12 and all(frescos[8:])
+    r = client.post('/export/wp-all-import/file', json=payload)
+    assert r.status_code == 200 and 'etag' in r.headers
+    assert len(llamadas) == 12
+
+    # "forzar" en el cuerpo equivale a Cache-Control: no-cache
+    r = client.post('/export/wp-all-import', json=dict(payload, forzar=True))
+    assert r.status_code == 200 and len(llamadas) == 14 and all(frescos[12:])
+
+
+def test_lote_cache_ttl_y_lru():
+    mod = fe_module
+    ahora = [0.0]
+    cache = mod.LoteCache(max_entries=2, ttl=10, clock=lambda: ahora[0])
+    lote = mod.LoteResponse(articulos=[mod.Articulo(titulo='t', subtitulo='', articulo='x')])
+    assert cache.set('a', lote) and cache.set('b', lote)
+    assert cache.get('a') is not None
+    cache.set('c', lote)  # expulsa 'b', el menos usado
+    assert cache.get('b') is None and cache.evictions == 1
+    ahora[0] = 11
+    assert cache.get('a') is None
+    # Lotes parciales no se cachean
+    parcial = mod.LoteResponse(articulos=[mod.Articulo(titulo='t', subtitulo='', articulo='', error='x')])
+    assert cache.set('d', parcial) is None and cache.get('d') is None
+
+
+def test_keyword_matcher_tildes_plurales_y_frases():
+    mod = fe_module
+    m = mod.KeywordMatcher('Jabón orgánico')
+    assert m.match('Pack de 3 jabones ORGANICOS de avena')
+    assert m.match('Jabon natural')
+    assert not m.match('Champú sólido')
+
+    frase = mod.KeywordMatcher('"robot aspirador"')
+    assert frase.match('Robot Aspiradora con mopa')
+    assert not frase.match('Aspirador de mano para robot de cocina')
+
+    mixto = mod.KeywordMatcher('"robot aspirador" cafetera')
+    assert mixto.match('Cafetera espresso')
+    assert not mod.KeywordMatcher('  ')
+
+
+def _producto(n, precio_amount=10.0, ahorro_pct=None, marca='Marca', titulo=None):
+    return fe_module.Producto(
+        titulo=titulo or f'Auriculares Producto {n}', url_producto='u', url_afiliado='u', asin=f'A{n}',
+        marca=marca, precio_amount=precio_amount, ahorro_pct=ahorro_pct,
+        tiene_descuento=bool(ahorro_pct),
+    )
+
+
+def _ranking(productos, keyword='', max_total=10, black_friday=False, **pesos):
+    mod = fe_module
+    return [p.asin for p in mod.rankear_productos(
+        productos, mod.KeywordMatcher(keyword), max_total, black_friday, {**mod.RANKING_PESOS, **pesos})]
+
+
+def test_ranking_fallback_black_friday():
+    sin_precio = _producto(2, precio_amount=None)
+    productos = [_producto(1), sin_precio, _producto(3)]
+    # Sin descuentos: en Black Friday entran los que tienen precio, en el orden de PAAPI
+    assert _ranking(productos, black_friday=True) == ['A1', 'A3']
+    # Fuera de Black Friday no hay fallback
+    assert _ranking(productos) == []
+    # Con algún descuento solo entran los rebajados, también en Black Friday
+    con_desc = productos + [_producto(4, ahorro_pct=10)]
+    assert _ranking(con_desc, black_friday=True) == ['A4']
+    # Si el rebajado no casa con la clave no se vuelve al fallback
+    otro = _producto(5, ahorro_pct=30, titulo='Cafetera espresso')
+    assert _ranking(productos + [otro], keyword='auriculares', black_friday=True) == []
+
+
+def test_ranking_descuento_marca_y_top_k():
+    productos = [
+        _producto(1, ahorro_pct=10, marca='Sony'),
+        _producto(2, ahorro_pct=10, marca='Sony'),
+        _producto(3, ahorro_pct=50, marca='Sony'),
+        _producto(4, ahorro_pct=10, marca='JBL'),
+    ]
+    # Más descuento primero; la segunda Sony cede el sitio a JBL
+    assert _ranking(productos, max_total=3) == ['A3', 'A1', 'A4']
+    # Sin penalización por marca manda la posición en PAAPI
+    assert _ranking(productos, max_total=3, marca=0.0) == ['A3', 'A1', 'A2']
+    # Con peso de descuento 0, la posición decide
+    assert _ranking(productos, max_total=2, descuento=0.0, marca=0.0) == ['A1', 'A2']
+
+
+
+def test_ranking_ordenacion_y_heap_coinciden():
+    import random
+
+    rnd = random.Random(7)
+    productos = [
+        _producto(i, ahorro_pct=rnd.choice([None, 5, 15, 30, 55]), marca=rnd.choice(['Sony', 'JBL', 'Bose', None]),
+                  precio_amount=None if i % 7 == 0 else 20.0 + i % 9)
+        for i in range(200)
+    ]
+    completo = _ranking(productos, max_total=len(productos))
+    # Con pocos elegidos se usa el heap: debe dar el mismo prefijo que la ordenación
+    for k in (1, 5, 20, 49, 60):
+        assert _ranking(productos, max_total=k) == completo[:k]
+    # Ahorro derivado de precio de lista sin porcentaje
+    derivado = fe_module.Producto(titulo='Auriculares X', url_producto='u', url_afiliado='u', asin='D',
+                                  precio_amount=60.0, ahorro_amount=40.0, precio_lista_amount=100.0)
+    assert _ranking([_producto(1, ahorro_pct=10), derivado], max_total=2) == ['D', 'A1']
+
+def test_sobrepedido_adaptativo_por_busqueda(monkeypatch):
+    import asyncio
+
+    mod = fe_module
+    llamadas = []
+
+    async def buscar(busqueda, categoria, total, pagina_inicial=1):
+        llamadas.append((pagina_inicial, total))
+        base = (pagina_inicial - 1) * 10
+        # Solo 1 de cada 5 productos tiene descuento
+        return [_producto(base + i, ahorro_pct=20.0 if (base + i) % 5 == 0 else None) for i in range(total)]
+
+    monkeypatch.setattr(mod, 'buscar_productos', buscar)
+    monkeypatch.setattr(mod, 'rendimiento_busquedas', mod.RendimientoBusquedas(0.5, 1.0, 10))
+    req = mod.LoteRequest(busqueda='auriculares', num_articulos=2, items_por_articulo=5)
+
+    grupos = asyncio.run(mod.seleccionar_grupos(req))
+    assert sum(len(g) for g in grupos) == 10
+    # Con el rendimiento inicial (0.5) la primera ronda se queda corta y se piden más páginas seguidas
+    assert llamadas == [(1, 30), (4, 30)]
+
+    # El siguiente lote de la misma búsqueda ya sabe que rinde 1/5 y acierta a la primera
+    llamadas.clear()
+    asyncio.run(mod.seleccionar_grupos(req))
+    assert llamadas == [(1, 60)]
+
+    # Sin resultados suficientes se para cuando PAAPI deja de devolver páginas llenas
+    async def escasa(busqueda, categoria, total, pagina_inicial=1):
+        llamadas.append((pagina_inicial, total))
+        return [_producto(i, ahorro_pct=20.0) for i in range(3)]
+
+    monkeypatch.setattr(mod, 'buscar_productos', escasa)
+    llamadas.clear()
+    grupos = asyncio.run(mod.seleccionar_grupos(mod.LoteRequest(busqueda='otra', num_articulos=2, items_por_articulo=5)))
+    assert sum(len(g) for g in grupos) == 3 and len(llamadas) == 1
+
+
+def test_sobrepedido_continua_paginas_contra_api_paapi(monkeypatch):
+    import asyncio
+    import httpx
+
+    mod = fe_module
+    pedidas = []
+
+    def handler(request):
+        pagina = int(request.url.params['pagina'])
+        n = int(request.url.params['num_resultados'])
+        pedidas.append(pagina)
+        # Solo 1 de cada 5 productos tiene descuento
+        data = [{'asin': f'A{k}', 'titulo': f'Auriculares {k}', 'url_producto': 'u', 'url_afiliado': 'u',
+                 'precio_amount': 10.0, 'ahorro_pct': 20.0 if k % 5 == 0 else None, 'tiene_descuento': k % 5 == 0}
+                for k in range((pagina - 1) * n, pagina * n)]
+        return httpx.Response(200, json=data)
+
+    cliente_original = httpx.AsyncClient
+    monkeypatch.setattr(mod.httpx, 'AsyncClient',
+                        lambda **kw: cliente_original(transport=httpx.MockTransport(handler), **kw))
+    monkeypatch.setattr(mod, 'rendimiento_busquedas', mod.RendimientoBusquedas(0.5, 1.0, 10))
+    req = mod.LoteRequest(busqueda='auriculares', num_articulos=2, items_por_articulo=5)
+
+    grupos = asyncio.run(mod.seleccionar_grupos(req))
+    asins = [p.asin for g in grupos for p in g]
+    # La segunda ronda sigue en la página 4, sin repetir productos de la primera
+    assert sorted(pedidas) == [1, 2, 3, 4, 5, 6]
+    assert len(asins) == 10 and len(set(asins)) == 10
+    assert all(int(a[1:]) % 5 == 0 for a in asins)
+    assert mod.rendimiento_busquedas.stats()['paginas'] == 6
+    assert mod.rendimiento_busquedas.stats()['rondas_extra'] == 1
+
+
+def test_continuacion_con_fake_de_paginas(monkeypatch):
+    import asyncio
+
+    mod = fe_module
+    llamadas = []
+
+    async def buscar(busqueda, categoria, total, pagina_inicial=1):
+        llamadas.append((pagina_inicial, total))
+        productos = await _fake_buscar_productos(busqueda, categoria, total, pagina_inicial)
+        # Solo 1 de cada 3 tiene descuento
+        for i, p in enumerate(productos, start=(pagina_inicial - 1) * 10 + 1):
+            p.tiene_descuento = i % 3 == 0
+            p.ahorro_pct = 20.0 if p.tiene_descuento else None
+        return productos
+
+    monkeypatch.setattr(mod, 'buscar_productos', buscar)
+    monkeypatch.setattr(mod, 'rendimiento_busquedas', mod.RendimientoBusquedas(1.0, 1.0, 10))
+    grupos = asyncio.run(mod.seleccionar_grupos(
+        mod.LoteRequest(busqueda='auriculares', num_articulos=2, items_por_articulo=5)))
+    titulos = [p.titulo for g in grupos for p in g]
+    assert llamadas == [(1, 20), (3, 20)]
+    assert len(set(titulos)) == 10 and 'Auriculares Producto 21' in titulos